@@ -0,0 +1,74 @@
+"""Time register allocation of many functions with each allocator.
+
+The functions are compiled and desugared first, only allocating their registers is timed.
+
+usage: python benchmarks/bench_allocate.py [function count] [register count]
+"""
+
+import sys
+sys.path.append("")  # lookup modules in the cwd
+
+import copy
+import time
+
+from wewcompiler.backend.rustvm.assemble import allocators
+from wewcompiler.backend.rustvm.desugar import DesugarIR_Pre
+from wewcompiler.objects import base, parse_source
+from wewcompiler.objects.base import FunctionDecl
+
+template = """
+fn template(a: u8, b: u8) -> u8 {
+    var c := a * 3 + b;
+    var d := (a << 2) ^ (b | c);
+    var arr: [u8] = {a, b, c, d, a * b, c * d};
+    while c > 0 {
+        if c % 2 == 0 {
+            d = d + c * a - b * arr[c % 6];
+        } else {
+            d = d - (c + a) / 2 + (arr[0] * arr[1] + arr[2] * arr[3]) * (arr[4] + arr[5]);
+        }
+        c = c - 1;
+    }
+    return c + d + 100000;
+}
+"""
+
+
+def make_functions(count: int):
+    """Compile copies of a template function and desugar them ready for allocation."""
+    fn, = parse_source(template)
+
+    functions = []
+    for n in range(count):
+        copied = copy.deepcopy(fn)
+        copied.name = f"f{n}"
+        functions.append(copied)
+
+    compiler = base.Compiler()
+    compiler.compile(functions)
+
+    functions = [i for i in compiler.compiled_objects if isinstance(i, FunctionDecl)]
+    for i in functions:
+        DesugarIR_Pre.desugar(i)
+
+    return functions
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    reg_count = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    for name, allocator in allocators.items():
+        functions = make_functions(count)
+        instructions = sum(len(i.code) for i in functions)
+
+        start = time.perf_counter()
+        for i in functions:
+            allocator(reg_count, i.code)
+        taken = time.perf_counter() - start
+
+        print(f"{name:>16}: {taken:.2f}s, {instructions / taken:.0f} instructions/sec")
+
+
+if __name__ == '__main__':
+    main()
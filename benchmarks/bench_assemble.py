@@ -0,0 +1,74 @@
+"""Time assembly of a large program, against packing each object to bytes separately.
+
+The program is the synthetic one from bench_package.py. Programs this large don't fit in the
+address space of the vm, so the locations it references are wrapped around to fit in a parameter.
+
+usage: python benchmarks/bench_assemble.py [instruction count] [runs]
+"""
+
+import sys
+sys.path.append("")  # lookup modules in the cwd
+
+import time
+
+from benchmarks.bench_package import make_program
+from wewcompiler.backend.rustvm import encoder
+from wewcompiler.backend.rustvm.assemble import package_objects, assemble_instructions, assemble_single
+from wewcompiler.objects import ir_object
+
+
+def pack_each(packed_instructions):
+    """Assemble by packing every opcode and parameter to bytes."""
+    assembled = bytearray()
+
+    for i in packed_instructions:
+        if isinstance(i, encoder.HardWareInstruction):
+            assembled.extend(encoder.pack_instruction(i))
+            for arg in i.args:
+                assembled.extend(assemble_single(arg))
+        else:
+            assembled.extend(assemble_single(i))
+
+    return assembled
+
+
+def wrap(arg):
+    """Wrap the locations referenced by an argument into the range of a parameter."""
+    if isinstance(arg, encoder.HardwareMemoryLocation):
+        return encoder.HardwareMemoryLocation(arg.index & 0x3fff)
+    if isinstance(arg, ir_object.Immediate):
+        arg.val &= 0x3fff
+    if isinstance(arg, ir_object.Dereference):
+        wrap(arg.to)
+    return arg
+
+
+def best_time(fn, packed, runs: int):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn(packed)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    _, packed = package_objects(*make_program(count))
+    for i in packed:
+        if isinstance(i, encoder.HardWareInstruction):
+            i.args = tuple(map(wrap, i.args))
+
+    each_time, each = best_time(pack_each, packed, runs)
+    direct_time, direct = best_time(assemble_instructions, packed, runs)
+    assert each == direct, "assembled binaries differ"
+
+    print(f"{count} instructions, {len(direct)} bytes")
+    print(f"  packing each object: {each_time:.3f}s")
+    print(f"  assembling directly: {direct_time:.3f}s ({each_time / direct_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
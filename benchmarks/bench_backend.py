@@ -0,0 +1,65 @@
+"""Time the backend over many functions with different numbers of jobs.
+
+Programs this large don't fit in the address space of the vm, so they're processed but not assembled.
+
+usage: python benchmarks/bench_backend.py [function count] [jobs...]
+"""
+
+import sys
+sys.path.append("")  # lookup modules in the cwd
+
+import copy
+import time
+
+from wewcompiler.backend.rustvm.assemble import process_code
+from wewcompiler.objects import base, parse_source
+
+template = """
+fn template(a: u8, b: u8) -> u8 {
+    var c := a * 3 + b;
+    var d := (a << 2) ^ (b | c);
+    while c > 0 {
+        if c % 2 == 0 {
+            d = d + c * a - b;
+        } else {
+            d = d - (c + a) / 2;
+        }
+        c = c - 1;
+    }
+    return c + d + 100000;
+}
+
+fn main() {}
+"""
+
+
+def make_program(count: int):
+    """Parse a template function once and copy it out under different names."""
+    fn, main = parse_source(template)
+
+    functions = []
+    for n in range(count):
+        copied = copy.deepcopy(fn)
+        copied.name = f"f{n}"
+        functions.append(copied)
+
+    return [*functions, main]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    all_jobs = [int(i) for i in sys.argv[2:]] or [1, 2, 4]
+
+    for jobs in all_jobs:
+        compiler = base.Compiler()
+        compiler.compile(make_program(count))
+
+        start = time.perf_counter()
+        process_code(compiler, 10, jobs)
+        taken = time.perf_counter() - start
+
+        print(f"{jobs:>3} jobs: {taken:.2f}s, {count / taken:.0f} functions/sec")
+
+
+if __name__ == '__main__':
+    main()
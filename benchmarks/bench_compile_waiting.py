@@ -0,0 +1,55 @@
+"""Time compiling many functions that reference each other before they're declared.
+
+The functions are built directly rather than parsed so that only the compiler is measured.
+
+usage: python benchmarks/bench_compile_waiting.py [function count]
+"""
+
+import sys
+sys.path.append("")  # lookup modules in the cwd
+
+import time
+
+from wewcompiler.objects import base, types
+from wewcompiler.objects.literals import Identifier, IntegerLiteral
+from wewcompiler.objects.operations import FunctionCallOp
+from wewcompiler.objects.statements import ReturnStmt
+
+
+def make_functions(count: int):
+    """Make groups of functions that reference each other.
+
+    The compiler takes objects from the end of the list. Each `g` calls a `k` that
+    is compiled last (and that calls the `g` back), so every `g` waits while the
+    `h` functions in between finish. The waiting list grows to a third of the program.
+    """
+    def fn(name: str, *calls: str) -> base.FunctionDecl:
+        body = [FunctionCallOp(Identifier(i), []) for i in calls]
+        return base.FunctionDecl(name, [], types.Int("u8"), False,
+                                 [*body, ReturnStmt(IntegerLiteral(0))])
+
+    n = count // 3
+
+    functions = [fn(f"k{i}", f"g{i}") for i in range(n)]
+    for i in range(n):
+        functions.append(fn(f"g{i}", f"k{i}", f"h{i}"))
+        functions.append(fn(f"h{i}", f"h{(i + 1) % n}"))
+    return functions
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+
+    for size in (count // 4, count // 2, count):
+        functions = make_functions(size)
+        compiler = base.Compiler()
+
+        start = time.perf_counter()
+        compiler.compile(functions)
+        taken = time.perf_counter() - start
+
+        print(f"{size:>6} functions: {taken:.2f}s, {size / taken:.0f} functions/sec")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Time building diagnostics for many nodes of a large file.
+
+usage: python benchmarks/bench_diagnostics.py [line count] [function count]
+"""
+
+import sys
+sys.path.append("")  # lookup modules in the cwd
+
+import time
+
+from wewcompiler.objects import parse_source
+
+
+def make_source(lines: int, functions: int) -> str:
+    """Generate a file of functions spread out by comments."""
+    fn = """fn f{n}(a: u8) -> u8 {{
+    var b := a * {n};
+    b = b + f{m}(a);
+    return b;
+}}
+"""
+    fn_lines = fn.count("\n")
+    padding = "// padding\n" * max(lines // functions - fn_lines, 0)
+
+    return "".join(padding + fn.format(n=n, m=max(n - 1, 0)) for n in range(functions))
+
+
+def nodes(decls):
+    """Every function and statement of the file."""
+    for decl in decls:
+        yield decl
+        yield from decl.body
+
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    fn_count = int(sys.argv[2]) if len(sys.argv) > 2 else 250
+
+    src = make_source(line_count, fn_count)
+
+    start = time.perf_counter()
+    decls = parse_source(src)
+    print(f"parsed {src.count(chr(10))} lines in {time.perf_counter() - start:.2f}s")
+
+    targets = list(nodes(decls))
+
+    start = time.perf_counter()
+    errors = [str(i.error("benchmark error")) for i in targets]
+    taken = time.perf_counter() - start
+    print(f"{len(errors)} errors in {taken:.2f}s, {len(errors) / taken:.0f} errors/sec")
+
+    start = time.perf_counter()
+    identifiers = [i.identifier for i in targets]
+    taken = time.perf_counter() - start
+    print(f"{len(identifiers)} identifiers in {taken:.2f}s, {len(identifiers) / taken:.0f} identifiers/sec")
+
+
+if __name__ == '__main__':
+    main()
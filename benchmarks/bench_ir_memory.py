@@ -0,0 +1,79 @@
+"""Measure the memory used by the IR of a large program.
+
+The code is made as IR directly, in the shapes the frontend emits for loops over variables,
+as programs this large take too long to parse. The memory the instructions hold is traced
+once they're made, and again once their registers are allocated.
+
+usage: python benchmarks/bench_ir_memory.py [loops] [register count]
+"""
+
+import sys
+sys.path.append("")  # lookup modules in the cwd
+
+import tracemalloc
+
+from wewcompiler.backend.rustvm.register_allocate import allocate
+from wewcompiler.objects import ir_object, types
+from wewcompiler.objects.ir_object import Register, Immediate
+from wewcompiler.objects.variable import Variable
+
+
+def make_code(loops: int):
+    """Make the IR of a function of loops like `while i < 10 { total = total + i * 3; i = i + 1; }`."""
+    total = Variable("total", types.Int.fromsize(2), stack_offset=0)
+    i = Variable("i", types.Int.fromsize(2), stack_offset=2)
+
+    regs = iter(range(10 ** 9))
+
+    def reg() -> Register:
+        return Register(next(regs), 2)
+
+    code = []
+    for _ in range(loops):
+        start, end = ir_object.JumpTarget(), ir_object.JumpTarget()
+        a, b, c, d, e, f = (reg() for _ in range(6))
+
+        code += [
+            start,
+            ir_object.LoadVar(i, a),
+            ir_object.Mov(b, Immediate(10, 2)),
+            ir_object.Compare(a, b),
+            ir_object.SetCmp(c, ir_object.CompType.geq),
+            ir_object.Jump(end, c),
+            ir_object.LoadVar(total, d),
+            ir_object.LoadVar(i, e),
+            ir_object.Binary.mul(e, Immediate(3, 2)),
+            ir_object.Binary.add(d, e),
+            ir_object.SaveVar(total, d),
+            ir_object.LoadVar(i, f),
+            ir_object.Binary.add(f, Immediate(1, 2)),
+            ir_object.SaveVar(i, f),
+            ir_object.Jump(start),
+            end,
+        ]
+
+    return code
+
+
+def main():
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    reg_count = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    tracemalloc.start()
+
+    before = tracemalloc.get_traced_memory()[0]
+    code = make_code(loops)
+    made = tracemalloc.get_traced_memory()[0]
+
+    allocate(reg_count, code)
+    allocated = tracemalloc.get_traced_memory()[0]
+
+    tracemalloc.stop()
+
+    print(f"{len(code)} instructions, {reg_count} registers")
+    print(f"made:      {(made - before) / len(code):.1f} bytes per instruction")
+    print(f"allocated: {(allocated - before) / len(code):.1f} bytes per instruction")
+
+
+if __name__ == '__main__':
+    main()
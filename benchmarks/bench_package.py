@@ -0,0 +1,84 @@
+"""Time packaging of a large program into the objects of the binary.
+
+The program is made of hardware instructions directly, as programs this large take too long
+to compile and don't fit in the address space of the vm.
+
+usage: python benchmarks/bench_package.py [instruction count] [runs]
+"""
+
+import sys
+sys.path.append("")  # lookup modules in the cwd
+
+import time
+
+from wewcompiler.backend.rustvm import encoder
+from wewcompiler.backend.rustvm.assemble import package_objects
+from wewcompiler.objects import base, ir_object
+from wewcompiler.objects.variable import DataReference
+
+#: Instructions in each function of the program.
+function_size = 50
+
+
+def make_function(n: int, function_count: int):
+    """Make a function that loops over a mix of register moves, global loads and calls."""
+    reg = ir_object.AllocatedRegister(2, physical_register=0)
+
+    start = ir_object.JumpTarget()
+    start.index = 0
+    end = ir_object.JumpTarget()
+    end.index = 1
+
+    code = [start]
+    for i in range(function_size - 3):
+        if i % 8 == 0:
+            code.append(encoder.HardWareInstruction(encoder.Mem.call, 2,
+                                                    (DataReference(f"f{(n + i) % function_count}"),)))
+        elif i % 4 == 0:
+            code.append(encoder.HardWareInstruction(encoder.Manip.mov, 2,
+                                                    (ir_object.Dereference(DataReference(f"raw-data-{i % 16}"), 2),
+                                                     reg)))
+        else:
+            code.append(encoder.HardWareInstruction(encoder.BinaryInstructions.add, 2,
+                                                    (reg, ir_object.Immediate(i, 2), reg)))
+
+    code.append(encoder.HardWareInstruction(encoder.Manip.jmp, 2, (reg, end)))
+    code.append(encoder.HardWareInstruction(encoder.Manip.jmp, 2, (ir_object.Immediate(1, 2), start)))
+    code.append(end)
+    code.append(encoder.HardWareInstruction(encoder.Mem.ret, 2, ()))
+
+    return f"f{n}", code
+
+
+def make_program(count: int):
+    compiler = base.Compiler()
+    for i in range(16):
+        compiler.add_bytes(i.to_bytes(2, "little"))
+
+    function_count = max(count // function_size, 1)
+    functions = [make_function(n, function_count) for n in range(function_count)]
+
+    toplevel = [encoder.HardWareInstruction(encoder.Mem.call, 2, (DataReference("f0"),)),
+                encoder.HardWareInstruction(encoder.Manip.halt, 2, ())]
+
+    return compiler, functions, toplevel
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    times = []
+    for _ in range(runs):
+        # packaging resolves references in place, so each run needs a fresh program
+        compiler, functions, toplevel = make_program(count)
+
+        start = time.perf_counter()
+        package_objects(compiler, functions, toplevel)
+        times.append(time.perf_counter() - start)
+
+    print(f"{count} instructions: best {min(times):.3f}s, mean {sum(times) / runs:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
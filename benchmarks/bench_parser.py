@@ -0,0 +1,51 @@
+"""Compare the throughput of the generated parser and the precedence climbing parser.
+
+usage: python benchmarks/bench_parser.py [function count]
+"""
+
+import sys
+sys.path.append("")  # lookup modules in the cwd
+
+import time
+
+from wewcompiler.objects import parse_source
+
+
+def make_source(count: int) -> str:
+    """Generate a file of functions that are mostly arithmetic."""
+    fn = """
+fn f{n}(a: u8, b: u8) -> u8 {{
+    var c := a * 2 + b / 3 - {n} % 7;
+    var d := (a << 1) | (b >> 2) & c ^ {n};
+    if a < b and c >= d or a == {n} {{
+        c = c + d * (a - b) + f{m}(c, d);
+    }}
+    while c > 0 {{
+        c = c - 1;
+        d = d + a * b - c / 2;
+    }}
+    return c + d;
+}}
+"""
+    return "".join(fn.format(n=n, m=max(n - 1, 0)) for n in range(count))
+
+
+def bench(src: str, pratt: bool) -> float:
+    start = time.perf_counter()
+    parse_source(src, pratt)
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    src = make_source(count)
+    lines = src.count("\n")
+
+    print(f"{lines} lines")
+    for name, pratt in (("generated", False), ("precedence climbing", True)):
+        taken = bench(src, pratt)
+        print(f"{name:>20}: {taken:.2f}s, {lines / taken:.0f} lines/sec")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Compare the register allocators on the examples.
+
+For each example the spill, reload and rematerialise instructions inserted by each allocator
+are counted, along with the size of the binary. The standard library is compiled in, as it is by the compiler.
+
+usage: python benchmarks/bench_regalloc.py [register count] [examples...]
+"""
+
+import sys
+sys.path.append("")  # lookup modules in the cwd
+
+import copy
+import glob
+
+from tatsu.exceptions import FailedParse
+
+from wewcompiler.backend.rustvm import assemble_instructions, parse_stdlib
+from wewcompiler.backend.rustvm.assemble import process_code, allocators
+from wewcompiler.backend.rustvm.register_allocate import Spill, Load, Rematerialise
+from wewcompiler.objects import base, parse_source
+from wewcompiler.objects.errors import CompileException
+
+
+def measure(source: str, stdlib, reg_count: int, regalloc: str):
+    """Compile a program.
+
+    :returns: The number of spills, reloads and rematerialisations and the size of the binary.
+    """
+    compiler = base.Compiler()
+    compiler.compile(parse_source(source) + copy.deepcopy(stdlib))
+    _, code = process_code(compiler, reg_count, regalloc=regalloc)
+
+    pre_instructions = [j for obj in compiler.compiled_objects for i in obj.code for j in i.pre_instructions]
+    spills = sum(isinstance(i, Spill) for i in pre_instructions)
+    loads = sum(isinstance(i, Load) for i in pre_instructions)
+    remats = sum(isinstance(i, Rematerialise) for i in pre_instructions)
+
+    return spills, loads, remats, len(assemble_instructions(code))
+
+
+def main():
+    reg_count = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    examples = sys.argv[2:] or sorted(glob.glob("examples/*.wew"))
+
+    stdlib = parse_stdlib()
+    totals = {name: [0, 0, 0, 0] for name in allocators}
+
+    print(f"{reg_count} registers, spills/reloads/remats/bytes")
+    print(f"{'example':<40}" + "".join(f"{name:>24}" for name in allocators))
+
+    for path in examples:
+        with open(path) as f:
+            source = f.read()
+
+        try:
+            results = {name: measure(source, stdlib, reg_count, name) for name in allocators}
+        except (CompileException, FailedParse):
+            # some of the examples are there to show errors
+            continue
+
+        print(f"{path:<40}" + "".join(f"{'/'.join(map(str, result)):>24}" for result in results.values()))
+
+        for name, result in results.items():
+            totals[name] = [a + b for a, b in zip(totals[name], result)]
+
+    print(f"{'total':<40}" + "".join(f"{'/'.join(map(str, total)):>24}" for total in totals.values()))
+
+
+if __name__ == '__main__':
+    main()
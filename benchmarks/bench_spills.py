@@ -0,0 +1,55 @@
+"""Time register allocation of code that spills thousands of registers.
+
+The code has the shape of the nested multiplication in examples/example_force_spill.py,
+each operand is loaded into a register before the ones inside it, so all of them are live
+at once. It's made as IR directly, as expressions this deep take too long to parse.
+
+usage: python benchmarks/bench_spills.py [depth] [register count] [runs]
+"""
+
+import sys
+sys.path.append("")  # lookup modules in the cwd
+
+import time
+
+from wewcompiler.backend.rustvm.register_allocate import allocate, Spill, Load
+from wewcompiler.objects import ir_object
+
+
+def make_code(depth: int):
+    """Make the IR of (1 * (2 * (3 * ... (depth - 1 * depth))))."""
+    regs = [ir_object.Register(n, 2) for n in range(depth)]
+
+    code = [ir_object.Mov(reg, ir_object.Immediate(n + 1, 2)) for n, reg in enumerate(regs)]
+    for left, right in zip(reversed(regs[:-1]), reversed(regs[1:])):
+        code.append(ir_object.Binary.mul(left, right))
+    code.append(ir_object.Return(None, regs[0]))
+
+    return code
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    reg_count = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    times = []
+    for _ in range(runs):
+        # allocation marks the code in place, so each run needs fresh code
+        code = make_code(depth)
+
+        start = time.perf_counter()
+        state = allocate(reg_count, code)
+        times.append(time.perf_counter() - start)
+
+    pre_instructions = [j for i in code for j in i.pre_instructions]
+    spills = sum(isinstance(i, Spill) for i in pre_instructions)
+    loads = sum(isinstance(i, Load) for i in pre_instructions)
+
+    print(f"depth {depth}, {reg_count} registers: {spills} spills, {loads} loads, "
+          f"{state.spill_slot_count} spill slots")
+    print(f"best {min(times):.3f}s, mean {sum(times) / runs:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
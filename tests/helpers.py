@@ -1,11 +1,24 @@
 from typing import Callable, TypeVar
 
+from wewcompiler.backend.rustvm.desugar import DesugarIR_Pre
+from wewcompiler.objects import compile_source
+from wewcompiler.objects.base import FunctionDecl
+
 
 def emptyfn(body: str, return_type: str="u1") -> str:
     """Wrap body inside of an empty function"""
     return f"fn test() -> {return_type} {{{body}}}"
 
 
+def compile_function(source: str, name: str="main", desugar: bool=True) -> FunctionDecl:
+    """Compile source and get the function called name, desugared ready for the backend if desugar is true."""
+    compiler = compile_source(source)
+    fn = next(i for i in compiler.compiled_objects if isinstance(i, FunctionDecl) and i.identifier == name)
+    if desugar:
+        DesugarIR_Pre.desugar(fn)
+    return fn
+
+
 RT = TypeVar('RT')
 
 
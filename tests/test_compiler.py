@@ -1,8 +1,25 @@
-from wewcompiler.backend.rustvm import compile_and_pack
+import pickle
+
+from wewcompiler.backend.rustvm import assemble, assemble_instructions, compile_and_pack, encoder, parse_stdlib
+from wewcompiler.backend.rustvm.assemble import (assemble_single, detach_jump_targets, optimise_function,
+                                                 process_code, process_function)
+from wewcompiler.backend.rustvm.cfg import ControlFlowGraph, function_cfg
+from wewcompiler.backend.rustvm.constant_propagation import fold_binary, fold_compare, fold_unary, propagate_constants
+from wewcompiler.backend.rustvm.dead_code import eliminate_dead_code
+from wewcompiler.backend.rustvm.desugar import DesugarIR_Pre
+from wewcompiler.backend.rustvm.graph_colouring import graph_colour
+from wewcompiler.backend.rustvm.register_allocate import allocate, mark_last_usages, Load, Rematerialise, Spill
+from wewcompiler.backend.rustvm.ssa import Phi, from_ssa, to_ssa
+from wewcompiler.objects import base, compile_source, ir_object, parse_source
+from wewcompiler.objects.base import FunctionDecl
 from wewcompiler.objects.errors import CompileException
+from wewcompiler.objects.ir_object import (Binary, Compare, CompType, Dereference, Immediate,
+                                           Jump, JumpTarget, Mov, Register, Return, SetCmp)
+from wewcompiler.utils import cache as cache_module
+from wewcompiler.utils.cache import ArtifactCache
 
 from pytest import raises
-from tests.helpers import emptyfn, for_feature
+from tests.helpers import compile_function, emptyfn, for_feature
 
 
 def compile(inp: str):
@@ -641,3 +658,616 @@ def test_call_nonfn():
 
     with raises(CompileException):
         compile(decl)
+
+
+@for_feature(functions="Functions")
+def test_forward_references():
+    """Make sure objects waiting on a name are woken when it's declared."""
+    decl = """
+    fn a() -> u8 { return b() + c(); }
+    fn b() -> u8 { return c() + d; }
+    fn c() -> u8 { return a() + b(); }
+    var d := 4;
+    """
+
+    _, compiler = compile(decl)
+    assert not compiler.waiting_coros
+    assert {"a", "b", "c", "main"} <= {i.identifier for i in compiler.compiled_objects}
+
+
+def test_stdlib_cache(tmp_path):
+    """Make sure the stdlib loaded from the cache compiles the same as a freshly parsed one."""
+
+    cache = ArtifactCache(str(tmp_path))
+
+    def build(stdlib):
+        compiler = base.Compiler()
+        compiler.compile(parse_source('fn main() { std.printf("%u8\\n", 4); }') + stdlib)
+        _, code = process_code(compiler, 10)
+        return assemble_instructions(code)
+
+    fresh = build(parse_stdlib(cache))
+    assert list((tmp_path / "stdlib").iterdir())
+
+    cached = build(parse_stdlib(cache))
+    assert fresh == cached
+
+
+def test_cache_unwritable(tmp_path):
+    """Make sure a cache that can't be written to is skipped instead of failing the compile."""
+
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+
+    cache = ArtifactCache(str(blocker / "wewcompiler"))
+    assert parse_stdlib(cache)
+
+    assert cache.skipped["stdlib"] == 1
+    assert cache.load("stdlib", "missing") is None
+
+
+def test_cache_key_sources(monkeypatch):
+    """Make sure changing the sources of the compiler changes the keys of what it caches."""
+
+    before = cache_module.cache_key(b"content")
+    assert cache_module.cache_key(b"content") == before
+
+    monkeypatch.setattr(cache_module, "compiler_fingerprint", lambda: b"changed")
+    assert cache_module.cache_key(b"content") != before
+
+
+def test_parallel_backend():
+    """Make sure running the backend for functions in worker processes doesn't change the binary."""
+
+    decl = "".join(f"""
+    fn f{i}(a: u8) -> u8 {{
+        var b := a * {i} + 40000;  // large immediates are moved into data
+        while b > {i} {{
+            b = b - 70000;
+        }}
+        return b;
+    }}
+    """ for i in range(6)) + "fn main() { f0(1); f5(2); }"
+
+    def build(jobs):
+        _, code = process_code(compile_source(decl), 10, jobs)
+        return assemble_instructions(code)
+
+    assert build(1) == build(3)
+
+
+def test_parallel_backend_allocates_once(tmp_path, monkeypatch):
+    """Make sure functions allocated in worker processes are encoded there instead of being allocated again."""
+
+    log = tmp_path / "allocated"
+    allocate_function = assemble.allocate_function
+
+    def logged(fn, *args):
+        # the workers are forked, so they share the log but not anything in memory
+        with open(log, "a") as f:
+            f.write(f"{fn.identifier}\n")
+        return allocate_function(fn, *args)
+
+    monkeypatch.setattr(assemble, "allocate_function", logged)
+
+    decl = "".join(f"fn f{i}(a: u8) -> u8 {{ return a * {i}; }}" for i in range(6)) + "fn main() { f0(1); }"
+    assemble.process_code(compile_source(decl), 10, 3)
+
+    allocated = log.read_text().split()
+    assert sorted(allocated) == sorted(set(allocated))
+    assert {f"f{i}" for i in range(6)} <= set(allocated)
+
+
+def test_incremental_backend(tmp_path, monkeypatch):
+    """Make sure only functions that changed, or that reference globals that changed, are rebuilt,
+    and that everything is rebuilt once the compiler changes."""
+
+    def program(a_body, g_type):
+        return f"""
+        var g: {g_type};
+        fn a() -> u8 {{ {a_body} }}
+        fn b() -> u8 {{ return g + 1; }}
+        fn c() -> u8 {{ return 3; }}
+        fn main() {{ a(); b(); c(); }}
+        """
+
+    def build(src):
+        cache = ArtifactCache(str(tmp_path))
+        _, code = process_code(compile_source(src), 10, cache=cache)
+        _, fresh = process_code(compile_source(src), 10)
+        assert assemble_instructions(code) == assemble_instructions(fresh)
+        return cache.hits["usage"] + cache.hits["function"], cache.misses["function"]
+
+    assert build(program("return 1;", "u8")) == (0, 4)
+    assert build(program("return 1;", "u8")) == (8, 0)
+    assert build(program("return 2;", "u8")) == (6, 1)
+    assert build(program("return 2;", "u4")) == (6, 1)
+
+    monkeypatch.setattr(cache_module, "compiler_fingerprint", lambda: b"changed")
+    assert build(program("return 2;", "u4")) == (0, 4)
+
+
+def test_deterministic_artifacts():
+    """Make sure compiling the same source twice gives identical IR and encoded functions."""
+
+    decl = """
+    var g := 3;
+    fn f(a: u8) -> u8 {
+        var b := a * 2;
+        while b > 3 {
+            if b == 7 { b = b - 1; } else { b = b - 2; }
+        }
+        return b and a or g;
+    }
+    fn main() { f(4); }
+    """
+
+    def build():
+        compiler = compile_source(decl)
+        ir = [i.pretty_print() for i in compiler.compiled_objects]
+
+        encoded = []
+        for fn in compiler.compiled_objects:
+            if isinstance(fn, FunctionDecl):
+                result = process_function(fn, 10)
+                detach_jump_targets(result[1])
+                encoded.append(pickle.dumps(result))
+        return ir, encoded
+
+    assert build() == build()
+
+
+def test_assembler_matches_packing():
+    """Make sure assembling into one buffer matches packing each object to bytes."""
+
+    decl = """
+    var s := "a string of odd length";
+    var a: [u8] = {1, 2, 3};
+    fn f(x: s2) -> s2 {
+        var arr: [s2@4];
+        arr[x] = -1;
+        return arr[x] * -300 + x + 70000;
+    }
+    fn main() { f(2); }
+    """
+
+    (_, code), _ = compile_and_pack(decl)
+
+    def pack(obj):
+        if isinstance(obj, encoder.HardWareInstruction):
+            return encoder.pack_instruction(obj) + b"".join(map(assemble_single, obj.args))
+        return assemble_single(obj)
+
+    assert assemble_instructions(code) == b"".join(map(pack, code))
+
+
+def test_loop_liveness():
+    """Make sure registers used in a loop are live until the jump back to the start of the loop."""
+
+    count, total, cond = Register(0, 8), Register(1, 8), Register(2, 1)
+    start, end = JumpTarget(), JumpTarget()
+
+    code = [
+        Mov(count, Immediate(10, 8)),
+        Mov(total, Immediate(0, 8)),
+        start,
+        Binary.add(total, count),
+        Binary.sub(count, Immediate(1, 8)),
+        Compare(count, Immediate(0, 8)),  # last use of count
+        SetCmp(cond, CompType.eq),
+        Jump(end, cond),
+        Jump(start),
+        end,
+        Mov(Dereference(Immediate(5000, 2), 8), total)
+    ]
+
+    mark_last_usages(code)
+
+    closing = {reg.reg: index for index, instr in enumerate(code) for reg in instr.closing_registers}
+    assert closing == {count.reg: 8, cond.reg: 7, total.reg: 10}
+
+
+def test_spill_furthest_next_use():
+    """Make sure the register spilled is the one used furthest away."""
+
+    a, b, c = Register(0, 2), Register(1, 2), Register(2, 2)
+
+    code = [
+        Mov(b, Immediate(2, 2)),
+        Mov(a, Immediate(1, 2)),
+        Mov(c, Immediate(3, 2)),  # a isn't used until after b, so a is spilled
+        Binary.add(b, c),
+        Binary.add(a, b),
+        Mov(Dereference(Immediate(5000, 2), 2), a)
+    ]
+
+    allocate(2, code)
+
+    assert code[2].pre_instructions == [Spill(code[1].to.physical_register, 0)]
+    assert code[4].pre_instructions == [Load(code[4].left.physical_register, 0)]
+    assert sum(len(i.pre_instructions) for i in code) == 2
+
+
+def test_rematerialise_immediate():
+    """Make sure a spilled register holding an immediate is recomputed rather than stored."""
+
+    a, b, c = Register(0, 2), Register(1, 2), Register(2, 2)
+
+    code = [
+        Mov(a, Immediate(7, 2)),
+        Mov(b, Immediate(2, 2)),
+        Mov(c, Immediate(3, 2)),
+        Binary.add(b, c),
+        Binary.add(b, a),
+        Mov(Dereference(Immediate(5000, 2), 2), b)
+    ]
+
+    state = allocate(2, code)
+
+    assert code[2].pre_instructions == []
+    assert code[4].pre_instructions == [Rematerialise(code[4].right.physical_register, 2, Immediate(7, 2))]
+    assert state.spill_slot_count == 0
+
+
+def test_coalesce_moves():
+    """Make sure registers moved between each other share a register and the moves are removed."""
+
+    a, b, c = Register(0, 2), Register(1, 2), Register(2, 2)
+
+    code = [
+        Mov(a, Immediate(7, 2)),
+        Mov(b, a),
+        Mov(c, Immediate(3, 2)),
+        Binary.add(b, c),
+        Mov(Dereference(Immediate(5000, 2), 2), b)
+    ]
+
+    state = graph_colour(2, code)
+
+    assert state.coalesced_moves == 1
+    assert len(code) == 4
+    assert state.colours[a.reg] == state.colours[b.reg] != state.colours[c.reg]
+    assert not any(i.pre_instructions for i in code)
+
+
+def test_callee_saves():
+    """Make sure functions only save the registers their callers need preserved."""
+
+    decl = """
+    fn leaf(a: u8) -> u8 { return a * 3 + 1; }
+    fn mid(a: u8) -> u8 { return a + leaf(a); }
+    fn pointer(a: u8) -> u8 { return a + 2; }
+    fn main() {
+        var f := pointer;
+        std.putchar('a');
+        *(5000::*u8) = mid(2) * 3 + mid(4) + f(1);
+    }
+    """
+
+    compiler = base.Compiler()
+    compiler.compile(parse_source(decl) + parse_stdlib())
+    process_code(compiler, 10)
+
+    functions = {i.identifier: i for i in compiler.compiled_objects if isinstance(i, FunctionDecl)}
+
+    # nothing is live across the calls main makes to std.putchar and the first call to mid
+    assert functions["std.putchar"].used_hw_regs == []
+    assert functions["main"].used_hw_regs == []
+
+    # the result of the first call to mid is live across the second, so mid saves it
+    # and so does leaf, if it clobbers it for mid
+    assert functions["mid"].used_hw_regs
+
+    # pointer could be called from anywhere
+    assert functions["pointer"].used_hw_regs
+
+
+def test_frame_elimination():
+    """Make sure functions without variables or spills don't move the stack pointer."""
+
+    decl = """
+    fn leaf(a: u8) -> u8 {
+        if a > 2 {
+            return a * 3 + 1;
+        }
+        return a;
+    }
+    fn local(a: u8) -> u8 {
+        var b := a * 2;
+        return *(&b) + leaf(b);
+    }
+    fn main() {
+        *(5000::*u8) = local(leaf(2));
+    }
+    """
+
+    compiler = compile_source(decl)
+    process_code(compiler, 10)
+
+    functions = {i.identifier: i for i in compiler.compiled_objects if isinstance(i, FunctionDecl)}
+
+    def moves_stack(fn: FunctionDecl) -> bool:
+        return any(isinstance(i, ir_object.Binary) and i.to == encoder.SpecificRegisters.stk
+                   for i in fn.code)
+
+    assert not moves_stack(functions["leaf"])
+    assert moves_stack(functions["local"])
+
+
+def test_shared_stack_slots():
+    """Make sure variables of scopes that aren't entered at the same time share their offsets."""
+
+    decl = """
+    fn main() {
+        var x: u8 = 1;
+        if x {
+            var a: [u8] = {1, 2, 3};
+            *(5000::*u8) = a[x];
+        } else {
+            var b: [u8] = {4, 5};
+            *(5000::*u8) = b[x];
+        }
+        {
+            var c: u8 = 3;
+            *(5000::*u8) = c;
+        }
+    }
+    """
+
+    main = compile_function(decl, desugar=False)
+    nested = {name: var for i in main.code if isinstance(i, ir_object.Prelude) and i.scope is not main
+              for name, var in i.scope.vars.items()}
+
+    process_code(main.context.compiler, 10)
+
+    x = main.lookup_variable("x")
+    a, b, c = nested["a"], nested["b"], nested["c"]
+
+    # x is live over all of main, the variables of the nested scopes share the space after it
+    assert x.stack_offset == 0
+    assert a.stack_offset == b.stack_offset == c.stack_offset == x.size
+    assert main.size == x.size + a.size
+
+
+def test_dominators_and_loops():
+    """Make sure dominators and natural loops are found for nested loops."""
+
+    i, j = Register(0, 2), Register(1, 2)
+    outer, inner, inner_end, end = JumpTarget(), JumpTarget(), JumpTarget(), JumpTarget()
+
+    code = [
+        Mov(i, Immediate(10, 2)),           # block 0
+        outer,                              # block 1, header of the outer loop
+        Jump(end, i),
+        Mov(j, Immediate(10, 2)),           # block 2
+        inner,                              # block 3, header of the inner loop
+        Jump(inner_end, j),
+        Binary.sub(j, Immediate(1, 2)),     # block 4
+        Jump(inner),
+        inner_end,                          # block 5
+        Binary.sub(i, Immediate(1, 2)),
+        Jump(outer),
+        Mov(i, j),                          # block 6, unreachable
+        end,                                # block 7
+        Return(None),
+    ]
+
+    cfg = ControlFlowGraph(code)
+    blocks = cfg.blocks
+
+    assert [(b.start, b.end) for b in blocks] == [(0, 0), (1, 2), (3, 3), (4, 5),
+                                                  (6, 7), (8, 10), (11, 11), (12, 13)]
+    assert cfg.idom == [0, 0, 1, 2, 3, 3, None, 1]
+
+    assert cfg.dominates(blocks[1], blocks[5])
+    assert not cfg.dominates(blocks[3], blocks[7])
+    assert not cfg.reachable(blocks[6])
+
+    assert [(loop.header, loop.blocks, loop.back_edges) for loop in cfg.loops] == [
+        (1, {1, 2, 3, 4, 5}, [5]),
+        (3, {3, 4}, [4]),
+    ]
+    assert cfg.loop_depths == [0, 1, 1, 2, 2, 1, 0, 0]
+
+    assert cfg.block_of(7) is blocks[4]
+    assert cfg.block_of(11) is blocks[6]
+
+
+def test_cfg_invalidated():
+    """Make sure the control flow graph of a function is kept until a pass changes it's code."""
+
+    main = compile_function("fn main() { var x := 3; while x { x = x - 1; } }", desugar=False)
+
+    cfg = function_cfg(main)
+    assert function_cfg(main) is cfg
+    assert len(cfg.loops) == 1
+
+    DesugarIR_Pre.desugar(main)
+
+    assert function_cfg(main) is not cfg
+    assert function_cfg(main).code is main.code
+
+
+def test_ssa_round_trip():
+    """Make sure registers are written once in SSA form, and converting out of it gives back the same code."""
+
+    decl = """
+    fn main() {
+        var x := 3;
+        var y := 0;
+        while x {
+            if x > 1 and y < 5 {
+                y = y + x;
+            }
+            x = x - 1;
+        }
+        *(5000::*u8) = y;
+    }
+    """
+
+    main = compile_function(decl)
+    before = [str(i) for i in main.code]
+
+    origins = to_ssa(main)
+
+    written = [reg.reg for instr in main.code for reg in instr.defined_registers]
+    assert len(written) == len(set(written))
+
+    # the result of the and is written along both edges into it's end
+    phis = [i for i in main.code if isinstance(i, Phi)]
+    assert len(phis) == 1
+    assert [edge is None for edge, _ in phis[0].args] == [False, True]
+
+    from_ssa(main, origins)
+
+    assert [str(i) for i in main.code] == before
+
+
+def test_ssa_swapped_phis():
+    """Make sure phis that swap registers along a split edge become moves through a temporary register."""
+
+    main = compile_function("fn main() {}", desugar=False)
+
+    a0, b0, a1, b1, cond = (Register(n, 2) for n in range(5))
+    start = JumpTarget()
+    back = Jump(start, cond)
+
+    main.code[:] = [
+        Mov(a0, Immediate(1, 2)),
+        Mov(b0, Immediate(2, 2)),
+        start,
+        Phi(a1, [(None, a0), (back, b1)]),
+        Phi(b1, [(None, b0), (back, a1)]),
+        Mov(cond, Immediate(0, 2)),
+        back,
+        Return(main, a1),
+    ]
+
+    # a1 and b1 were made from the first two registers
+    from_ssa(main, {2: 0, 3: 1})
+
+    a, b = Register(0, 2), Register(1, 2)
+    code = main.code
+
+    assert not any(isinstance(i, Phi) for i in code)
+    assert code[:5] == [Mov(a, Immediate(1, 2)), Mov(b, Immediate(2, 2)), start,
+                        Mov(Register(4, 2), Immediate(0, 2)), back]
+
+    # the jump back to the loop is split, the swap is run in it's own block
+    target, save, *swap, jump = code[6:]
+    assert back.location is target
+    assert isinstance(target, JumpTarget) and target.index is not None
+    assert save.from_ == a and save.to.reg not in (0, 1, 4)
+    assert swap == [Mov(a, b), Mov(b, save.to)]
+    assert jump.location is start and jump.condition is None
+
+
+def test_constant_propagation():
+    """Make sure constant expressions are folded and branches on constants are pruned."""
+
+    decl = """
+    fn main() {
+        var x: u8 = 1 * (2 * (3 * 4));
+        if -1 < 2 {
+            x = x + 1;
+        }
+        *(5000::*u8) = x;
+    }
+    """
+
+    main = compile_function(decl)
+    optimise_function(main, 1)
+
+    assert not any(isinstance(i, ir_object.Binary) and i.op == "mul" for i in main.code)
+    assert not any(isinstance(i, (ir_object.Compare, ir_object.SetCmp)) for i in main.code)
+    assert not any(isinstance(i, ir_object.Jump) and i.condition is not None for i in main.code)
+    assert any(isinstance(i, ir_object.Mov) and isinstance(i.from_, ir_object.Immediate)
+               and i.from_.val == 24 for i in main.code)
+
+
+def test_constant_folding_semantics():
+    """Make sure constants are folded as the VM would compute them, and are left alone when it wouldn't."""
+
+    # division truncates towards zero
+    assert fold_binary("idiv", 0xFC, 2, 1) == 0xFE
+    assert fold_binary("imod", 0xFD, 2, 1) == 0xFF
+    assert fold_binary("add", 0xFF, 1, 1) == 0
+
+    # shifts right fill with zeroes, or with the sign bit when arithmetic
+    assert fold_binary("shr", 0xF0, 2, 1) == 0x3C
+    assert fold_binary("sar", 0xF0, 2, 1) == 0xFC
+    assert fold_binary("sar", 0x70, 2, 1) == 0x1C
+
+    assert fold_binary("udiv", 1, 0, 2) is None
+    assert fold_binary("umod", 1, 0, 2) is None
+    assert fold_binary("idiv", 0x80, 0xFF, 1) is None
+    assert fold_binary("shl", 1, 8, 1) is None
+    assert fold_binary("sar", 1, 8, 1) is None
+    assert fold_unary("neg", 0x80, 1) is None
+
+    assert not fold_compare(CompType.lt, 0xFF, 2, 1)
+    assert fold_compare(CompType.lts, 0xFF, 2, 1)
+
+
+def test_dead_code_elimination():
+    """Make sure code that can't be reached and values that aren't read are removed."""
+
+    decl = """
+    fn f(a: u8) -> u8 {
+        a * 5;
+        if 0 {
+            a = a / 3;
+        }
+        return a;
+        a = a - 1;
+    }
+
+    fn g() {
+        f(1);
+        _asm[ halt:1 ;];
+        f(2);
+    }
+    """
+
+    f, g = compile_function(decl, "f"), compile_function(decl, "g")
+    optimise_function(f, 1)
+    optimise_function(g, 1)
+
+    ops = [i.op for i in f.code if isinstance(i, ir_object.Binary)]
+    assert "mul" not in ops and "udiv" not in ops
+    assert not any(isinstance(i, ir_object.Jump) for i in f.code)
+    assert isinstance(f.code[-1], ir_object.Return)
+    assert sum(isinstance(i, ir_object.Return) for i in f.code) == 1
+
+    calls = [i for i in g.code if isinstance(i, ir_object.Call)]
+    assert len(calls) == 1 and calls[0].result is None
+    assert isinstance(g.code[-1], ir_object.MachineInstr)
+
+
+def test_boolean_constant_operand():
+    """Make sure the jump of an and or or with a constant right side is kept when it's result differs between it's edges."""
+
+    for op, const in (("or", 5), ("and", 0)):
+        decl = f"""
+        fn main(a: u8) {{
+            var r: u8 = 0;
+            if a {op} {const} {{
+                r = 1;
+            }}
+            *(5000::*u8) = r;
+        }}
+        """
+
+        main = compile_function(decl)
+        to_ssa(main)
+        propagate_constants(main)
+        eliminate_dead_code(main)
+
+        phis = [i for i in main.code if isinstance(i, Phi)]
+        assert len(phis) == 1
+        # the left side is taken along the jump, the constant along the edge falling through
+        (jump, left), (fallthrough, right) = phis[0].args
+        assert isinstance(left, Register)
+        assert fallthrough is None and right == Immediate(const, 8)
+        assert jump.condition is not None and any(i is jump for i in main.code)
+
@@ -5,9 +5,9 @@ from wewcompiler.backend.rustvm import compile_and_pack, assemble_instructions
 from tests.helpers import for_feature
 
 
-def run_code_on_vm(location: int, value: int, size: int, program: str, binary_location: str):
+def run_code_on_vm(location: int, value: int, size: int, program: str, binary_location: str, **options):
 
-    (_, code), _ = compile_and_pack(program)
+    (_, code), _ = compile_and_pack(program, **options)
     compiled = assemble_instructions(code)
 
     proc = subprocess.run(
@@ -112,7 +112,7 @@ def test_function_pt_write():
     }
 
     fn main() {
-        var arr: [u8] = {0, 1, 2, 3, 4, 5, 6};
+        var arr: [u8] = {0, 1, 2, 3, 4, 5, 6, 7};
 
         test(arr, 7);
 
@@ -721,3 +721,266 @@ test_op_sar = math_test_gen("sar", -4, 1, ">>", force_result=254)
 
 
 test_op_shl = math_test_gen("shl", 1, 1, "<<")
+
+
+@for_feature(register_allocation="Register Allocation", loop="While loops")
+@pytest.mark.parametrize("reg_count", [3, 4, 10])
+def test_linear_scan_allocation(binloc, reg_count):
+    """Values live around a loop keep their values when allocated by linear scan."""
+    x = "i"
+    for n in range(8):
+        x = f"({x} * {n % 3 + 1} + a)"
+    program = """
+    fn f(a: u8, b: u8) -> u8 {
+        var total: u8 = 0;
+        var i: u8 = 0;
+        while i < b {
+            total = total + {x};
+            i = i + 1;
+        }
+        return total;
+    }
+
+    fn main() {
+        *(5000::*u8) = f(2, 5);
+    }
+    """.replace("{x}", x)
+
+    def expected(i, a=2):
+        for n in range(8):
+            i = i * (n % 3 + 1) + a
+        return i
+
+    run_code_on_vm(5000, sum(map(expected, range(5))), 8, program, binloc,
+                   reg_count=reg_count, regalloc="linear-scan")
+
+
+@for_feature(register_allocation="Register Allocation")
+@pytest.mark.parametrize("reg_count", [3, 4])
+def test_spill_slots_keep_values(binloc, reg_count):
+    """Spilled registers are stored and loaded back intact with only a few registers to allocate."""
+    x = "c"
+    for n in range(12):
+        x = f"({'abc'[n % 3]} * {x} + {n})"
+    program = """
+    fn f(a: u8, b: u8, c: u8) -> u8 {
+        return {x};
+    }
+
+    fn main() {
+        *(5000::*u8) = f(3, 5, 7);
+    }
+    """.replace("{x}", x)
+
+    expected = 7
+    for n in range(12):
+        expected = (3, 5, 7)[n % 3] * expected + n
+
+    run_code_on_vm(5000, expected % 2 ** 64, 8, program, binloc, reg_count=reg_count)
+
+
+@for_feature(register_allocation="Register Allocation", loop="While loops")
+@pytest.mark.parametrize("reg_count", [3, 4, 10])
+def test_graph_colouring_allocation(binloc, reg_count):
+    """Values moved between registers and live around a loop keep their values when allocated by graph colouring."""
+    program = """
+    fn g(a: u8, b: u8) -> u8 {
+        return a * 3 + b;
+    }
+
+    fn f(a: u8, b: u8) -> u8 {
+        var total: u8 = 0;
+        var i: u8 = 0;
+        while i < b {
+            var x: u8 = g(i, a);
+            total = total + x * (i + a) + g(x, total);
+            i = i + 1;
+        }
+        return total;
+    }
+
+    fn main() {
+        *(5000::*u8) = f(2, 5);
+    }
+    """
+
+    total = 0
+    for i in range(5):
+        x = i * 3 + 2
+        total = (total + x * (i + 2) + x * 3 + total) % 2 ** 64
+
+    run_code_on_vm(5000, total, 8, program, binloc, reg_count=reg_count, opt_level=3)
+
+
+@for_feature(functions="Functions", register_allocation="Register Allocation")
+@pytest.mark.parametrize("regalloc", ["greedy", "linear-scan", "graph-colouring"])
+@pytest.mark.parametrize("reg_count", [3, 10])
+def test_registers_kept_over_calls(binloc, reg_count, regalloc):
+    """Values live across calls keep their values when the functions called only save what's needed."""
+    program = """
+    fn leaf(a: u8) -> u8 {
+        return a * 3 + 1;
+    }
+
+    fn mid(a: u8) -> u8 {
+        return a * 5 + leaf(a) * (a + 2) + leaf(a + 1);
+    }
+
+    fn rec(a: u8) -> u8 {
+        if a == 0 {
+            return 1;
+        }
+        return a + rec(a - 1) * 2 + mid(a);
+    }
+
+    fn main() {
+        var f := leaf;
+        var x: u8 = 7;
+        *(5000::*u8) = x * 11 + mid(x) * (x + 1) + rec(4) + f(x) * x;
+    }
+    """
+
+    def leaf(a):
+        return a * 3 + 1
+
+    def mid(a):
+        return a * 5 + leaf(a) * (a + 2) + leaf(a + 1)
+
+    def rec(a):
+        return 1 if a == 0 else a + rec(a - 1) * 2 + mid(a)
+
+    x = 7
+    expected = x * 11 + mid(x) * (x + 1) + rec(4) + leaf(x) * x
+
+    run_code_on_vm(5000, expected, 8, program, binloc, reg_count=reg_count, regalloc=regalloc)
+
+
+@for_feature(variables="Variables", register_allocation="Register Allocation")
+@pytest.mark.parametrize("regalloc", ["greedy", "linear-scan", "graph-colouring"])
+@pytest.mark.parametrize("reg_count", [3, 10])
+def test_shared_stack_slots(binloc, reg_count, regalloc):
+    """Variables of scopes that aren't entered at the same time keep their values when they share stack slots."""
+    program = """
+    fn sum(arr: *u8, len: u8) -> u8 {
+        var total: u8 = 0;
+        var i: u8 = 0;
+        while i < len {
+            total = total + arr[i];
+            i = i + 1;
+        }
+        return total;
+    }
+
+    fn main() {
+        var total: u8 = 0;
+        var i: u8 = 0;
+        while i < 4 {
+            if i % 2 {
+                var a: [u8] = {1, 2, 3};
+                total = total + sum(a, 3) * i;
+            } else {
+                var b: [u8] = {4, 5, 6, 7};
+                {
+                    var c: [u8] = {8, 9};
+                    total = total + sum(c, 2);
+                }
+                total = total + sum(b, 4) + i;
+            }
+            i = i + 1;
+        }
+        {
+            var d: [u8] = {10, 11, 12, 13, 14};
+            total = total + sum(d, 5);
+        }
+        *(5000::*u8) = total;
+    }
+    """
+
+    expected = sum(6 * i if i % 2 else 17 + 22 + i for i in range(4)) + 60
+
+    run_code_on_vm(5000, expected, 8, program, binloc, reg_count=reg_count, regalloc=regalloc)
+
+
+@for_feature(math="Maths", if_stmt="IF Statements")
+@pytest.mark.parametrize("opt_level", [0, 1])
+def test_constant_propagation(binloc, opt_level):
+    """Constants folded when compiling give the values the VM would compute, and branches on them go the same way."""
+    program = """
+    fn main() {
+        var a: s1 = -3;
+        var b: s1 = a % 2;
+        var c: s1 = (a - 1) / 2;
+        var total: u8 = 0;
+        if c < 0 and b == -1 {
+            total = (b::u8 + 2) * 100 + (-c)::u8 * 10;
+        } else {
+            total = 7;
+        }
+        if 300::u1 > 50 {
+            total = total + 1000;
+        }
+        *(5000::*u8) = total;
+    }
+    """
+
+    run_code_on_vm(5000, 120, 8, program, binloc, opt_level=opt_level)
+
+
+@for_feature(functions="Functions", if_stmt="IF Statements")
+@pytest.mark.parametrize("opt_level", [0, 1])
+def test_dead_code_elimination(binloc, opt_level):
+    """Code after returns and in branches never taken is left out without changing what's run."""
+    program = """
+    fn f(a: u8) -> u8 {
+        if a > 3 {
+            var b: u8 = a * 2;
+            return b;
+            b = b + 1;
+        }
+        a * 5;
+        return a;
+        a = a + 1;
+    }
+
+    fn main() {
+        var x: u8 = f(5) + f(1);
+        f(2);
+        if 0 {
+            x = 99;
+        }
+        *(5000::*u8) = x;
+        _asm[ halt:1 ;];
+        *(5000::*u8) = 3;
+    }
+    """
+
+    run_code_on_vm(5000, 11, 8, program, binloc, opt_level=opt_level)
+
+
+@for_feature(if_stmt="IF Statements")
+@pytest.mark.parametrize("opt_level", [0, 1, 2, 3])
+def test_boolean_constant_operand(binloc, opt_level):
+    """An and or an or with a constant right side and a left side that isn't constant gives the right result."""
+    program = """
+    fn either(a: u8) -> u8 {
+        var r: u8 = 0;
+        if a or 5 {
+            r = 1;
+        }
+        return r;
+    }
+
+    fn both(a: u8) -> u8 {
+        var r: u8 = 0;
+        if a and 0 {
+            r = 1;
+        }
+        return r;
+    }
+
+    fn main() {
+        *(5000::*u8) = either(0) * 1000 + either(7) * 100 + both(0) * 10 + both(7);
+    }
+    """
+
+    run_code_on_vm(5000, 1100, 8, program, binloc, opt_level=opt_level)
@@ -1,5 +1,8 @@
 from wewcompiler import objects
 from wewcompiler.objects import parse_source
+from wewcompiler.parser import pratt
+from wewcompiler.parser.lines import line_table
+from wewcompiler.backend.rustvm import compile_and_pack, assemble_instructions
 
 from pytest import raises
 from tatsu.exceptions import FailedParse
@@ -79,3 +82,65 @@ def test_fn_in_fn():
     decl = emptyfn(emptyfn(""))
     with raises(FailedParse):
         parse_source(decl)
+
+
+@for_feature(operators="Operators")
+def test_pratt_parser_equivalent():
+    """Test the precedence climbing parser building the same program as the generated parser."""
+    decl = """
+    fn main() -> u8 {
+        var a := 1/u8;
+        var b := a + 2 * 3 - 4 / 2 % 3 << 1 >> 1;
+        var c := a < b and b >= 3 or a == 1 and !(b != 2);
+        var d := a & b | c ^ 7 & ~a;
+        var e := (a + 1) * (b + c) - d - 1 - 2;
+        return a + b + c + d + e;
+    }
+    """
+
+    (_, peg), _ = compile_and_pack(decl)
+    (_, pratt), _ = compile_and_pack(decl, pratt=True)
+
+    assert assemble_instructions(peg) == assemble_instructions(pratt)
+
+
+@for_feature(operators="Operators")
+def test_pratt_parser_errors():
+    """Test the precedence climbing parser reporting the same errors as the generated parser."""
+    decl = emptyfn("var a := 1 + ;")
+
+    with raises(FailedParse) as peg:
+        parse_source(decl)
+    with raises(FailedParse) as pratt:
+        parse_source(decl, pratt=True)
+
+    # the rule stacks differ, but the failure is reported at the same place for the same reason
+    assert peg.value.pos == pratt.value.pos
+    assert peg.value.message == pratt.value.message
+
+
+def test_pratt_parser_unavailable(monkeypatch):
+    """Test the precedence climbing parser failing clearly when tatsu is missing what it needs."""
+    assert not pratt.missing_internals(pratt.PrattWewParser())
+    assert pratt.missing_internals(object()) == pratt.tatsu_internals
+
+    monkeypatch.setattr(objects, "pratt_lang", None)
+    monkeypatch.setattr(objects, "pratt_unavailable", "the installed version of tatsu is missing _cut")
+
+    with raises(RuntimeError, match="missing _cut"):
+        parse_source(emptyfn("var a := 1;"), pratt=True)
+
+
+def test_line_table():
+    """Test the line table agreeing with the line info of the parse buffer."""
+    decl = "\n".join([emptyfn("var a := 1;"), "// comment", "", emptyfn("return 2;")])
+    parsed = parse_source(decl)
+
+    buffer = parsed[0]._info.buffer
+    table = line_table(buffer)
+
+    for pos in range(len(buffer.text)):
+        info = buffer.line_info(pos)
+        assert table.position(pos) == (info.line, info.col)
+
+    assert [i.body[0].matched_region for i in parsed] == ["var a := 1", "return 2"]
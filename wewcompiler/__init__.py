@@ -1,2 +1,4 @@
+__version__ = "0.1.0"
+
 from wewcompiler.objects.builder import WewSemantics
 from wewcompiler.parser import lang
@@ -1,8 +1,9 @@
+import os
 import sys
 import re
 import pprint
 from itertools import count
-from typing import Tuple, Dict, Any, Iterable
+from typing import Tuple, Dict, Any, Iterable, List, Optional
 
 import click
 import colorama
@@ -11,29 +12,65 @@ from termcolor import colored
 from tatsu.exceptions import FailedParse
 
 from wewcompiler.objects import base, parse_source, compile_source
+from wewcompiler.parser import pratt_lang, pratt_unavailable
 from wewcompiler.utils import add_line_count, strip_newlines
+from wewcompiler.utils.cache import ArtifactCache, cache_key
 from wewcompiler.objects.errors import CompileException
-from wewcompiler.backend.rustvm.assemble import process_code, assemble_instructions, group_fns_toplevel
+from wewcompiler.backend.rustvm.assemble import (process_code, assemble_instructions, group_fns_toplevel,
+                                               allocators, max_opt_level)
 
 
-def compile_and_pack(inp: str, reg_count: int = 10) -> Tuple[Dict[str, int], Any]:
-    compiler = compile_source(inp)
-    return process_code(compiler, reg_count), compiler
+STDLIB_PATH = os.path.join(os.path.dirname(__file__), "stdlib.wew")
 
 
-def get_stats(compiler: base.Compiler, instructions: bytearray):
+def compile_and_pack(inp: str, reg_count: int = 10, pratt: bool = False,
+                     regalloc: Optional[str] = None, opt_level: int = 0) -> Tuple[Dict[str, int], Any]:
+    compiler = compile_source(inp, pratt)
+    return process_code(compiler, reg_count, regalloc=regalloc, opt_level=opt_level), compiler
+
+
+def parse_stdlib(cache: Optional[ArtifactCache] = None) -> List[base.StatementObject]:
+    """Parse the standard library.
+
+    If a cache is given the parsed objects are loaded from it, keyed on the content of the stdlib.
+    A fresh copy is returned each time as compilation mutates the objects.
+    """
+    with open(STDLIB_PATH) as f:
+        stdlib = f.read()
+
+    if cache is None:
+        return parse_source(stdlib)
+
+    key = cache_key(stdlib.encode("utf-8"))
+
+    parsed = cache.load("stdlib", key)
+    if parsed is None:
+        parsed = parse_source(stdlib)
+        cache.store("stdlib", key, parsed)
+
+    return parsed
+
+
+def get_stats(compiler: base.Compiler, instructions: bytearray, cache: Optional[ArtifactCache] = None):
     f, s = group_fns_toplevel(compiler.compiled_objects)
 
     num_funs = len(f)
     num_globals = len(s)
     num_instructions = len(instructions)
 
-    return [
+    stats = [
         f"Function count: {num_funs}",
         f"Global count: {num_globals}",
         f"Binary length: {num_instructions}"
     ]
 
+    if cache is not None:
+        stats.append(f"Function cache: {cache.hits['function']} hits, {cache.misses['function']} misses")
+        if cache.skipped:
+            stats.append(f"Cache writes skipped: {sum(cache.skipped.values())}")
+
+    return stats
+
 
 @click.command()
 @click.argument("input", type=click.File('r'))
@@ -45,11 +82,26 @@ def get_stats(compiler: base.Compiler, instructions: bytearray):
 @click.option("--print-hwin", is_flag=True)
 @click.option("--print-offsets", is_flag=True)
 @click.option("--no-include-std", is_flag=True)
+@click.option("--cache-dir", type=click.Path(file_okay=False), default=None,
+              help="Directory to cache compiler artifacts in.")
+@click.option("--no-cache", is_flag=True, help="Don't read or write cached artifacts.")
+@click.option("--pratt", is_flag=True, help="Parse binary expressions by precedence climbing.")
+@click.option("--jobs", "-j", default=1, type=click.IntRange(min=1),
+              help="Number of processes to run the backend for functions in.")
+@click.option("--incremental", is_flag=True, help="Reuse the code of functions that haven't changed since the last build.")
+@click.option("--regalloc", default=None, type=click.Choice(list(allocators)),
+              help="Register allocator to use, picked by the optimisation level if not given.")
+@click.option("--opt-level", "-O", default=0, type=click.IntRange(0, max_opt_level),
+              help="Optimisation level.")
 def compile(input, out, reg_count, show_stats, debug_compiler,
-            print_ir, print_hwin, print_offsets, no_include_std):
+            print_ir, print_hwin, print_offsets, no_include_std,
+            cache_dir, no_cache, pratt, jobs, incremental, regalloc, opt_level):
 
     colorama.init(autoreset=True)
 
+    if pratt and pratt_lang is None:
+        raise click.UsageError(f"--pratt can't be used, {pratt_unavailable}.")
+
     input = input.read()
     input = input.expandtabs(tabsize=4)
 
@@ -58,7 +110,7 @@ def compile(input, out, reg_count, show_stats, debug_compiler,
         exit(1)
 
     try:
-        parsed = parse_source(input)
+        parsed = parse_source(input, pratt)
     except FailedParse as e:
         print("Failed to parse input: ", file=sys.stderr)
 
@@ -97,14 +149,10 @@ def compile(input, out, reg_count, show_stats, debug_compiler,
         print(e, file=sys.stderr)
         exit(1)
 
-    if not no_include_std:
-        import os
-        stdlib_path = os.path.join(os.path.dirname(__file__), "stdlib.wew")
-
-        with open(stdlib_path) as f:
-            stdlib = f.read()
+    cache = None if no_cache else ArtifactCache(cache_dir)
 
-        parsed.extend(parse_source(stdlib))
+    if not no_include_std:
+        parsed.extend(parse_stdlib(cache))
 
     compiler = base.Compiler()
 
@@ -116,7 +164,13 @@ def compile(input, out, reg_count, show_stats, debug_compiler,
         print(e, file=sys.stderr)
         exit(1)
 
-    offsets, code = process_code(compiler, reg_count)
+    # functions processed by workers or reused from the cache are left untouched here,
+    # so process all of them here when printing the IR
+    if print_ir:
+        jobs = 1
+    function_cache = cache if incremental and not print_ir else None
+
+    offsets, code = process_code(compiler, reg_count, jobs, function_cache, regalloc, opt_level)
 
     if print_ir:
         print("\n\n".join("{}\n{}".format(i.identifier, i.pretty_print())
@@ -132,7 +186,7 @@ def compile(input, out, reg_count, show_stats, debug_compiler,
 
     if show_stats:
         print("Stats: \n  ", end="")
-        print("\n  ".join(get_stats(compiler, compiled)))
+        print("\n  ".join(get_stats(compiler, compiled, function_cache)))
 
     out.write(compiled)
 
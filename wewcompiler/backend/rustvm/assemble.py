@@ -1,13 +1,25 @@
+import multiprocessing
+import sys
+from array import array
 from itertools import chain
-from typing import Tuple, List, Dict, Union, Optional, Iterable, Any
+from typing import Tuple, List, Dict, Union, Optional, Iterable, Any, Set
 
 from wewcompiler.backend.rustvm.desugar import DesugarIR_Pre, DesugarIR_Post
 from wewcompiler.backend.rustvm import encoder
-from wewcompiler.backend.rustvm.register_allocate import allocate, Spill, Load
+from wewcompiler.backend.rustvm.cfg import function_cfg, invalidate_cfg
+from wewcompiler.backend.rustvm.constant_propagation import propagate_constants
+from wewcompiler.backend.rustvm.dead_code import eliminate_dead_code
+from wewcompiler.backend.rustvm.graph_colouring import graph_colour
+from wewcompiler.backend.rustvm.linear_scan import linear_scan
+from wewcompiler.backend.rustvm.register_allocate import allocate, Spill, Load, Rematerialise
+from wewcompiler.backend.rustvm.register_usage import RegisterUsage, call_targets, register_usage, saved_registers
+from wewcompiler.backend.rustvm.ssa import from_ssa, to_ssa
+from wewcompiler.backend.rustvm.stack_slots import assign_spill_offsets, assign_variable_offsets
 from wewcompiler.objects.base import FunctionDecl, StatementObject, Compiler, Scope
 from wewcompiler.objects.errors import InternalCompileException, CompileException
 from wewcompiler.objects.variable import Variable, DataReference
 from wewcompiler.objects import ir_object
+from wewcompiler.utils.cache import ArtifactCache, cache_key
 
 
 def group_fns_toplevel(code: List[StatementObject]) -> Tuple[List[FunctionDecl],
@@ -20,40 +32,75 @@ def group_fns_toplevel(code: List[StatementObject]) -> Tuple[List[FunctionDecl],
     return fns, nfns
 
 
-def allocate_code(compiler: Compiler, reg_count) -> Tuple[List[FunctionDecl],
-                                                          List[StatementObject]]:
-    """Allocates registers for toplevel and function level blocks."""
+#: The register allocators that can be used, by name.
+allocators = {
+    "greedy": allocate,
+    "linear-scan": linear_scan,
+    "graph-colouring": graph_colour
+}
 
-    functions, toplevel = group_fns_toplevel(compiler.compiled_objects)
+#: The highest optimisation level, registers are allocated by graph colouring at this level.
+max_opt_level = 3
+
+
+def allocate_toplevel(compiler: Compiler, toplevel: List[StatementObject], reg_count: int,
+                      regalloc: str = "greedy") -> RegisterUsage:
+    """Allocates registers for toplevel blocks, they share a single set of spill variables.
+
+    :returns: The registers the toplevel code uses around the calls it makes.
+    """
 
     toplevel_spill_vars = 0
+    usage = RegisterUsage()
 
     for i in toplevel:
-        allocator = allocate(reg_count, i.code)
-        toplevel_spill_vars = max(toplevel_spill_vars, len(allocator.spilled_registers))
+        targets, address_taken = call_targets(i.code)
+        allocator = allocators[regalloc](reg_count, i.code)
+        toplevel_spill_vars = max(toplevel_spill_vars, allocator.spill_slot_count)
+        usage.update(register_usage(i.code, targets, address_taken))
 
     compiler.add_spill_vars(toplevel_spill_vars)
 
-    for i in functions:
-        allocator = allocate(reg_count, i.code)
-        i.add_spill_vars(len(allocator.spilled_registers))
-
-    return functions, toplevel
+    return usage
 
 
 def process_toplevel(compiler: Compiler, code: List[StatementObject]) -> List[ir_object.IRObject]:
-    """Inserts scope around the toplevel assignment code."""
+    """Inserts scope around the toplevel assignment code.
+
+    Jump targets are numbered per object, they're renumbered so that they're unique over all the toplevel code.
+    """
+    offset = 0
+    for obj in code:
+        for i in obj.code:
+            if isinstance(i, ir_object.JumpTarget):
+                i.index += offset
+        offset += obj.context.jump_targets
+
+    instrs = list(chain.from_iterable(i.code for i in code))
+
+    if not compiler.spill_size:
+        return instrs
+
     return [
         ir_object.Binary.add(encoder.SpecificRegisters.stk, ir_object.Immediate(compiler.spill_size, 8)),
-        *chain.from_iterable(i.code for i in code),
+        *instrs,
         ir_object.Binary.sub(encoder.SpecificRegisters.stk, ir_object.Immediate(compiler.spill_size, 8))
     ]
 
 
-def process_immediates(compiler: Compiler, code: List[StatementObject]):
-    """Replaces immediate values that are too large to fit into 14 bits by allocating
-    global objects for them and referencing them in the arguments."""
-    for i in chain.from_iterable(i.code for i in code):
+Relocation = Tuple[DataReference, bytes]
+
+
+def relocate_immediates(instrs: Iterable[ir_object.IRObject]) -> List[Relocation]:
+    """Replaces immediate values that are too large to fit into 14 bits with references to data holding them.
+
+    The data isn't added to the compiler here, so that functions can be processed apart from it.
+
+    :returns: The references that were inserted, paired with the bytes they should point to.
+    """
+    relocations = []
+
+    for i in instrs:
         for attr in i.touched_regs:
             arg = getattr(i, attr)
 
@@ -71,23 +118,41 @@ def process_immediates(compiler: Compiler, code: List[StatementObject]):
                 # bit length wont fit in an argument, we need to allocate a variable and make this point to it
                 signed = arg.val < 0
                 try:
-                    var = compiler.add_bytes(arg.val.to_bytes(length=arg.size, byteorder="little", signed=signed))
-                    setattr(i, attr, ir_object.Dereference(var.global_offset, arg.size))
+                    data = arg.val.to_bytes(length=arg.size, byteorder="little", signed=signed)
                 except OverflowError:
                     raise InternalCompileException("Number: {arg.val} too large!")
+                ref = DataReference(None)  # named when the data is added
+                setattr(i, attr, ir_object.Dereference(ref, arg.size))
+                relocations.append((ref, data))
 
+    return relocations
 
-def process_instruction(indexes: Dict[str, int],
+
+def add_relocations(compiler: Compiler, relocations: Iterable[Relocation]):
+    """Add the data of relocations to the compiler and point their references at it."""
+    for ref, data in relocations:
+        var = compiler.add_bytes(data)
+        ref.name = var.global_offset.name
+
+
+def process_immediates(compiler: Compiler, code: List[StatementObject]):
+    """Replaces immediate values that are too large to fit into 14 bits by allocating
+    global objects for them and referencing them in the arguments."""
+    add_relocations(compiler, relocate_immediates(chain.from_iterable(i.code for i in code)))
+
+
+def process_instruction(labels: Dict[int, int],
                         size: int,
                         instr: Union[encoder.HardWareInstruction, ir_object.JumpTarget]) -> Optional[encoder.HardWareInstruction]:
     """Process an instruction for packaging.
 
+    :param labels: The offsets of the jump targets of the code being packaged, by index.
     :returns: The instruction processed. Jump targets return None."""
     if isinstance(instr, encoder.HardWareInstruction):
         return instr
 
     elif isinstance(instr, ir_object.JumpTarget):
-        indexes[instr.identifier] = size
+        labels[instr.index] = size
         return None
 
     raise InternalCompileException("Content of code that was not a hardware instruction or jump point")
@@ -96,36 +161,93 @@ def process_instruction(indexes: Dict[str, int],
 InstrOrTarget = Union[encoder.HardWareInstruction, ir_object.JumpTarget]
 
 
+#: A site that refers to a symbol, resolved once everything is placed.
+#: This is the object holding the reference, the position of the reference in it
+#: (None for dereferences, which hold the reference directly), the table of
+#: symbol locations the symbol is looked up in, and the symbol.
+Fixup = Tuple[Any, Optional[int], Dict[Any, int], Union[str, int]]
+
+
+def record_fixups(fixups: List[Fixup], instr: encoder.HardWareInstruction,
+                  indexes: Dict[str, int], labels: Dict[int, int]):
+    """Record the sites in the arguments of an instruction that refer to symbols."""
+    for position, arg in enumerate(instr.args):
+        # this runs for every argument of the program, none of these types are subclassed
+        # so comparing types exactly is enough and saves the cost of isinstance.
+        kind = type(arg)
+
+        if kind is DataReference:
+            fixups.append((instr, position, indexes, arg.name))
+
+        # we dont need to process dereferences as they can only be applied to registers or immediates
+        elif kind is ir_object.Dereference:
+            if type(arg.to) is DataReference:
+                fixups.append((arg, None, indexes, arg.to.name))
+
+        elif kind is ir_object.JumpTarget:
+            fixups.append((instr, position, labels, arg.index))
+
+
+def resolve_fixups(fixups: List[Fixup]) -> List[str]:
+    """Replace the symbols referenced by fixups with their locations.
+
+    :returns: The symbols that couldn't be found.
+    """
+    missing = []
+
+    for site, position, table, symbol in fixups:
+        location = table.get(symbol)
+
+        if location is None:
+            missing.append(symbol if isinstance(symbol, str) else f"jump-target-{symbol}")
+
+        elif position is None:
+            site.to = ir_object.Immediate(location, 2)
+
+        elif isinstance(site, list):
+            site[position] = encoder.HardwareMemoryLocation(location)
+
+        else:
+            args = list(site.args)
+            args[position] = encoder.HardwareMemoryLocation(location)
+            site.args = tuple(args)
+
+    return missing
+
+
 def package_objects(compiler: Compiler,
                     fns: List[Tuple[str, InstrOrTarget]],
                     toplevel: List[InstrOrTarget]) -> Tuple[Dict[str, int], Any]:
-    """Packages objects into the binary, making multiple passes to resolve arguments
+    """Packages objects into the binary.
 
     All IR instructions should have been moved into HardWareInstructions by this point.
 
-    If no substitutions are made in a pass, the data will be scanned for any remaining references.
-    although remaining references should be minimal since the IR generator couldn't have worked
-    properly for everything but a missing main reference
+    Objects are laid out in a single pass. Every reference to a symbol found while laying out is
+    recorded as a fixup, these are resolved once everything has been placed. Any references left
+    unresolved should be minimal since the IR generator couldn't have worked properly for everything
+    but a missing main reference.
 
     :returns: The dict of identifier to byte offset and the packaged objects.
     """
 
     packaged = []
     size = 0
-    indexes = {}  # CLEANUP: factor out state variables maybe?
+    indexes = {}
+    fixups: List[Fixup] = []
 
     starting_jump = encoder.HardWareInstruction(encoder.Manip.jmp, 2,
                                                 (ir_object.Immediate(1, 2),
                                                  ir_object.DataReference("toplevel-code")))
 
     packaged.append(starting_jump)
+    record_fixups(fixups, starting_jump, indexes, {})
 
     size += starting_jump.code_size
 
     indexes["program-data"] = size
 
-    # do a single pass to place everything in the output table
-    for (ident, index) in compiler.data_identifiers.copy().items():
+    # place everything in the output table
+    for (ident, index) in compiler.data_identifiers.items():
 
         obj = compiler.data[index]
         indexes[ident] = size
@@ -136,6 +258,10 @@ def package_objects(compiler: Compiler,
         elif isinstance(obj, list):
             size += len(obj) * 2  # Variables become pointers
 
+            fixups.extend((obj, position, indexes, elem.name)
+                          for position, elem in enumerate(obj)
+                          if isinstance(elem, Variable))
+
         packaged.append(obj)
 
     indexes["toplevel-code"] = size
@@ -144,61 +270,32 @@ def package_objects(compiler: Compiler,
     packaged.append(pre_instr)  # this will be filled at the end of allocating sizes
     size += pre_instr.code_size
 
-    # add in startup code
-    for i in toplevel:
-        instr = process_instruction(indexes, size, i)
-        if instr:
-            size += instr.code_size
-            packaged.append(instr)
+    def add_code(code: List[InstrOrTarget]):
+        nonlocal size
+
+        # jump targets are numbered from zero in each function and in the toplevel code,
+        # they can only be jumped to from the same code so each gets it's own table of labels.
+        labels = {}
 
-    # add in code
-    for (name, code) in fns:
-        indexes[name] = size
         for i in code:
-            instr = process_instruction(indexes, size, i)
+            instr = process_instruction(labels, size, i)
             if instr:
                 size += instr.code_size
                 packaged.append(instr)
+                record_fixups(fixups, instr, indexes, labels)
+
+    # add in startup code
+    add_code(toplevel)
+
+    # add in code
+    for (name, code) in fns:
+        indexes[name] = size
+        add_code(code)
 
     # set stack position
     pre_instr.args = (ir_object.Immediate(size + 2, 2),)
 
-    missing = []
-
-    for obj in packaged:
-        if isinstance(obj, encoder.HardWareInstruction):
-            args = list(obj.args)  # create list from args to allow us to mutate indexes
-            for position, arg in enumerate(args):
-                # resolve data reference
-                # we dont need to process dereferences as they can only be applied to registers or immediates
-                if isinstance(arg, ir_object.DataReference):
-                    if arg.name in indexes:  # replace reference to actual location
-                        args[position] = encoder.HardwareMemoryLocation(indexes[arg.name])
-                    else:
-                        missing.append(arg.name)
-
-                if isinstance(arg, ir_object.Dereference):
-                    if isinstance(arg.to, DataReference):
-                        if arg.to.name in indexes:
-                            arg.to = ir_object.Immediate(indexes[arg.to.name], 2)
-                        else:
-                            missing.append(arg.to.name)
-
-                # resolve jump target
-                if isinstance(arg, ir_object.JumpTarget):
-                    if arg.identifier in indexes:
-                        args[position] = encoder.HardwareMemoryLocation(indexes[arg.identifier])
-                    else:
-                        missing.append(arg.identifier)
-            obj.args = tuple(args)
-
-        if isinstance(obj, list):
-            for index, elem in enumerate(obj):
-                if isinstance(elem, Variable):
-                    if elem.name in indexes:
-                        obj[index] = encoder.HardwareMemoryLocation(indexes[elem.name])
-                    else:
-                        missing.append(elem.name)
+    missing = resolve_fixups(fixups)
 
     if missing == ["main"]:
         # custom message when missing main
@@ -209,10 +306,12 @@ def package_objects(compiler: Compiler,
     return indexes, packaged
 
 
-def insert_register_stores(fn: FunctionDecl):
+def insert_register_stores(fn: FunctionDecl, saved_registers: Optional[Set[int]] = None):
     """Insert register stores to preserve registers used inside this function.
 
     Inserts extra variables into the function body and inserts stores/ loads before and after the function code.
+
+    :param saved_registers: The registers callers need preserved, every register used is saved if not given.
     """
 
     # scan through the function and collect used registers
@@ -223,63 +322,93 @@ def insert_register_stores(fn: FunctionDecl):
             {reg.physical_register for reg in i.touched_registers}
         )
 
+    if saved_registers is not None:
+        touched_regs &= saved_registers
+
     # Add vars here but dont actually insert instructions to save/restore
     # instead this will happen when prelude/ epilog are desugared
 
     fn.used_hw_regs = list(touched_regs)
 
 
-def process_spill(scope: Scope, instr: Union[Spill, Load]) -> Iterable[encoder.HardWareInstruction]:
-    """Process spill instructions."""
+def process_spills(scope: Scope,
+                   instrs: Iterable[Union[Spill, Load, Rematerialise]]) -> Iterable[encoder.HardWareInstruction]:
+    """Process the spill instructions placed before an instruction."""
 
     # Spill:
-    # Push current value
-    # load index of location to spill
-    # Pop into location
+    # load address of location to spill into scratch register
+    # move register into location
     #
     # Load:
-    # load index of location to load
-    # dereference into register
+    # load address of location to load into scratch register
+    # move location into register
+    #
+    # Rematerialise:
+    # move value into register
+    # add offset to register
+    #
+    # The return register is the scratch register, it only holds a value inside of the code
+    # for a call or a return, where there are no spills. Once the address of a location is in it
+    # the address of the next location is found by adding the difference of their offsets.
+
+    scratch = encoder.SpecificRegisters.ret
+
+    #: the offset off of the base pointer held in the scratch register
+    address = None
+
+    for instr in instrs:
+        if isinstance(instr, Rematerialise):
+            yield from process_rematerialise(instr)
+            continue
+
+        assert isinstance(instr, (Spill, Load))
 
-    assert isinstance(instr, (Spill, Load))
+        var = scope.lookup_variable(f"spill-var-{instr.index}")
+        assert var is not None
 
-    reg_s8 = ir_object.AllocatedRegister(8, False, instr.reg)
-    reg_s2 = ir_object.AllocatedRegister(2, False, instr.reg)
+        if address is None:
+            yield encoder.HardWareInstruction(
+                encoder.Manip.mov,
+                2,
+                (scratch, encoder.SpecificRegisters.bas)
+            )
+            address = 0
+
+        if var.stack_offset != address:
+            op = encoder.BinaryInstructions.add if var.stack_offset > address else encoder.BinaryInstructions.sub
+            yield encoder.HardWareInstruction(
+                op,
+                2,
+                (scratch, ir_object.Immediate(abs(var.stack_offset - address), 2), scratch)
+            )
+            address = var.stack_offset
+
+        reg = ir_object.AllocatedRegister(8, False, instr.reg)
+        location = ir_object.Dereference(scratch, 8)
 
-    if isinstance(instr, Spill):
         yield encoder.HardWareInstruction(
-            encoder.Mem.push,
+            encoder.Manip.mov,
             8,
-            (reg_s8,)
+            (location, reg) if isinstance(instr, Spill) else (reg, location)
         )
 
-    yield encoder.HardWareInstruction(
-        encoder.Manip.mov,
-        2,
-        (reg_s2,
-         encoder.SpecificRegisters.bas)
-    )
 
-    var = scope.lookup_variable(f"spill-var-{instr.index}")
-    assert var is not None
+def process_rematerialise(instr: Rematerialise) -> Iterable[encoder.HardWareInstruction]:
+    """Recompute the value of a spilled register."""
+    reg = ir_object.AllocatedRegister(instr.size, False, instr.reg)
 
     yield encoder.HardWareInstruction(
-        encoder.BinaryInstructions.add,
-        2,
-        (reg_s2, ir_object.Immediate(var.stack_offset, 2), reg_s2)
+        encoder.Manip.mov,
+        instr.size,
+        (reg, instr.value)
     )
 
-    if isinstance(instr, Spill):
+    if instr.offset:
+        op = encoder.BinaryInstructions.add if instr.offset > 0 else encoder.BinaryInstructions.sub
         yield encoder.HardWareInstruction(
-            encoder.Mem.pop,
-            8,
-            (ir_object.Dereference(reg_s2, 8),)
-        )
-    else:
-        yield encoder.HardWareInstruction(
-            encoder.Manip.mov,
-            8,
-            (reg_s8, ir_object.Dereference(reg_s2, 8))
+            op,
+            instr.size,
+            (reg, ir_object.Immediate(abs(instr.offset), instr.size), reg)
         )
 
 
@@ -291,48 +420,332 @@ def encode_instructions(obj: Scope, instrs: List[ir_object.IRObject]) -> List[en
     encoded = []
 
     for i in instrs:
-        spills = chain.from_iterable(process_spill(obj, x) for x in i.pre_instructions)
-        encoded.extend(spills)
+        encoded.extend(process_spills(obj, i.pre_instructions))
         encoded.extend(encoder.InstructionEncoder.encode_instr(i))
 
     return encoded
 
 
-def process_code(compiler: Compiler, reg_count) -> Tuple[Dict[str, int], Any]:
+def optimise_function(fn: FunctionDecl, opt_level: int):
+    """Optimise the desugared code of a function, optimisations are run on the code in SSA form."""
+    if not opt_level:
+        return
+
+    origins = to_ssa(fn)
+    propagate_constants(fn)
+    eliminate_dead_code(fn)
+    from_ssa(fn, origins)
+
+
+def allocate_function(fn: FunctionDecl, reg_count: int, regalloc: str = "greedy",
+                      opt_level: int = 0) -> RegisterUsage:
+    """Desugar a function and allocate it's registers.
+
+    :returns: The registers the function uses around the calls it makes, for choosing the registers functions save.
+    """
+    assign_variable_offsets(fn)
+
+    DesugarIR_Pre.desugar(fn)
+
+    optimise_function(fn, opt_level)
+
+    targets, address_taken = call_targets(fn.code)
+
+    allocator = allocators[regalloc](reg_count, fn.code)
+
+    # allocators can remove moves, so the blocks of the code are found again
+    invalidate_cfg(fn)
+
+    assign_spill_offsets(fn, allocator.spill_slot_count)
+
+    return register_usage(fn.code, targets, address_taken, function_cfg(fn))
+
+
+def encode_function(fn: FunctionDecl,
+                    saved_registers: Optional[Set[int]] = None) -> Tuple[str, List[InstrOrTarget], List[Relocation]]:
+    """Encode a function after it's registers have been allocated.
+
+    :param saved_registers: The registers to save in the prelude and restore on return,
+                            from :func:`register_usage.saved_registers`. Every register used is saved if not given.
+    :returns: The identifier of the function, it's encoded instructions
+              and the relocations for immediates that didn't fit in an argument.
+    """
+    insert_register_stores(fn, saved_registers)
+
+    DesugarIR_Post.desugar(fn)
+
+    relocations = relocate_immediates(fn.code)
+
+    return fn.identifier, encode_instructions(fn, fn.code), relocations
+
+
+def process_function(fn: FunctionDecl, reg_count: int, regalloc: str = "greedy",
+                     saved_registers: Optional[Set[int]] = None,
+                     opt_level: int = 0) -> Tuple[str, List[InstrOrTarget], List[Relocation]]:
+    """Run the backend over a single function.
+
+    Apart from choosing the registers they save, functions don't depend on each other or on the compiler
+    until they are packaged, so this can be run for each function in any order, or in another process.
+
+    :returns: The identifier of the function, it's encoded instructions
+              and the relocations for immediates that didn't fit in an argument.
+    """
+    allocate_function(fn, reg_count, regalloc, opt_level)
+    return encode_function(fn, saved_registers)
+
+
+def detach_jump_targets(instrs: List[InstrOrTarget]):
+    """Drop the links jump targets hold to the rest of the IR, so that they can be sent between processes."""
+    for i in instrs:
+        targets = [i] if isinstance(i, ir_object.JumpTarget) else i.args
+        for target in targets:
+            if isinstance(target, ir_object.JumpTarget):
+                target.parent = None
+                target.pre_instructions = []
+                target.closing_registers = set()
+                target.jumps_from = []
+                target.jumps_to = []
+
+
+def use_workers(functions: List[FunctionDecl], jobs: int) -> bool:
+    """Check if functions should be split between a pool of processes.
+
+    The workers are forked so that they inherit the functions instead of them being pickled,
+    where forking isn't available the functions are processed in this process.
+    """
+    return jobs > 1 and len(functions) > 1 and "fork" in multiprocessing.get_all_start_methods()
+
+
+class FunctionWorkers:
+    """Run the backend over a list of functions, in a pool of processes if more than one job is requested.
+
+    Every function is allocated before any is encoded, as the registers a function saves depend on the
+    functions calling it. Each function belongs to one of the processes, which keeps the functions it
+    allocates until they're encoded, so that no function is allocated twice.
+
+    Use as a context manager, the processes are stopped on leaving it.
+    """
+
+    def __init__(self, functions: List[FunctionDecl], reg_count: int, jobs: int = 1,
+                 regalloc: str = "greedy", opt_level: int = 0):
+        self.functions = functions
+        self.reg_count = reg_count
+        self.regalloc = regalloc
+        self.opt_level = opt_level
+        # the functions allocated in this process, by index
+        self.allocated: Set[int] = set()
+        self.connections = []
+        self.processes = []
+
+        if not use_workers(functions, jobs):
+            return
+
+        context = multiprocessing.get_context("fork")
+        for _ in range(min(jobs, len(functions))):
+            connection, child = context.Pipe()
+            process = context.Process(target=_run_worker, args=(self, child), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def __enter__(self) -> 'FunctionWorkers':
+        return self
+
+    def __exit__(self, *exc_info):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+    def run(self, request: str, index: int, arg: Any) -> Any:
+        """Run a request for a function in this process."""
+        fn = self.functions[index]
+
+        if request == "allocate":
+            self.allocated.add(index)
+            return allocate_function(fn, self.reg_count, self.regalloc, self.opt_level)
+
+        if index in self.allocated:
+            return encode_function(fn, arg)
+        return process_function(fn, self.reg_count, self.regalloc, arg, self.opt_level)
+
+    def map(self, request: str, indexes: List[int], args: List[Any]) -> List[Any]:
+        """Run a request for the functions at some indexes, in the processes they belong to.
+
+        :returns: The result for each function, in the same order.
+        """
+        if not self.connections:
+            return [self.run(request, index, arg) for index, arg in zip(indexes, args)]
+
+        shares: List[List[Tuple[int, int, Any]]] = [[] for _ in self.connections]
+        for position, (index, arg) in enumerate(zip(indexes, args)):
+            shares[index % len(self.connections)].append((position, index, arg))
+
+        for connection, share in zip(self.connections, shares):
+            connection.send((request, [(index, arg) for _, index, arg in share]))
+
+        results: List[Any] = [None] * len(indexes)
+        errors = []
+        for connection, share in zip(self.connections, shares):
+            failed, values = connection.recv()
+            if failed:
+                errors.append(values)
+                continue
+            for (position, _, _), value in zip(share, values):
+                results[position] = value
+
+        if errors:
+            raise errors[0]
+
+        return results
+
+    def allocate(self, indexes: List[int]) -> List[RegisterUsage]:
+        """Allocate registers for the functions at some indexes, returning the register usage of each in order."""
+        return self.map("allocate", indexes, [None] * len(indexes))
+
+    def process(self, indexes: List[int],
+                saved_registers: List[Optional[Set[int]]]) -> List[Tuple[str, List[InstrOrTarget], List[Relocation]]]:
+        """Encode the functions at some indexes, allocating those that aren't yet, returning the results in order.
+
+        :param saved_registers: The registers each function saves, see :func:`encode_function`.
+        """
+        return self.map("process", indexes, saved_registers)
+
+
+def _run_worker(workers: FunctionWorkers, connection):
+    """Run the requests sent to a worker process until it's told to stop."""
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        request, items = message
+        try:
+            results = [workers.run(request, index, arg) for index, arg in items]
+            if request == "process":
+                for result in results:
+                    detach_jump_targets(result[1])
+        except Exception as e:  # pylint: disable=broad-except
+            connection.send((True, e))
+        else:
+            connection.send((False, results))
+
+
+def function_fingerprint(compiler: Compiler, fn: FunctionDecl, reg_count: int,
+                         regalloc: str = "greedy", opt_level: int = 0) -> Optional[str]:
+    """Fingerprint a function for the function cache.
+
+    The code of a function depends on it's source, namespace and the globals it references.
+    The data it adds is referenced by index, so the indexes of that are included too.
+    It also depends on the code of the compiler, which :func:`cache_key` mixes in, so code and
+    register usage cached by a compiler with another encoder, allocator or save convention isn't reused.
+
+    :returns: The fingerprint, None if the function has no source.
+    """
+    if fn.ast is None:
+        return None
+
+    parts = [fn.namespace, fn.matched_region, str(reg_count), regalloc, str(opt_level)]
+
+    for ref in sorted(compiler.references.get(fn, ()), key=lambda r: (isinstance(r, int), str(r))):
+        if isinstance(ref, int):
+            parts.append(f"data {ref}")
+        else:
+            var = compiler.lookup_variable(ref)
+            parts.append(f"{ref}: {var.type} {var.lvalue_is_rvalue}")
+
+    return cache_key(*(i.encode("utf-8") for i in parts))
+
+
+def process_code(compiler: Compiler, reg_count, jobs: int = 1,
+                 cache: Optional[ArtifactCache] = None, regalloc: Optional[str] = None,
+                 opt_level: int = 0) -> Tuple[Dict[str, int], Any]:
     """Process the IR for a program ready to be emitted.
 
+    :param jobs: The number of processes to run the backend for functions in.
+    :param cache: A cache to reuse the encoded instructions of unchanged functions from.
+    :param regalloc: The name of the register allocator to use, one of :data:`allocators`.
+                     If not given it's picked by the optimisation level.
+    :param opt_level: How much to optimise the program, up to :data:`max_opt_level`.
     :returns: dictionary mapping identifiers to indexes, and the packaged objects in the order packed.
 
     Steps:
       1. Desugar IR
-      2. Allocate registers
-      3. Process Immediate values, optionally converting to globals
-      4. Flatten data, instructions, insert setup instructions and main jump
-      4. Resolve Jump targets, checking for main
-      5. Package into :class:`encoder.HardwareInstruction` objects
+      2. Optimise functions in SSA form, above optimisation level 0
+      3. Allocate registers, choosing the registers each function saves over the call graph
+      4. Process Immediate values, optionally converting to globals
+      5. Flatten data, instructions, insert setup instructions and main jump
+      6. Resolve Jump targets, checking for main
+      7. Package into :class:`encoder.HardwareInstruction` objects
       """
 
-    for o in compiler.compiled_objects:
-        DesugarIR_Pre.desugar(o)
+    if regalloc is None:
+        regalloc = "graph-colouring" if opt_level >= max_opt_level else "greedy"
 
-    functions, toplevel = allocate_code(compiler, reg_count)
+    functions, toplevel = group_fns_toplevel(compiler.compiled_objects)
+
+    for o in toplevel:
+        DesugarIR_Pre.desugar(o)
 
-    for fn in functions:
-        insert_register_stores(fn)
+    toplevel_usage = allocate_toplevel(compiler, toplevel, reg_count, regalloc)
 
-    # NOTE: This mutates the objects contained in 'functions' and 'toplevel' on the line above
-    for o in compiler.compiled_objects:
+    for o in toplevel:
         DesugarIR_Post.desugar(o)
 
     process_immediates(compiler, toplevel)
-    process_immediates(compiler, functions)
+
+    if cache is None:
+        keys = [None] * len(functions)
+    else:
+        keys = [function_fingerprint(compiler, fn, reg_count, regalloc, opt_level) for fn in functions]
+
+    with FunctionWorkers(functions, reg_count, jobs, regalloc, opt_level) as workers:
+        # the register usage of each function is needed before any can be encoded
+        usages = [key and cache.load("usage", key) for key in keys]
+
+        misses = [index for index, usage in enumerate(usages) if usage is None]
+        for index, usage in zip(misses, workers.allocate(misses)):
+            usages[index] = usage
+            if keys[index] is not None:
+                cache.store("usage", keys[index], usage)
+
+        saved = saved_registers({fn.identifier: usage for fn, usage in zip(functions, usages)}, toplevel_usage)
+        saves = [saved[fn.identifier] for fn in functions]
+
+        if cache is None:
+            processed = workers.process(list(range(len(functions))), saves)
+        else:
+            # functions with the same fingerprint are encoded the same unless they save different registers
+            keys = [key and cache_key(key.encode("utf-8"), bytes(sorted(save))) for key, save in zip(keys, saves)]
+            processed = [key and cache.load("function", key) for key in keys]
+
+            indexes = [index for index, result in enumerate(processed) if result is None]
+            results = workers.process(indexes, [saves[i] for i in indexes])
+
+            for index, result in zip(indexes, results):
+                processed[index] = result
+                if keys[index] is not None:
+                    detach_jump_targets(result[1])
+                    cache.store("function", keys[index], result)
+
+    # data for immediates is added in the order of the functions so the output doesn't depend on the job count
+    encoded_functions = []
+    for identifier, encoded, relocations in processed:
+        add_relocations(compiler, relocations)
+        encoded_functions.append((identifier, encoded))
 
     toplevel_instructions = process_toplevel(compiler, toplevel)
 
     encoded_toplevel = encode_instructions(compiler, toplevel_instructions)
 
-    encoded_functions = [(i.identifier, encode_instructions(i, i.code)) for i in functions]
-
     encoded_toplevel.extend([
         encoder.HardWareInstruction(encoder.Mem.call, 2, (DataReference("main"),)),
         encoder.HardWareInstruction(encoder.Manip.halt, 1, ())
@@ -358,6 +771,9 @@ def assemble_single(obj: Any) -> bytes:
         if isinstance(obj.to, (ir_object.Register, ir_object.AllocatedRegister)):
             return encoder.pack_param(obj.to.physical_register + encoder.SpecificRegisters.free_reg_offset, deref=True, reg=True)
 
+        if isinstance(obj.to, encoder.HardwareRegister):
+            return encoder.pack_param(obj.to.index, deref=True, reg=True)
+
     if isinstance(obj, ir_object.Immediate):
         return encoder.pack_param(obj.val)
 
@@ -374,14 +790,94 @@ def assemble_single(obj: Any) -> bytes:
 
 
 def assemble_instructions(packed_instructions: List[Any]) -> bytearray:
-    assembled = bytearray()
+    """Assemble packaged objects into the binary.
+
+    Instructions are encoded into runs of 16 bit words, broken up by raw data.
+    Once everything is encoded the size of the binary is known and the runs and data
+    are copied into it, so nothing is allocated for each instruction or parameter.
+    """
+    segments = []
+    words = array("H")
+    append = words.append
+
+    instruction_words = encoder.instruction_words
+    reg_offset = encoder.SpecificRegisters.free_reg_offset
+    HardWareInstruction = encoder.HardWareInstruction
+    HardwareMemoryLocation = encoder.HardwareMemoryLocation
+    HardwareRegister = encoder.HardwareRegister
+    Register, AllocatedRegister = ir_object.Register, ir_object.AllocatedRegister
+    Immediate, Dereference = ir_object.Immediate, ir_object.Dereference
 
     for i in packed_instructions:
-        if isinstance(i, encoder.HardWareInstruction):
-            assembled.extend(encoder.pack_instruction(i))
-            for arg in i.args:
-                assembled.extend(assemble_single(arg))
+        if type(i) is HardWareInstruction:
+            instr = i.instr
+            append(instruction_words[type(instr)][instr][i.size])
+            args = i.args
+
+        elif isinstance(i, list):
+            args = i
+
         else:
-            assembled.extend(assemble_single(i))
+            if words:
+                segments.append(words)
+                words = array("H")
+                append = words.append
+            segments.append(i)
+            continue
+
+        for arg in args:
+            # this is the innermost loop of assembly, so types are compared exactly.
+            # none of the objects of the ir are subclassed, only ints can be enums.
+            kind = type(arg)
+
+            if kind is Register or kind is AllocatedRegister:
+                append((arg.physical_register + reg_offset) | 0x8000)
+                continue
+
+            if kind is HardwareRegister:
+                append(arg.index | 0x8000)
+                continue
+
+            if kind is HardwareMemoryLocation:
+                append(arg.index)
+                continue
+
+            if kind is Immediate:
+                value = arg.val
+            elif kind is Dereference:
+                to = arg.to
+                if type(to) is Immediate:
+                    value = to.val | 0x4000
+                elif type(to) is Register or type(to) is AllocatedRegister:
+                    value = (to.physical_register + reg_offset) | 0xc000
+                elif type(to) is HardwareRegister:
+                    value = to.index | 0xc000
+                else:
+                    raise InternalCompileException(f"Could not assemble object: {arg} of type: {kind}")
+            elif isinstance(arg, int):
+                value = arg
+            else:
+                raise InternalCompileException(f"Could not assemble object: {arg} of type: {kind}")
+
+            # negative parameters are stored as two's complement,
+            # anything out of range is left for the array to raise on.
+            if value < 0:
+                value += 0x10000 if value >= -0x8000 else 0
+            append(value)
+
+    if words:
+        segments.append(words)
+
+    assembled = bytearray(sum(len(i) * i.itemsize if isinstance(i, array) else len(i)
+                              for i in segments))
+    offset = 0
+
+    for i in segments:
+        if isinstance(i, array):
+            if sys.byteorder != "little":
+                i.byteswap()
+            i = i.tobytes()
+        assembled[offset:offset + len(i)] = i
+        offset += len(i)
 
     return assembled
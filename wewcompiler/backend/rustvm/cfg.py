@@ -0,0 +1,378 @@
+"""Control flow graphs of IR code.
+
+The control flow graph of the code of an object is built when it's first needed with :func:`function_cfg`,
+and kept until a pass that changes the code drops it with :func:`invalidate_cfg`.
+"""
+
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from wewcompiler.objects import ir_object
+from wewcompiler.objects.base import StatementObject
+
+
+class BasicBlock:
+    """A run of instructions that is only entered at the top and only left at the bottom.
+
+    :index: Index of the block in the blocks of the code.
+    :start: Index of the first instruction of the block.
+    :end: Index of the last instruction of the block.
+    """
+
+    __slots__ = ("index", "start", "end", "successors", "predecessors")
+
+    def __init__(self, index: int, start: int, end: int):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.successors: List['BasicBlock'] = []
+        self.predecessors: List['BasicBlock'] = []
+
+    def add_successor(self, other: 'BasicBlock'):
+        self.successors.append(other)
+        other.predecessors.append(self)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.start}..{self.end}>"
+
+
+def halts(instr: ir_object.IRObject) -> bool:
+    """Check if an instruction is inline assembly halting the machine."""
+    return isinstance(instr, ir_object.MachineInstr) and instr.instr == "halt"
+
+
+def ends_block(instr: ir_object.IRObject) -> bool:
+    return isinstance(instr, (ir_object.Jump, ir_object.Return)) or halts(instr)
+
+
+def build_blocks(code: Sequence[ir_object.IRObject]) -> List[BasicBlock]:
+    """Split code into basic blocks and link them together.
+
+    Blocks start at jump targets and after jumps, returns and halts.
+    Control flow reaches a block by falling through from the one before, unless that
+    ends in a return, a halt or an unconditional jump, or by a jump to the target it starts with.
+
+    :returns: The blocks in the order of the code.
+    """
+    if not code:
+        return []
+
+    starts = [0]
+    for index, instr in enumerate(code):
+        if index and isinstance(instr, ir_object.JumpTarget) and starts[-1] != index:
+            starts.append(index)
+        if ends_block(instr) and index + 1 < len(code):
+            starts.append(index + 1)
+
+    blocks = [BasicBlock(index, start, end - 1)
+              for index, (start, end) in enumerate(zip(starts, [*starts[1:], len(code)]))]
+
+    # jump targets don't hash, they're looked up by identity
+    targets: Dict[int, BasicBlock] = {id(code[block.start]): block for block in blocks}
+
+    for index, block in enumerate(blocks):
+        last = code[block.end]
+
+        if isinstance(last, ir_object.Jump):
+            block.add_successor(targets[id(last.location)])
+            if last.condition is None:
+                continue
+        elif isinstance(last, ir_object.Return) or halts(last):
+            continue
+
+        if index + 1 < len(blocks):
+            block.add_successor(blocks[index + 1])
+
+    return blocks
+
+
+def reverse_postorder(blocks: Sequence[BasicBlock]) -> List[BasicBlock]:
+    """Order the blocks reachable from the first so that each comes before it's successors,
+    apart from along back edges."""
+    if not blocks:
+        return []
+
+    order = []
+    visited = {0}
+    # depth first, with a stack of blocks and the index of the next successor to visit
+    stack = [(blocks[0], 0)]
+
+    while stack:
+        block, n = stack.pop()
+        if n < len(block.successors):
+            stack.append((block, n + 1))
+            succ = block.successors[n]
+            if succ.index not in visited:
+                visited.add(succ.index)
+                stack.append((succ, 0))
+        else:
+            order.append(block)
+
+    order.reverse()
+    return order
+
+
+def dominators(blocks: Sequence[BasicBlock]) -> List[Optional[int]]:
+    """Find the immediate dominator of each block, by the iterative algorithm of Cooper, Harvey and Kennedy.
+
+    A block dominates another if every path from the first block to the other passes through it.
+
+    :returns: The index of the immediate dominator of each block, in the order of the blocks.
+              The first block is it's own immediate dominator, blocks that can't be reached have none.
+    """
+    order = reverse_postorder(blocks)
+    position = {block.index: n for n, block in enumerate(order)}
+
+    idom: List[Optional[int]] = [None] * len(blocks)
+    if not order:
+        return idom
+    idom[0] = 0
+
+    def intersect(a: int, b: int) -> int:
+        while a != b:
+            while position[a] > position[b]:
+                a = idom[a]
+            while position[b] > position[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for block in order[1:]:
+            new = None
+            for pred in block.predecessors:
+                if idom[pred.index] is None:
+                    continue
+                new = pred.index if new is None else intersect(pred.index, new)
+            if idom[block.index] != new:
+                idom[block.index] = new
+                changed = True
+
+    return idom
+
+
+def dominator_tree_order(idom: Sequence[Optional[int]]) -> List[Optional[Tuple[int, int]]]:
+    """Number the blocks in the order a depth first walk of the dominator tree enters and leaves them.
+
+    A block dominates another if it's entered before and left after the other, so this
+    answers if one block dominates another without walking up the tree.
+
+    :param idom: The immediate dominators of the blocks, from :func:`dominators`.
+    :returns: When each block is entered and left, blocks that can't be reached have none.
+    """
+    children: List[List[int]] = [[] for _ in idom]
+    for n, parent in enumerate(idom):
+        if parent is not None and n != 0:
+            children[parent].append(n)
+
+    order: List[Optional[Tuple[int, int]]] = [None] * len(idom)
+    if not idom:
+        return order
+
+    entered = [0] * len(idom)
+    count = 0
+    stack = [(0, False)]
+
+    while stack:
+        n, leaving = stack.pop()
+        if leaving:
+            order[n] = (entered[n], count)
+        else:
+            entered[n] = count
+            stack.append((n, True))
+            stack.extend((child, False) for child in reversed(children[n]))
+        count += 1
+
+    return order
+
+
+def dominates(order: Sequence[Optional[Tuple[int, int]]], a: int, b: int) -> bool:
+    """Check if every path from the first block to one block passes through another.
+
+    :param order: The order of the dominator tree, from :func:`dominator_tree_order`.
+    :param a: Index of the block that may dominate.
+    :param b: Index of the block that may be dominated.
+    """
+    if order[a] is None or order[b] is None:
+        return False
+    return order[a][0] <= order[b][0] and order[b][1] <= order[a][1]
+
+
+def dominance_frontiers(blocks: Sequence[BasicBlock], idom: Sequence[Optional[int]]) -> List[Set[int]]:
+    """Find the dominance frontier of each block, the blocks where it's dominance ends.
+
+    A block is in the frontier of another if the other dominates one of it's predecessors,
+    but doesn't strictly dominate it.
+
+    :param idom: The immediate dominators of the blocks, from :func:`dominators`.
+    :returns: The indexes of the blocks in the frontier of each block, in the order of the blocks.
+    """
+    frontiers: List[Set[int]] = [set() for _ in blocks]
+
+    for block in blocks:
+        if idom[block.index] is None or len(block.predecessors) < 2:
+            continue
+        for pred in block.predecessors:
+            runner = pred.index
+            if idom[runner] is None:
+                continue
+            # walk up from each predecessor to the block's immediate dominator
+            while runner != idom[block.index]:
+                frontiers[runner].add(block.index)
+                if runner == 0:
+                    break
+                runner = idom[runner]
+
+    return frontiers
+
+
+class Loop:
+    """A natural loop, the blocks that can reach a jump back to a block that dominates them without
+    passing through it.
+
+    :header: Index of the block the loop is entered through, which dominates the rest of the loop.
+    :blocks: Indexes of the blocks of the loop, including the header.
+    :back_edges: Indexes of the blocks that jump back to the header.
+    """
+
+    __slots__ = ("header", "blocks", "back_edges")
+
+    def __init__(self, header: int):
+        self.header = header
+        self.blocks: Set[int] = {header}
+        self.back_edges: List[int] = []
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.header}: {sorted(self.blocks)}>"
+
+
+def natural_loops(blocks: Sequence[BasicBlock], idom: Sequence[Optional[int]] = None) -> List[Loop]:
+    """Find the natural loops of some blocks, loops with the same header are merged.
+
+    :param idom: The immediate dominators of the blocks, from :func:`dominators`.
+    :returns: The loops, in the order of their headers.
+    """
+    if idom is None:
+        idom = dominators(blocks)
+    order = dominator_tree_order(idom)
+
+    loops: Dict[int, Loop] = {}
+
+    for block in blocks:
+        if idom[block.index] is None:
+            continue
+        for succ in block.successors:
+            if not dominates(order, succ.index, block.index):
+                continue
+
+            loop = loops.setdefault(succ.index, Loop(succ.index))
+            loop.back_edges.append(block.index)
+
+            # walk back from the jump, the header stops the walk as it's already in the loop
+            stack = [block.index]
+            while stack:
+                n = stack.pop()
+                if n in loop.blocks:
+                    continue
+                loop.blocks.add(n)
+                stack.extend(pred.index for pred in blocks[n].predecessors)
+
+    return [loops[header] for header in sorted(loops)]
+
+
+def loop_depths(blocks: Sequence[BasicBlock], loops: Sequence[Loop] = None) -> List[int]:
+    """Find how many loops each block is inside of.
+
+    :param loops: The natural loops of the blocks, from :func:`natural_loops`.
+    :returns: The depth of each block, in the order of the blocks.
+    """
+    if loops is None:
+        loops = natural_loops(blocks)
+
+    depths = [0] * len(blocks)
+    for loop in loops:
+        for n in loop.blocks:
+            depths[n] += 1
+
+    return depths
+
+
+class ControlFlowGraph:
+    """The basic blocks of some code, linked together.
+
+    Dominators and loops are found when they're first needed.
+
+    :code: The code the graph is of.
+    :blocks: The basic blocks of the code, in order.
+    """
+
+    __slots__ = ("code", "blocks", "_idom", "_order", "_frontiers", "_loops", "_depths")
+
+    def __init__(self, code: Sequence[ir_object.IRObject]):
+        self.code = code
+        self.blocks = build_blocks(code)
+        self._idom: Optional[List[Optional[int]]] = None
+        self._order: Optional[List[Optional[Tuple[int, int]]]] = None
+        self._frontiers: Optional[List[Set[int]]] = None
+        self._loops: Optional[List[Loop]] = None
+        self._depths: Optional[List[int]] = None
+
+    @property
+    def idom(self) -> List[Optional[int]]:
+        """The index of the immediate dominator of each block, see :func:`dominators`."""
+        if self._idom is None:
+            self._idom = dominators(self.blocks)
+        return self._idom
+
+    @property
+    def frontiers(self) -> List[Set[int]]:
+        """The dominance frontier of each block, see :func:`dominance_frontiers`."""
+        if self._frontiers is None:
+            self._frontiers = dominance_frontiers(self.blocks, self.idom)
+        return self._frontiers
+
+    @property
+    def loops(self) -> List[Loop]:
+        """The natural loops of the code, see :func:`natural_loops`."""
+        if self._loops is None:
+            self._loops = natural_loops(self.blocks, self.idom)
+        return self._loops
+
+    @property
+    def loop_depths(self) -> List[int]:
+        """How many loops each block is inside of."""
+        if self._depths is None:
+            self._depths = loop_depths(self.blocks, self.loops)
+        return self._depths
+
+    def reachable(self, block: BasicBlock) -> bool:
+        return self.idom[block.index] is not None
+
+    def dominates(self, a: BasicBlock, b: BasicBlock) -> bool:
+        """Check if every path from the first block to block b passes through block a."""
+        if self._order is None:
+            self._order = dominator_tree_order(self.idom)
+        return dominates(self._order, a.index, b.index)
+
+    def block_of(self, index: int) -> BasicBlock:
+        """Find the block an instruction is in, by the index of the instruction."""
+        low, high = 0, len(self.blocks) - 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.blocks[mid].start <= index:
+                low = mid
+            else:
+                high = mid - 1
+        return self.blocks[low]
+
+
+def function_cfg(obj: StatementObject) -> ControlFlowGraph:
+    """Get the control flow graph of the code of an object, building it if the code changed since it was last built."""
+    if obj.context.cfg is None or obj.context.cfg.code is not obj.context.code:
+        obj.context.cfg = ControlFlowGraph(obj.context.code)
+    return obj.context.cfg
+
+
+def invalidate_cfg(obj: StatementObject):
+    """Drop the control flow graph of the code of an object, passes that change the code call this."""
+    obj.context.cfg = None
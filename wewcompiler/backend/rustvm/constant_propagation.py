@@ -0,0 +1,454 @@
+"""Sparse conditional constant propagation over code in SSA form.
+
+Registers start with no known value and are lowered to a constant, then to a value that isn't constant,
+as the instructions writing them are evaluated. Only blocks reached along edges that can be taken are
+evaluated, a jump on a constant is only taken one way, so registers written in blocks that can't be
+reached don't stop a register from being constant where paths meet.
+
+Instructions are evaluated as the virtual machine runs them, on values of the size of the instruction with
+the result truncated to that size. Divisions by zero, shifts as wide as the value and other operations the
+machine may fault on aren't folded. A register only has a known value when read at a size no larger than
+it was written at, the bytes above those written aren't known.
+
+Once the values are found, registers with constant values are replaced by immediates where they're read,
+instructions writing them are removed once nothing reads them, and jumps on constants are removed or made
+unconditional. Blocks this leaves unreachable are left for dead code elimination to remove.
+"""
+
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from wewcompiler.backend.rustvm.cfg import BasicBlock, function_cfg, invalidate_cfg
+from wewcompiler.backend.rustvm.ssa import Phi, out_edges
+from wewcompiler.objects import ir_object
+from wewcompiler.objects.base import StatementObject
+from wewcompiler.objects.ir_object import CompType, Immediate, IRParam, Register
+
+#: A constant value and the size it was written at.
+Constant = Tuple[int, int]
+
+#: The value of a register that isn't constant.
+VARYING = "varying"
+
+Value = Union[Constant, str, None]
+
+#: The largest immediate that fits in an argument, larger immediates are moved to data
+#: which can't be done for the address of a dereference.
+max_address = 0x3FFF
+
+#: Instructions that do nothing but write a register.
+pure_instructions = (ir_object.Mov, ir_object.Binary, ir_object.Unary, ir_object.SetCmp, ir_object.Resize, Phi)
+
+
+def mask(value: int, size: int) -> int:
+    return value & ((1 << (8 * size)) - 1)
+
+
+def signed(value: int, size: int) -> int:
+    value = mask(value, size)
+    if value >> (8 * size - 1):
+        value -= 1 << (8 * size)
+    return value
+
+
+def truncating_divide(left: int, right: int) -> int:
+    """Divide rounding towards zero."""
+    quotient = abs(left) // abs(right)
+    return -quotient if (left < 0) != (right < 0) else quotient
+
+
+def fold_binary(op: str, left: int, right: int, size: int) -> Optional[int]:
+    """Compute a binary operation on values of a size, None if the operation isn't folded."""
+    bits = 8 * size
+    sleft, sright = signed(left, size), signed(right, size)
+
+    if op in ("udiv", "idiv", "umod", "imod") and right == 0:
+        return None
+    if op in ("idiv", "imod") and sleft == -(1 << (bits - 1)) and sright == -1:
+        return None
+    if op in ("shl", "shr", "sar") and right >= bits:
+        return None
+
+    if op == "add":
+        result = left + right
+    elif op == "sub":
+        result = left - right
+    elif op == "mul":
+        result = left * right
+    elif op == "udiv":
+        result = left // right
+    elif op == "idiv":
+        result = truncating_divide(sleft, sright)
+    elif op == "umod":
+        result = left % right
+    elif op == "imod":
+        result = sleft - sright * truncating_divide(sleft, sright)
+    elif op == "shl":
+        result = left << right
+    elif op == "shr":
+        result = left >> right
+    elif op == "sar":
+        result = sleft >> right
+    elif op == "and":
+        result = left & right
+    elif op == "or":
+        result = left | right
+    elif op == "xor":
+        result = left ^ right
+    else:
+        return None
+
+    return mask(result, size)
+
+
+def fold_unary(op: str, arg: int, size: int) -> Optional[int]:
+    """Compute a unary operation on a value of a size, None if the operation isn't folded."""
+    sarg = signed(arg, size)
+
+    if op in ("neg", "pos") and sarg == -(1 << (8 * size - 1)):
+        return None
+
+    if op == "binv":
+        result = ~arg
+    elif op == "linv":
+        result = int(arg == 0)
+    elif op == "neg":
+        result = -sarg
+    elif op == "pos":
+        result = abs(sarg)
+    else:
+        return None
+
+    return mask(result, size)
+
+
+def fold_compare(op: CompType, left: int, right: int, size: int) -> bool:
+    """Compute the result of a comparison of two values of a size."""
+    sleft, sright = signed(left, size), signed(right, size)
+    return {
+        CompType.uncond: True,
+        CompType.lt: left < right,
+        CompType.leq: left <= right,
+        CompType.eq: left == right,
+        CompType.lts: sleft < sright,
+        CompType.leqs: sleft <= sright,
+        CompType.geq: left >= right,
+        CompType.gt: left > right,
+        CompType.neq: left != right,
+        CompType.geqs: sleft >= sright,
+        CompType.gts: sleft > sright,
+    }[op]
+
+
+def fold_resize(value: int, from_size: int, to_size: int, sign: bool) -> int:
+    """Resize a value, sign extending it if it's signed."""
+    if sign:
+        value = signed(value, from_size)
+    return mask(value, to_size)
+
+
+def flag_readers(code: List[ir_object.IRObject], blocks: Sequence[BasicBlock]) -> Dict[int, int]:
+    """Find the comparison each comparison result is set from.
+
+    Comparisons set flags that the next comparison result in the same block reads,
+    calls and inline assembly may set them too.
+
+    :returns: The index of the comparison read by each comparison result, by the index of the result.
+    """
+    readers: Dict[int, int] = {}
+
+    for block in blocks:
+        compare = None
+        for index in range(block.start, block.end + 1):
+            instr = code[index]
+            if isinstance(instr, ir_object.Compare):
+                compare = index
+            elif isinstance(instr, (ir_object.Call, ir_object.MachineInstr)):
+                compare = None
+            elif isinstance(instr, ir_object.SetCmp) and compare is not None:
+                readers[index] = compare
+
+    return readers
+
+
+def propagate_constants(obj: StatementObject):
+    """Propagate and fold the constants of the code of an object in SSA form, in place."""
+    code = obj.context.code
+    blocks = function_cfg(obj).blocks
+
+    if not blocks:
+        return
+
+    owner: List[int] = []
+    for block in blocks:
+        owner.extend([block.index] * (block.end - block.start + 1))
+
+    jumps = {id(instr): index for index, instr in enumerate(code) if isinstance(instr, ir_object.Jump)}
+
+    # registers of inline assembly may be written to without saying so
+    fixed = {reg.reg for instr in code if isinstance(instr, ir_object.MachineInstr)
+             for reg in instr.touched_registers}
+
+    definitions: Dict[int, int] = {}
+    uses: Dict[int, List[int]] = {}
+    for index, instr in enumerate(code):
+        for reg in instr.defined_registers:
+            # a register written more than once isn't in SSA form
+            definitions[reg.reg] = None if reg.reg in definitions else index
+        for reg in instr.used_registers:
+            uses.setdefault(reg.reg, []).append(index)
+
+    readers = flag_readers(code, blocks)
+    compares: Dict[int, List[int]] = {}
+    for reader, compare in readers.items():
+        compares.setdefault(compare, []).append(reader)
+
+    values: Dict[int, Value] = {}
+    executable: Set[int] = set()
+    # edges that can be taken, by the block they leave and if they're taken by a jump
+    taken: Set[Tuple[int, bool]] = set()
+
+    flow_work: List[Tuple[int, int, Optional[bool]]] = [(-1, 0, None)]
+    value_work: List[int] = []
+
+    def read(arg: IRParam, size: int) -> Value:
+        if isinstance(arg, Immediate):
+            return mask(arg.val, size), size
+        if not isinstance(arg, Register) or arg.reg in fixed or definitions.get(arg.reg) is None:
+            return VARYING
+
+        value = values.get(arg.reg)
+        if value is None or value is VARYING:
+            return value
+        if size > value[1]:
+            return VARYING
+        return mask(value[0], size), size
+
+    def fold(fn, size: int, *args: Value) -> Value:
+        if VARYING in args:
+            return VARYING
+        if None in args:
+            return None
+        result = fn(*(value for value, _ in args))
+        return VARYING if result is None else (mask(result, size), size)
+
+    def evaluate(index: int) -> Value:
+        instr = code[index]
+
+        if isinstance(instr, Phi):
+            found = None
+            for edge, arg in instr.args:
+                pred = owner[index] - 1 if edge is None else owner[jumps[id(edge)]]
+                if (pred, edge is not None) not in taken:
+                    continue
+                value = read(arg, instr.to.size)
+                if value is None:
+                    continue
+                if value is VARYING or (found is not None and value != found):
+                    return VARYING
+                found = value
+            return found
+
+        if isinstance(instr, ir_object.Mov):
+            return fold(lambda v: v, instr.to.size, read(instr.from_, instr.to.size))
+
+        if isinstance(instr, ir_object.Binary):
+            size = instr.left.size
+            return fold(lambda l, r: fold_binary(instr.op, l, r, size), size,
+                        read(instr.left, size), read(instr.right, size))
+
+        if isinstance(instr, ir_object.Unary):
+            size = instr.arg.size
+            return fold(lambda v: fold_unary(instr.op, v, size), size, read(instr.arg, size))
+
+        if isinstance(instr, ir_object.Resize):
+            return fold(lambda v: fold_resize(v, instr.from_.size, instr.to.size, instr.from_.sign),
+                        instr.to.size, read(instr.from_, instr.from_.size))
+
+        if isinstance(instr, ir_object.SetCmp) and index in readers:
+            compare = code[readers[index]]
+            size = compare.left.size
+            return fold(lambda l, r: int(fold_compare(instr.op, l, r, size)), instr.dest.size,
+                        read(compare.left, size), read(compare.right, size))
+
+        return VARYING
+
+    def visit(index: int):
+        instr = code[index]
+
+        if isinstance(instr, ir_object.Compare):
+            for reader in compares.get(index, ()):
+                visit(reader)
+            return
+
+        if index == blocks[owner[index]].end:
+            leave(owner[index])
+
+        for reg in instr.defined_registers:
+            if reg.reg in fixed or definitions.get(reg.reg) is None:
+                continue
+            value, old = evaluate(index), values.get(reg.reg)
+            if value is None or value == old or old is VARYING:
+                continue
+            # values are only lowered, a register written with different constants isn't constant
+            values[reg.reg] = value if old is None else VARYING
+            value_work.append(reg.reg)
+
+    def leave(n: int):
+        """Add the edges leaving a block that can be taken."""
+        block = blocks[n]
+        last = code[block.end]
+
+        for edge, succ in out_edges(code, block):
+            if edge is not None and last.condition is not None:
+                condition = read(last.condition, last.condition.size)
+                if condition is None or (condition is not VARYING and not condition[0]):
+                    continue
+            elif edge is None and isinstance(last, ir_object.Jump):
+                condition = read(last.condition, last.condition.size)
+                if condition is None or (condition is not VARYING and condition[0]):
+                    continue
+            flow_work.append((n, succ.index, edge is not None))
+
+    while flow_work or value_work:
+        while flow_work:
+            pred, n, by_jump = flow_work.pop()
+            if pred >= 0:
+                if (pred, by_jump) in taken:
+                    continue
+                taken.add((pred, by_jump))
+
+            block = blocks[n]
+            if n in executable:
+                # only the phis can change with another edge in
+                for index in range(block.start, block.end + 1):
+                    if isinstance(code[index], Phi):
+                        visit(index)
+                continue
+
+            executable.add(n)
+            for index in range(block.start, block.end + 1):
+                visit(index)
+
+        while value_work:
+            for index in uses.get(value_work.pop(), ()):
+                if owner[index] in executable:
+                    visit(index)
+
+    constants = {reg: value for reg, value in values.items() if value is not None and value is not VARYING}
+
+    replace_constants(code, constants)
+    fold_jumps(code, blocks, executable, constants, owner)
+    remove_folded(code, constants, definitions, readers)
+
+    invalidate_cfg(obj)
+
+
+def constant_argument(arg: IRParam, constants: Dict[int, Constant]) -> IRParam:
+    """Get the immediate to replace a register argument with, or the argument if it isn't constant."""
+    if isinstance(arg, Register) and arg.reg in constants:
+        value, size = constants[arg.reg]
+        if arg.size <= size:
+            return Immediate(mask(value, arg.size), arg.size)
+
+    if (isinstance(arg, ir_object.Dereference) and isinstance(arg.to, Register)
+            and arg.to.reg in constants):
+        value, size = constants[arg.to.reg]
+        if arg.to.size <= size and mask(value, arg.to.size) <= max_address:
+            return ir_object.Dereference(Immediate(mask(value, arg.to.size), arg.to.size), arg.size)
+
+    return arg
+
+
+def replace_constants(code: List[ir_object.IRObject], constants: Dict[int, Constant]):
+    """Replace the registers with constant values read by instructions with immediates."""
+    for instr in code:
+        if isinstance(instr, Phi):
+            instr.args = [(edge, constant_argument(arg, constants)) for edge, arg in instr.args]
+            continue
+
+        # calls and inline assembly are left to use registers, resizes need to know the sign of their argument
+        if isinstance(instr, (ir_object.Call, ir_object.MachineInstr, ir_object.Resize, ir_object.Jump)):
+            continue
+
+        for attr in instr.touched_regs:
+            arg = getattr(instr, attr)
+            if attr in instr.written_regs and isinstance(arg, Register):
+                continue
+            replaced = constant_argument(arg, constants)
+            if replaced is not arg:
+                setattr(instr, attr, replaced)
+
+
+def fold_jumps(code: List[ir_object.IRObject], blocks: Sequence[BasicBlock], executable: Set[int],
+               constants: Dict[int, Constant], owner: List[int]):
+    """Make jumps on constants that are reached unconditional, or remove them if they're never taken.
+
+    The arguments phis take along the edges that are removed are removed with them.
+    """
+    for index, instr in enumerate(code):
+        if not isinstance(instr, ir_object.Jump) or owner[index] not in executable:
+            continue
+
+        condition = instr.condition
+        if not isinstance(condition, Register) or condition.reg not in constants:
+            continue
+        value, size = constants[condition.reg]
+        if condition.size > size:
+            continue
+
+        removed = None
+        for edge, succ in out_edges(code, blocks[owner[index]]):
+            if (edge is None) == bool(mask(value, condition.size)):
+                removed = edge, succ
+
+        if removed is None:
+            continue
+
+        edge, succ = removed
+        for phi in (i for i in code[succ.start:succ.end + 1] if isinstance(i, Phi)):
+            phi.remove_edge(edge)
+
+        if edge is None:
+            instr.condition = None
+        else:
+            code[index] = None
+
+
+def remove_folded(code: List[ir_object.IRObject], constants: Dict[int, Constant],
+                  definitions: Dict[int, Optional[int]], readers: Dict[int, int]):
+    """Move constants into the registers still read instead of computing them, and remove those that aren't read.
+
+    Comparisons are removed once all the results read from them are folded.
+    """
+    folded: Set[int] = set()
+
+    for reg, (value, size) in constants.items():
+        index = definitions.get(reg)
+        if index is None or not isinstance(code[index], pure_instructions):
+            continue
+
+        instr = code[index]
+        folded.add(index)
+
+        if not isinstance(instr, Phi) and not (isinstance(instr, ir_object.Mov)
+                                               and isinstance(instr.from_, Immediate)):
+            to = instr.defined_registers[0]
+            moved = ir_object.Mov(Register(reg, size, to.sign), Immediate(value, size))
+            moved.parent = instr.parent
+            code[index] = moved
+
+    # constants are moved in without reading anything, so removing them doesn't leave others unread
+    read = {reg.reg for instr in code if instr is not None for reg in instr.used_registers}
+    for index in folded:
+        if code[index].defined_registers[0].reg not in read:
+            code[index] = None
+
+    compares: Dict[int, List[int]] = {}
+    for reader, compare in readers.items():
+        compares.setdefault(compare, []).append(reader)
+
+    for compare, results in compares.items():
+        if all(result in folded for result in results):
+            code[compare] = None
+
+    code[:] = [instr for instr in code if instr is not None]
@@ -0,0 +1,170 @@
+"""Dead code elimination over code in SSA form.
+
+Blocks that can't be reached from the start of the code are removed, with the arguments phis take along the
+edges leaving them. This removes code after returns and halts, and the arms of branches on constants once
+constant propagation has made the jumps into them unconditional or removed them. Jumps to the instruction
+after them are then removed, the edges they took fall through instead.
+
+Instructions that do nothing but write registers are removed unless a register they write is read by an
+instruction that isn't removed, starting from the instructions that do something else and working back
+through the registers they read. Registers written around a loop but never read outside it are removed with
+the loop's other instructions. Comparisons are removed with the comparison results read from them, calls
+aren't removed but no longer move their result out of the return register if it isn't read.
+
+The epilogs of nested scopes mark where the variables of the scope stop being live when stack slots are
+shared, so epilogs of scopes that are entered but only left in code that can't be reached are kept.
+"""
+
+from typing import Dict, List, Set
+
+from wewcompiler.backend.rustvm.cfg import function_cfg, invalidate_cfg
+from wewcompiler.backend.rustvm.constant_propagation import flag_readers, pure_instructions
+from wewcompiler.backend.rustvm.ssa import block_phis, out_edges
+from wewcompiler.objects import ir_object
+from wewcompiler.objects.base import StatementObject
+from wewcompiler.objects.ir_object import Register
+
+
+def remove_unreachable(obj: StatementObject):
+    """Remove the blocks of the code of an object in SSA form that can't be reached, in place."""
+    code = obj.context.code
+    cfg = function_cfg(obj)
+    blocks, idom = cfg.blocks, cfg.idom
+
+    # the first block is it's own immediate dominator, only blocks that can't be reached have none
+    reachable = [n is not None for n in idom]
+    if all(reachable):
+        return
+
+    for block in blocks:
+        if reachable[block.index]:
+            continue
+        for edge, succ in out_edges(code, block):
+            if reachable[succ.index]:
+                for phi in block_phis(code, succ):
+                    phi.remove_edge(edge)
+
+    # scopes are looked up by identity
+    entered: Set[int] = set()
+    left: Set[int] = set()
+    for block in blocks:
+        if not reachable[block.index]:
+            continue
+        for instr in code[block.start:block.end + 1]:
+            if isinstance(instr, ir_object.Prelude):
+                entered.add(id(instr.scope))
+            elif isinstance(instr, ir_object.Epilog):
+                left.add(id(instr.scope))
+
+    never_left = entered - left
+
+    def kept(instr: ir_object.IRObject) -> bool:
+        return (isinstance(instr, ir_object.Epilog) and instr.scope is not obj
+                and id(instr.scope) in never_left)
+
+    new_code = []
+    for block in blocks:
+        instrs = code[block.start:block.end + 1]
+        if reachable[block.index]:
+            new_code.extend(instrs)
+        else:
+            new_code.extend(filter(kept, instrs))
+
+    code[:] = new_code
+
+    invalidate_cfg(obj)
+
+
+def remove_jumps_to_next(obj: StatementObject):
+    """Remove the jumps of the code of an object in SSA form to the instruction after them, in place.
+
+    The arguments phis take along the edges of the jumps are taken along the edge falling through instead.
+    A conditional jump is kept if a phi takes a different argument along it than along the edge falling through,
+    as constant propagation can leave the two edges into a block with different arguments.
+    """
+    code = obj.context.code
+    blocks = function_cfg(obj).blocks
+
+    removed = False
+    for block in blocks[:-1]:
+        jump = code[block.end]
+        if not isinstance(jump, ir_object.Jump) or code[block.end + 1] is not jump.location:
+            continue
+
+        phis = block_phis(code, blocks[block.index + 1])
+        if jump.condition is not None and any(phi.arg_for(jump) != phi.arg_for(None) for phi in phis):
+            continue
+
+        for phi in phis:
+            phi.args = [(None, arg) if edge is jump else (edge, arg)
+                        for edge, arg in phi.args if edge is not None]
+
+        code[block.end] = None
+        removed = True
+
+    if not removed:
+        return
+
+    code[:] = [instr for instr in code if instr is not None]
+
+    invalidate_cfg(obj)
+
+
+def remove_dead_instructions(obj: StatementObject):
+    """Remove the instructions of the code of an object that write registers that aren't read, in place."""
+    code = obj.context.code
+    blocks = function_cfg(obj).blocks
+
+    readers = flag_readers(code, blocks)
+    compares = set(readers.values())
+
+    definitions: Dict[int, List[int]] = {}
+    for index, instr in enumerate(code):
+        for reg in instr.defined_registers:
+            definitions.setdefault(reg.reg, []).append(index)
+
+    def needed(instr: ir_object.IRObject, index: int) -> bool:
+        # comparisons that no comparison result reads from may be read by inline assembly
+        if isinstance(instr, ir_object.Compare):
+            return index not in compares
+        return not isinstance(instr, pure_instructions) or not instr.defined_registers
+
+    live = [False] * len(code)
+    worklist = []
+
+    def mark(index: int):
+        if not live[index]:
+            live[index] = True
+            worklist.append(index)
+
+    for index, instr in enumerate(code):
+        if needed(instr, index):
+            mark(index)
+
+    while worklist:
+        index = worklist.pop()
+        for reg in code[index].used_registers:
+            for definition in definitions.get(reg.reg, ()):
+                mark(definition)
+        if index in readers:
+            mark(readers[index])
+
+    read = {reg.reg for index, instr in enumerate(code) if live[index] for reg in instr.used_registers}
+    for instr in code:
+        if (isinstance(instr, ir_object.Call) and isinstance(instr.result, Register)
+                and instr.result.reg not in read):
+            instr.result = None
+
+    if all(live):
+        return
+
+    code[:] = [instr for index, instr in enumerate(code) if live[index]]
+
+    invalidate_cfg(obj)
+
+
+def eliminate_dead_code(obj: StatementObject):
+    """Remove the code of an object in SSA form that can't be reached or does nothing, in place."""
+    remove_unreachable(obj)
+    remove_jumps_to_next(obj)
+    remove_dead_instructions(obj)
@@ -2,6 +2,7 @@ from itertools import chain
 from typing import Iterable
 
 from wewcompiler.backend.rustvm import encoder
+from wewcompiler.backend.rustvm.cfg import invalidate_cfg
 from wewcompiler.objects import ir_object
 from wewcompiler.objects.variable import DataReference
 from wewcompiler.objects.base import StatementObject, CompileContext
@@ -22,6 +23,7 @@ class Desugarer(Emitter):
             cls.method_for(ir)(obj.context, ir)
             for ir in obj.context.code
         )
+        invalidate_cfg(obj)
 
 
 class DesugarIR_Post(Desugarer):
@@ -38,8 +40,11 @@ class DesugarIR_Post(Desugarer):
 
     @emits(ir_object.Prelude)
     def emit_prelude(cls, ctx: CompileContext, pre: ir_object.Prelude):  # pylint: disable=unused-argument
-        # vm enters function with base pointer and stack pointer equal
-        yield ir_object.Binary.add(encoder.SpecificRegisters.stk, ir_object.Immediate(pre.scope.size, 8))
+        # vm enters function with base pointer and stack pointer equal.
+        # variables of nested scopes are placed in the function's frame, so they have no frame of their own,
+        # and neither do functions without variables or spills
+        if pre.scope.size:
+            yield ir_object.Binary.add(encoder.SpecificRegisters.stk, ir_object.Immediate(pre.scope.size, 8))
         for reg in pre.scope.used_hw_regs:
             yield ir_object.Push(ir_object.AllocatedRegister(8, False, reg))
 
@@ -47,7 +52,8 @@ class DesugarIR_Post(Desugarer):
     def emit_epilog(cls, ctx: CompileContext, epi: ir_object.Epilog):  # pylint: disable=unused-argument
         for reg in reversed(epi.scope.used_hw_regs):
             yield ir_object.Pop(ir_object.AllocatedRegister(8, False, reg))
-        yield ir_object.Binary.sub(encoder.SpecificRegisters.stk, ir_object.Immediate(epi.scope.size, 8))
+        if epi.scope.size:
+            yield ir_object.Binary.sub(encoder.SpecificRegisters.stk, ir_object.Immediate(epi.scope.size, 8))
 
 
 class DesugarIR_Pre(Desugarer):
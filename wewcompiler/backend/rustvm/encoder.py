@@ -66,6 +66,10 @@ class HardwareRegister:
     index: int
     size = 8  # all hardware registers are just size 8
 
+    def __reduce__(self):
+        # frozen dataclasses with slots can't be unpickled by setting their slots
+        return type(self), (self.index,)
+
 
 @dataclass(frozen=True)
 class HardwareMemoryLocation:
@@ -74,6 +78,9 @@ class HardwareMemoryLocation:
 
     index: int
 
+    def __reduce__(self):
+        return type(self), (self.index,)
+
 
 class SpecificRegisters:
     free_reg_offset = 4
@@ -103,19 +110,30 @@ class HardWareInstruction:
         return 2 * (1 + len(self.args))
 
 
-def pack_instruction(instr: HardWareInstruction) -> bytes:
-    """Pack an instruction into bytes."""
-    idx = instr.instr
+#: The size field of an instruction for each operand size.
+instruction_sizes = {
+    1: 0,
+    2: 1,
+    4: 2,
+    8: 3
+}
+
 
-    size = {
-        1: 0,
-        2: 1,
-        4: 2,
-        8: 3
-    }[instr.size]
+def instruction_word(instr: Union[BinaryInstructions, UnaryInstructions, Manip, Mem, IO], size: int) -> int:
+    """Get the 16 bit word an instruction of some operand size is encoded as."""
+    return ((instruction_sizes[size] << 14) | (instr.group << 8) | instr) & 0xffff
 
-    value = (size << 14) | (idx.group << 8) | idx
-    return (value & 0xffff).to_bytes(2, byteorder="little")
+
+#: The encoded word of each instruction, indexed by group, then instruction, then operand size.
+instruction_words = {
+    group: tuple({size: instruction_word(instr, size) for size in instruction_sizes} for instr in group)
+    for group in (BinaryInstructions, UnaryInstructions, Manip, Mem, IO)
+}
+
+
+def pack_instruction(instr: HardWareInstruction) -> bytes:
+    """Pack an instruction into bytes."""
+    return instruction_word(instr.instr, instr.size).to_bytes(2, byteorder="little")
 
 
 def pack_param(param: int, reg: bool = False, deref: bool = False) -> bytes:
@@ -228,11 +246,12 @@ class InstructionEncoder(Emitter):
                 (ir_object.AllocatedRegister(8, False, reg), )
             )
 
-        yield HardWareInstruction(
-            BinaryInstructions.sub,
-            8,
-            (SpecificRegisters.stk, ir_object.Immediate(instr.scope.size, 8), SpecificRegisters.stk)
-        )
+        if instr.scope.size:
+            yield HardWareInstruction(
+                BinaryInstructions.sub,
+                8,
+                (SpecificRegisters.stk, ir_object.Immediate(instr.scope.size, 8), SpecificRegisters.stk)
+            )
 
         yield HardWareInstruction(
             Mem.ret,
@@ -251,13 +270,13 @@ class InstructionEncoder(Emitter):
 
         arg_len = ir_object.Immediate(instr.argsize, 8)
 
-        # move up the stack pointer to clear off the arguments
-
-        yield HardWareInstruction(
-            BinaryInstructions.sub,
-            arg_len.size,
-            (SpecificRegisters.stk, arg_len, SpecificRegisters.stk)
-        )
+        # move up the stack pointer to clear off the arguments, if there are any
+        if instr.argsize:
+            yield HardWareInstruction(
+                BinaryInstructions.sub,
+                arg_len.size,
+                (SpecificRegisters.stk, arg_len, SpecificRegisters.stk)
+            )
         if instr.result is not None:
             yield HardWareInstruction(
                 Manip.mov,
@@ -0,0 +1,320 @@
+"""Graph colouring register allocation, in the style of Chaitin and Briggs.
+
+Virtual registers that are live at the same time interfere, they are joined by an edge
+in the interference graph. Giving each register one of as many colours as there are
+physical registers, with no two neighbours sharing a colour, allocates them.
+
+Before colouring, registers moved between each other are coalesced into a single node when
+that can't make the graph harder to colour, and the moves between them are removed.
+
+A node with fewer neighbours than there are colours can always be coloured, so it's removed
+from the graph and coloured once the rest of the graph is. When there are none left the node
+that is cheapest to spill for the number of neighbours it has is removed instead, it may still
+be coloured once it's neighbours are. Spilling a register costs more the more instructions touch
+it, and the deeper they are in loops.
+
+Registers that can't be coloured are spilled. Each instruction touching a spilled register gets
+a short lived register of it's own, which is loaded before the instruction and stored after, and
+the graph is built and coloured again.
+"""
+
+import itertools
+from array import array
+from dataclasses import replace
+from typing import Dict, List, Sequence, Set, Tuple
+
+from wewcompiler.backend.rustvm.cfg import loop_depths
+from wewcompiler.backend.rustvm.liveness import Liveness, live_intervals
+from wewcompiler.backend.rustvm.register_allocate import Spill, Load, assign_physical_registers, find_rematerialisable
+from wewcompiler.objects import ir_object
+from wewcompiler.objects.errors import InternalCompileException
+from wewcompiler.objects.ir_object import Register
+
+#: Nodes of the interference graph are the numbers of virtual registers.
+Graph = Dict[int, Set[int]]
+
+
+class GraphColouringState:
+    """The result of graph colouring allocation.
+
+    :reg_count: The number of physical registers.
+    :colours: The physical register of each virtual register, by it's number.
+    :spill_slots: The spill slot of each spilled virtual register, by it's number.
+    :spill_slot_count: The number of spill slots used.
+    :coalesced_moves: The number of moves removed by coalescing.
+    """
+
+    def __init__(self, reg_count: int):
+        self.reg_count = reg_count
+        self.colours: Dict[int, int] = {}
+        self.spill_slots: Dict[int, int] = {}
+        self.spill_slot_count = 0
+        self.coalesced_moves = 0
+
+
+def is_move(instr: ir_object.IRObject) -> bool:
+    """Check if an instruction copies one register to another of the same size."""
+    return (isinstance(instr, ir_object.Mov)
+            and isinstance(instr.to, Register) and isinstance(instr.from_, Register)
+            and instr.to.size == instr.from_.size)
+
+
+def build_graph(code: Sequence[ir_object.IRObject], loaded: Set[int] = frozenset()) -> Graph:
+    """Build the interference graph of some code.
+
+    Registers interfere if one is defined while the other is live. The registers
+    of a single instruction are kept apart, as they are by the other allocators,
+    except for the two sides of a move, which can share a register.
+
+    :param loaded: Registers loaded before the only instruction that uses them, they aren't defined
+                   in the code so they're only live over that instruction.
+    """
+    graph: Graph = {}
+
+    def interfere(a: int, b: int):
+        if a != b:
+            graph.setdefault(a, set()).add(b)
+            graph.setdefault(b, set()).add(a)
+
+    liveness = Liveness(code)
+
+    for block, live_out in zip(liveness.blocks, liveness.live_out):
+        live = live_out - loaded
+
+        for instr in reversed(code[block.start:block.end + 1]):
+            touched = {reg.reg for reg in instr.touched_registers}
+            for node in touched:
+                graph.setdefault(node, set())
+
+            if is_move(instr):
+                live.discard(instr.from_.reg)
+            else:
+                for a, b in itertools.combinations(touched, 2):
+                    interfere(a, b)
+
+            for node in touched & loaded:
+                for other in live:
+                    interfere(node, other)
+
+            defined = {reg.reg for reg in instr.defined_registers}
+            for node in defined:
+                for other in live:
+                    interfere(node, other)
+
+            live -= defined
+            live |= {reg.reg for reg in instr.used_registers} - loaded
+
+    # registers that are used before being defined are all live together on entry
+    if liveness.blocks:
+        entry = liveness.live_in[0] - loaded
+        for a, b in itertools.combinations(entry, 2):
+            interfere(a, b)
+
+    return graph
+
+
+def coalesce(code: List[ir_object.IRObject], reg_count: int) -> Dict[int, int]:
+    """Coalesce registers that are moved between each other and don't interfere, removing the moves.
+
+    Registers are only coalesced if the node they make has fewer neighbours with as many neighbours
+    as there are colours than there are colours, so it can be coloured whenever the two could.
+    The registers of the code are renamed to the registers they're coalesced into.
+
+    :returns: The register each coalesced register was renamed to.
+    """
+    graph = build_graph(code)
+    aliases: Dict[int, int] = {}
+
+    def find(node: int) -> int:
+        while node in aliases:
+            node = aliases[node]
+        return node
+
+    for instr in code:
+        if not is_move(instr):
+            continue
+
+        a, b = find(instr.to.reg), find(instr.from_.reg)
+        if a == b or b in graph[a]:
+            continue
+
+        neighbours = graph[a] | graph[b]
+        if sum(len(graph[n]) >= reg_count for n in neighbours) >= reg_count:
+            continue
+
+        aliases[b] = a
+        for n in graph.pop(b):
+            graph[n].discard(b)
+            graph[n].add(a)
+            graph[a].add(n)
+
+    aliases = {node: find(node) for node in aliases}
+    for instr in code:
+        rename_registers(instr, aliases)
+
+    code[:] = [i for i in code if not (is_move(i) and i.to.reg == i.from_.reg)]
+
+    return aliases
+
+
+def spill_costs(code: Sequence[ir_object.IRObject]) -> Dict[int, float]:
+    """Find the cost of spilling each register, each instruction touching it costs ten times more
+    for each loop it is inside of."""
+    liveness = Liveness(code)
+    costs: Dict[int, float] = {}
+
+    for block, depth in zip(liveness.blocks, loop_depths(liveness.blocks)):
+        for instr in code[block.start:block.end + 1]:
+            for reg in instr.touched_registers:
+                costs[reg.reg] = costs.get(reg.reg, 0) + 10 ** depth
+
+    return costs
+
+
+def colour_graph(graph: Graph, reg_count: int, costs: Dict[int, float],
+                 unspillable: Set[int]) -> Tuple[Dict[int, int], List[int]]:
+    """Colour an interference graph.
+
+    :returns: The colour of each node that could be coloured, and the nodes that couldn't.
+    """
+    degrees = {node: len(neighbours) for node, neighbours in graph.items()}
+    remaining = set(graph)
+    low = [node for node in graph if degrees[node] < reg_count]
+    stack = []
+
+    while remaining:
+        if low:
+            node = low.pop()
+        else:
+            # no node is certain to be coloured, remove the cheapest to spill and hope it is
+            node = min(remaining, key=lambda n: (n in unspillable, costs.get(n, 0) / degrees[n], n))
+
+        remaining.remove(node)
+        stack.append(node)
+
+        for neighbour in graph[node]:
+            if neighbour in remaining:
+                degrees[neighbour] -= 1
+                if degrees[neighbour] == reg_count - 1:
+                    low.append(neighbour)
+
+    colours: Dict[int, int] = {}
+    uncoloured = []
+
+    for node in reversed(stack):
+        taken = {colours[n] for n in graph[node] if n in colours}
+        free = [colour for colour in range(reg_count) if colour not in taken]
+        if free:
+            colours[node] = free[0]
+        else:
+            uncoloured.append(node)
+
+    return colours, uncoloured
+
+
+def rename_registers(instr: ir_object.IRObject, names: Dict[int, int]):
+    """Replace the registers touched by an instruction with the registers they're renamed to."""
+    def rename(arg):
+        if isinstance(arg, Register) and arg.reg in names:
+            return Register(names[arg.reg], arg.size, arg.sign)
+        if (isinstance(arg, ir_object.Dereference) and isinstance(arg.to, Register)
+                and arg.to.reg in names):
+            return ir_object.Dereference(Register(names[arg.to.reg], arg.to.size, arg.to.sign), arg.size)
+        return arg
+
+    if isinstance(instr, ir_object.MachineInstr):
+        instr.args = [rename(arg) for arg in instr.args]
+    else:
+        for attr in instr.touched_regs:
+            setattr(instr, attr, rename(getattr(instr, attr)))
+
+
+def graph_colour(reg_count: int, code: List[ir_object.IRObject]) -> GraphColouringState:
+    """Allocate registers for an ∞ register IR by colouring it's interference graph.
+    returns the allocation state to be used in further processing.
+    """
+    state = GraphColouringState(reg_count)
+
+    length = len(code)
+    aliases = coalesce(code, reg_count)
+    state.coalesced_moves = length - len(code)
+
+    rematerialisable = {reg.reg: info for reg, info in find_rematerialisable(code).items()}
+
+    temps = itertools.count(max((reg.reg for instr in code for reg in instr.touched_registers), default=0) + 1)
+    unspillable: Set[int] = set()
+    loaded: Set[int] = set()
+
+    # the neighbours of each spilled node, for sharing spill slots between them
+    spilled: Dict[int, Set[int]] = {}
+
+    # pre instructions to add once the registers to load into and store from are known,
+    # keyed by the instruction they are placed before
+    stores: Dict[int, List[Tuple[int, int]]] = {}
+    loads: Dict[int, List[Tuple[int, int]]] = {}
+
+    while True:
+        graph = build_graph(code, loaded)
+        colours, uncoloured = colour_graph(graph, reg_count, spill_costs(code), unspillable)
+
+        if not uncoloured:
+            break
+
+        for node in uncoloured:
+            if node in unspillable:
+                raise InternalCompileException(f"Ran out of registers to allocate register {node}.")
+            spilled[node] = graph[node]
+
+        ends = {reg: end for reg, (_, end) in live_intervals(code).items()}
+
+        for index, instr in enumerate(code):
+            nodes = {reg.reg for reg in instr.touched_registers} & set(uncoloured)
+
+            for node in nodes:
+                used = any(reg.reg == node for reg in instr.used_registers)
+                defined = any(reg.reg == node for reg in instr.defined_registers)
+
+                temp = next(temps)
+                unspillable.add(temp)
+                rename_registers(instr, {node: temp})
+
+                if used:
+                    loaded.add(temp)
+                    loads.setdefault(id(instr), []).append((temp, node))
+
+                # stores are placed before the next instruction, as in linear scan
+                if defined and ends[node] > index:
+                    if node in rematerialisable and index == rematerialisable[node][1]:
+                        continue
+                    stores.setdefault(id(code[index + 1]), []).append((temp, node))
+
+    # spilled nodes that don't interfere can share a slot,
+    # nodes recomputed wherever they're used don't need one
+    for node, neighbours in spilled.items():
+        if node in rematerialisable and rematerialisable[node][0] == rematerialisable[node][1]:
+            continue
+        taken = {state.spill_slots[n] for n in neighbours if n in state.spill_slots}
+        taken.update(state.spill_slots[n] for n, others in spilled.items()
+                     if node in others and n in state.spill_slots)
+        slot = next(i for i in itertools.count() if i not in taken)
+        state.spill_slots[node] = slot
+        state.spill_slot_count = max(state.spill_slot_count, slot + 1)
+
+    state.colours = dict(colours)
+    state.colours.update((node, colours[alias]) for node, alias in aliases.items() if alias in colours)
+
+    assign_physical_registers(code, array("b", (colours[v_reg.reg] for instr in code
+                                                for v_reg in instr.touched_registers)))
+
+    for index, instr in enumerate(code):
+        # stores go first, a register loaded into may have just been stored from
+        for temp, node in stores.get(id(instr), ()):
+            instr.insert_pre_instrs(Spill(colours[temp], state.spill_slots[node]))
+
+        for temp, node in loads.get(id(instr), ()):
+            if node in rematerialisable and index > rematerialisable[node][1]:
+                instr.insert_pre_instrs(replace(rematerialisable[node][2], reg=colours[temp]))
+            else:
+                instr.insert_pre_instrs(Load(colours[temp], state.spill_slots[node]))
+
+    return state
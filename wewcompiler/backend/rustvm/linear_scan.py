@@ -0,0 +1,190 @@
+"""Linear scan register allocation.
+
+Registers are given to the live intervals of virtual registers in order of where they start.
+When there aren't enough registers to go around, the interval that ends furthest away is spilled.
+
+A spilled register lives in a spill slot over all of it's interval. Each instruction that touches
+it gets a short interval of it's own, loading the register before the instruction and storing it
+after. These short intervals can't be spilled, but they take registers from other intervals, so
+allocation is repeated with them until nothing more needs to be spilled.
+
+A spilled register holding a constant or an address is recomputed where it's used once it's
+value is set, it's only stored before then.
+"""
+
+import heapq
+from array import array
+from dataclasses import replace
+from typing import Dict, List, Sequence, Set, Tuple
+
+from wewcompiler.backend.rustvm.liveness import live_intervals
+from wewcompiler.backend.rustvm.register_allocate import Spill, Load, assign_physical_registers, find_rematerialisable
+from wewcompiler.objects import ir_object
+from wewcompiler.objects.errors import InternalCompileException
+
+
+class Interval:
+    """The instructions a virtual register needs a physical register over.
+
+    :register: The number of the virtual register.
+    :start: Index of the first instruction of the interval.
+    :end: Index of the last instruction of the interval.
+    :spillable: If the interval can be spilled, false for intervals of spilled registers.
+    :physical: The physical register given to the interval.
+    """
+
+    __slots__ = ("register", "start", "end", "spillable", "physical")
+
+    def __init__(self, register: int, start: int, end: int, spillable: bool = True):
+        self.register = register
+        self.start = start
+        self.end = end
+        self.spillable = spillable
+        self.physical = None
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.register} {self.start}..{self.end}>"
+
+
+class LinearScanState:
+    """The result of linear scan allocation.
+
+    :reg_count: The number of physical registers.
+    :spill_slots: The spill slot of each spilled register, by it's number.
+    :spill_slot_count: The number of spill slots used.
+    """
+
+    def __init__(self, reg_count: int):
+        self.reg_count = reg_count
+        self.spill_slots: Dict[int, int] = {}
+        self.spill_slot_count = 0
+
+
+def scan(intervals: List[Interval], reg_count: int) -> Set[int]:
+    """Give physical registers to intervals, sorted by their start.
+
+    :returns: The numbers of the registers whose intervals had to be spilled.
+    """
+    free = set(range(reg_count))
+    active: List[Interval] = []
+    spilled = set()
+
+    for current in intervals:
+        # free the registers of intervals that have ended
+        still_active = []
+        for interval in active:
+            if interval.end < current.start:
+                free.add(interval.physical)
+            else:
+                still_active.append(interval)
+        active = still_active
+
+        if free:
+            current.physical = min(free)
+            free.remove(current.physical)
+            active.append(current)
+            continue
+
+        candidates = [i for i in active if i.spillable]
+        if current.spillable:
+            candidates.append(current)
+
+        if not candidates:
+            raise InternalCompileException(f"Ran out of registers to allocate at instruction {current.start}.")
+
+        # the interval that ends furthest away leaves the most room once it's spilled
+        victim = max(candidates, key=lambda i: (i.end, i.start))
+        spilled.add(victim.register)
+
+        if victim is not current:
+            current.physical = victim.physical
+            active.remove(victim)
+            active.append(current)
+
+    return spilled
+
+
+def assign_spill_slots(state: LinearScanState, intervals: Dict[int, Tuple[int, int]]):
+    """Give spill slots to spilled registers, registers whose intervals don't overlap share a slot."""
+    # heap of (end of interval, slot) for each slot in use
+    in_use = []
+    free = []
+
+    for reg in sorted(state.spill_slots, key=lambda r: (intervals[r], r)):
+        start, end = intervals[reg]
+
+        while in_use and in_use[0][0] < start:
+            heapq.heappush(free, heapq.heappop(in_use)[1])
+
+        if free:
+            slot = heapq.heappop(free)
+        else:
+            slot = state.spill_slot_count
+            state.spill_slot_count += 1
+
+        state.spill_slots[reg] = slot
+        heapq.heappush(in_use, (end, slot))
+
+
+def linear_scan(reg_count: int, code: Sequence[ir_object.IRObject]) -> LinearScanState:
+    """Allocate registers for an ∞ register IR by linear scan over live intervals.
+    returns the allocation state to be used in further processing.
+    """
+    state = LinearScanState(reg_count)
+
+    intervals = live_intervals(code)
+
+    touches: Dict[int, List[int]] = {}
+    for index, instr in enumerate(code):
+        for reg in {reg.reg for reg in instr.touched_registers}:
+            touches.setdefault(reg, []).append(index)
+
+    spilled: Set[int] = set()
+
+    while True:
+        allocated = [Interval(reg, start, end) for reg, (start, end) in intervals.items()
+                     if reg not in spilled]
+        allocated.extend(Interval(reg, index, index, spillable=False)
+                         for reg in spilled for index in touches[reg])
+        allocated.sort(key=lambda i: (i.start, i.end, i.register))
+
+        newly_spilled = scan(allocated, reg_count)
+        if not newly_spilled:
+            break
+        spilled |= newly_spilled
+
+    rematerialisable = {reg.reg: info for reg, info in find_rematerialisable(code).items()}
+
+    # registers set by a single instruction are never stored
+    state.spill_slots = dict.fromkeys(reg for reg in spilled
+                                      if reg not in rematerialisable
+                                      or rematerialisable[reg][0] != rematerialisable[reg][1])
+    assign_spill_slots(state, intervals)
+
+    physical = {}
+    for interval in allocated:
+        key = interval.register if interval.spillable else (interval.register, interval.start)
+        physical[key] = interval.physical
+
+    assign_physical_registers(code, array("b", (physical[v_reg.reg, index] if v_reg.reg in spilled
+                                                else physical[v_reg.reg]
+                                                for index, instr in enumerate(code)
+                                                for v_reg in instr.touched_registers)))
+
+    for index, instr in enumerate(code):
+        for v_reg in {reg.reg for reg in instr.used_registers} & spilled:
+            if v_reg in rematerialisable and index > rematerialisable[v_reg][1]:
+                instr.insert_pre_instrs(replace(rematerialisable[v_reg][2], reg=physical[v_reg, index]))
+            else:
+                instr.insert_pre_instrs(Load(physical[v_reg, index], state.spill_slots[v_reg]))
+
+        # stores are placed before the next instruction, which is before it's jump target
+        # if it is one, so they're only run on the way from here.
+        # nothing is stored if the register isn't used again, or is recomputed from here
+        for v_reg in {reg.reg for reg in instr.defined_registers} & spilled:
+            if v_reg in rematerialisable and index == rematerialisable[v_reg][1]:
+                continue
+            if intervals[v_reg][1] > index:
+                code[index + 1].insert_pre_instrs(Spill(physical[v_reg, index], state.spill_slots[v_reg]))
+
+    return state
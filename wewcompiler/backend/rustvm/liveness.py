@@ -0,0 +1,83 @@
+"""Liveness analysis of virtual registers over the control flow graph.
+
+Virtual registers are refered to by their numbers.
+"""
+
+from typing import Dict, List, Sequence, Set, Tuple
+
+from wewcompiler.backend.rustvm.cfg import build_blocks
+from wewcompiler.objects import ir_object
+
+
+class Liveness:
+    """The numbers of the registers live on entry to and exit from each block of some code.
+
+    :blocks: The basic blocks of the code.
+    :live_in: The registers live on entry to each block, in the order of the blocks.
+    :live_out: The registers live on exit from each block, in the order of the blocks.
+    """
+
+    __slots__ = ("blocks", "live_in", "live_out")
+
+    def __init__(self, code: Sequence[ir_object.IRObject]):
+        self.blocks = build_blocks(code)
+
+        uses, defs = [], []
+        for block in self.blocks:
+            used, defined = set(), set()
+            for instr in code[block.start:block.end + 1]:
+                used.update(i.reg for i in instr.used_registers if i.reg not in defined)
+                defined.update(i.reg for i in instr.defined_registers)
+            uses.append(used)
+            defs.append(defined)
+
+        self.live_in: List[Set[int]] = [set() for _ in self.blocks]
+        self.live_out: List[Set[int]] = [set() for _ in self.blocks]
+
+        # iterate to a fixed point, going backwards through the blocks as liveness flows backwards
+        changed = True
+        while changed:
+            changed = False
+            for n in reversed(range(len(self.blocks))):
+                live_out = set()
+                for succ in self.blocks[n].successors:
+                    live_out |= self.live_in[succ.index]
+
+                live_in = uses[n] | (live_out - defs[n])
+
+                if live_in != self.live_in[n] or live_out != self.live_out[n]:
+                    self.live_in[n] = live_in
+                    self.live_out[n] = live_out
+                    changed = True
+
+
+def live_intervals(code: Sequence[ir_object.IRObject],
+                   liveness: Liveness = None) -> Dict[int, Tuple[int, int]]:
+    """Find the interval of the code each register is live over.
+
+    An interval covers every instruction that touches it's register, along with
+    the start of each block it's live on entry to and the end of each block it's live on exit from.
+    So a register is never live outside of it's interval, but may not be live everywhere inside it.
+
+    :returns: The (first, last) instruction index each register is live over, by the register's number.
+    """
+    if liveness is None:
+        liveness = Liveness(code)
+
+    intervals: Dict[int, Tuple[int, int]] = {}
+
+    def extend(reg: int, index: int):
+        start, end = intervals.get(reg, (index, index))
+        intervals[reg] = (min(start, index), max(end, index))
+
+    for block, live_in, live_out in zip(liveness.blocks, liveness.live_in, liveness.live_out):
+        for reg in live_in:
+            extend(reg, block.start)
+        for reg in live_out:
+            extend(reg, block.end)
+
+        for index in range(block.start, block.end + 1):
+            for reg in code[index].touched_registers:
+                extend(reg.reg, index)
+
+    return intervals
@@ -1,10 +1,16 @@
+import bisect
+import heapq
+from array import array
 from enum import Enum, auto
 from typing import Any, Dict, List, Optional, Sequence, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 
+from wewcompiler.backend.rustvm import encoder
+from wewcompiler.backend.rustvm.liveness import live_intervals
 from wewcompiler.objects import ir_object
 from wewcompiler.objects.errors import InternalCompileException
 from wewcompiler.objects.ir_object import Register
+from wewcompiler.objects.variable import DataReference
 
 
 @dataclass
@@ -60,6 +66,66 @@ class Load:
     index: int
 
 
+@dataclass(frozen=True)
+class Rematerialise:
+    """Recompute the value of a spilled register instead of loading it.
+
+    :reg: Physical register to recompute into
+    :size: Size of the value
+    :value: Immediate, data reference or the base pointer to move into the register
+    :offset: Offset added to the value, for addresses of stack variables
+    """
+
+    reg: Optional[int]
+    size: int
+    value: Any
+    offset: int = 0
+
+
+def find_rematerialisable(code: Sequence[ir_object.IRObject]) -> Dict[Register, Tuple[int, int, Rematerialise]]:
+    """Find the registers that hold a value that can be recomputed instead of spilled.
+
+    These are registers set once to an immediate or the address of a global,
+    and registers set to the address of a stack variable by the base pointer and an offset.
+
+    :returns: The index of the first and last instruction defining each register,
+              with the recomputation of it's value, which has no physical register.
+    """
+    definitions: Dict[Register, List[int]] = {}
+    for index, instr in enumerate(code):
+        for v_reg in instr.defined_registers:
+            definitions.setdefault(v_reg, []).append(index)
+
+    found = {}
+
+    for v_reg, indexes in definitions.items():
+        first = code[indexes[0]]
+        if not isinstance(first, ir_object.Mov):
+            continue
+
+        value = first.from_
+
+        if len(indexes) == 1:
+            # immediates too large for an argument are moved out to data after allocation
+            if (isinstance(value, DataReference)
+                    or isinstance(value, ir_object.Immediate) and 0 <= value.val <= 0x3FFF):
+                found[v_reg] = indexes[0], indexes[0], Rematerialise(None, first.to.size, value)
+            continue
+
+        # the address of a stack variable, loaded as in DesugarIR_Pre.emit_loadvar
+        if value != encoder.SpecificRegisters.bas or indexes != [indexes[0], indexes[0] + 1]:
+            continue
+
+        add = code[indexes[1]]
+        if (isinstance(add, ir_object.Binary) and add.op in ("add", "sub")
+                and add.left == v_reg and add.to == v_reg
+                and isinstance(add.right, ir_object.Immediate)):
+            offset = add.right.val if add.op == "add" else -add.right.val
+            found[v_reg] = indexes[0], indexes[1], Rematerialise(None, first.to.size, value, offset)
+
+    return found
+
+
 class RegisterState(Enum):
     """The state of a virtual register."""
 
@@ -72,51 +138,86 @@ class RegisterState(Enum):
     #: register is saved to memory
     Spilled = auto()
 
+    #: register was spilled but is recomputed instead of loaded
+    Rematerialisable = auto()
+
 
 class AllocationState:
-    def __init__(self, reg_count: int):
+    """The state of greedy allocation, virtual registers are refered to by their numbers."""
+
+    def __init__(self, reg_count: int, uses: Dict[int, List[int]] = None,
+                 rematerialisable: Dict[int, Tuple[int, int, Rematerialise]] = None):
         self.reg_count = reg_count
         self.usable_registers = set(range(reg_count))
 
-        #: the states of virtual registers, dict of Registers to Tuples of state and data
-        self.register_states: Dict[Register, Tuple[RegisterState, Any]] = {}
+        #: the sorted indexes of the instructions that touch each virtual register
+        self.uses = uses or {}
+
+        #: registers that can be recomputed instead of spilled, from find_rematerialisable
+        self.rematerialisable = rematerialisable or {}
 
-        #: list of extra memory places that are used to hold spilled registers
-        # We use a list for this so that we can check if it's full
-        # (No None's) and to grow we just append a None
-        self.spilled_registers: List[Optional[Register]] = []
+        #: index of the instruction being allocated
+        self.position = 0
+
+        #: the states of virtual registers, dict of register numbers to Tuples of state and data
+        self.register_states: Dict[int, Tuple[RegisterState, Any]] = {}
+
+        #: the spill slot each spilled register is held in
+        self.spill_slots: Dict[int, int] = {}
+
+        #: heap of spill slots that have been emptied, the lowest is reused first
+        self.free_spill_slots: List[int] = []
+
+        #: the number of spill slots created
+        self.spill_slot_count = 0
 
         #: the stack of allocated registers, k:v of real register to virtual register
-        self.allocated_registers: Dict[int, Register] = {}
+        self.allocated_registers: Dict[int, int] = {}
 
-    def emit_spill(self, v_reg: Register, reg: int):
+    def release_spill_slot(self, v_reg: int) -> int:
+        """Take a spilled register out of it's spill slot.
+        :returns: The index of the slot it was in."""
+        index = self.spill_slots.pop(v_reg)
+        heapq.heappush(self.free_spill_slots, index)
+        return index
+
+    def can_rematerialise(self, v_reg: int) -> bool:
+        """Once it's value is set a register can be recomputed when it's next needed."""
+        return v_reg in self.rematerialisable and self.position > self.rematerialisable[v_reg][1]
+
+    def emit_spill(self, v_reg: int, reg: int) -> Optional[Spill]:
         """Emit a spill for a register.
-        :returns: The IR instruction to spill."""
+        :returns: The IR instruction to spill, None if the register will be recomputed."""
+
+        if self.can_rematerialise(v_reg):
+            self.register_states[v_reg] = (RegisterState.Rematerialisable, None)
+            return None
 
         # There's an empty spill location, spill to that
-        if None in self.spilled_registers:
-            index = self.spilled_registers.index(None)
-        # All slots to spill to are free, create a new one
+        if self.free_spill_slots:
+            index = heapq.heappop(self.free_spill_slots)
+        # All slots to spill to are full, create a new one
         else:
-            index = len(self.spilled_registers)
-            self.spilled_registers.append(None)
-        self.spilled_registers[index] = v_reg
+            index = self.spill_slot_count
+            self.spill_slot_count += 1
+        self.spill_slots[v_reg] = index
         self.register_states[v_reg] = (RegisterState.Spilled, index)
         return Spill(reg, index)
 
-    def emit_load(self, v_reg: Register, reg: int):
+    def emit_load(self, v_reg: int, reg: int):
         """Emit a load for a spilled register.
         :returns: The IR instruction to load."""
 
-        # find where this register was spilled to
-        index = self.spilled_registers.index(v_reg)
+        if self.register_states[v_reg][0] is RegisterState.Rematerialisable:
+            self.register_states[v_reg] = (RegisterState.Allocated, reg)
+            return replace(self.rematerialisable[v_reg][2], reg=reg)
 
-        # mark the spill slot as free
-        self.spilled_registers[index] = None
+        # find where this register was spilled to, and mark the spill slot as free
+        index = self.release_spill_slot(v_reg)
         self.register_states[v_reg] = (RegisterState.Allocated, reg)
         return Load(reg, index)
 
-    def free_register(self, v_reg: Register):
+    def free_register(self, v_reg: int):
         """Mark a virtual register as unused,
         any further attempts to access it will raise an Exception"""
 
@@ -129,26 +230,44 @@ class AllocationState:
         if state is RegisterState.Allocated:
             del self.allocated_registers[data]
             self.usable_registers.add(data)
-        # if spilled, remove it from the array of spilled registers
+        # if spilled, free it's spill slot
         elif state is RegisterState.Spilled:
-            index = self.spilled_registers.index(v_reg)
-            self.spilled_registers[index] = None
-        else:
+            self.release_spill_slot(v_reg)
+        elif state is not RegisterState.Rematerialisable:
             raise InternalCompileException("Tried to free a dead register")
 
+    def next_use(self, v_reg: int) -> float:
+        """Find the index of the next instruction from the current one that touches a register.
+        A register that isn't touched again is only live around a loop, and is used at infinity."""
+        uses = self.uses.get(v_reg, ())
+        index = bisect.bisect_left(uses, self.position)
+        if index < len(uses):
+            return uses[index]
+        return float("inf")
+
     def least_active_register(self, exclude: List[int]):
-        """Return the current least active register.
+        """Return the register whose virtual register is next used furthest away.
+        Registers that can be recomputed are preferred, unless they're needed by the current instruction.
 
         :param exclude: List of registers to not consider inactive at all."""
-        # TODO: a better algorithm
-        # currently this just gets a random (by chance of program state)
-        # register from the active pool
-        return (set(range(self.reg_count))
-                .difference(exclude)
-                .difference(self.usable_registers)
-                .pop())
-
-    def allocate_register(self, v_reg: Register,
+        candidates = (set(range(self.reg_count))
+                      .difference(exclude)
+                      .difference(self.usable_registers))
+
+        def priority(reg: int):
+            v_reg = self.allocated_registers[reg]
+            next_use = self.next_use(v_reg)
+            return self.can_rematerialise(v_reg) and next_use > self.position, next_use
+
+        return max(sorted(candidates), key=priority)
+
+    def spill_register(self, register: int, source: ir_object.IRObject):
+        """Spill the virtual register allocated to a physical register before an instruction."""
+        spill = self.emit_spill(self.allocated_registers[register], register)
+        if spill is not None:
+            source.insert_pre_instrs(spill)
+
+    def allocate_register(self, v_reg: int,
                           source: ir_object.IRObject,
                           excludes: List[int]) -> int:
         """Allocate a register. If it is already allocated this is a noop."""
@@ -157,15 +276,14 @@ class AllocationState:
             if state is RegisterState.Allocated:
                 # alread allocated: Just return
                 return data
-            if state is RegisterState.Spilled:
+            if state in (RegisterState.Spilled, RegisterState.Rematerialisable):
                 #  we need to recover the register, find a register to load,
                 #  If all registers are taken: emit spill before load instruction
                 if self.usable_registers:
                     register = self.usable_registers.pop()
                 else:
                     register = self.least_active_register(excludes)
-                    spilled_virtual = self.allocated_registers[register]
-                    source.insert_pre_instrs(self.emit_spill(spilled_virtual, register))
+                    self.spill_register(register, source)
 
                 self.allocated_registers[register] = v_reg
                 source.insert_pre_instrs(self.emit_load(v_reg, register))
@@ -182,46 +300,109 @@ class AllocationState:
             return reg
 
         register = self.least_active_register(excludes)
-        spilled_virtual = self.allocated_registers[register]
-        source.insert_pre_instrs(self.emit_spill(spilled_virtual, register))
+        self.spill_register(register, source)
         self.register_states[v_reg] = (RegisterState.Allocated, register)
         self.allocated_registers[register] = v_reg
         return register
 
 
 def mark_last_usages(code: Sequence[ir_object.IRObject]):
-    """Scans backwards over instructions, marking registers when they are last used."""
-    spotted_registers = set()
+    """Marks registers on the instruction after which they are no longer live.
 
-    # by scanning backwards, the first time we see a variable
-    # is the last time it's used in the execution order
-    for instr in reversed(code):
+    Liveness is found over the control flow graph of the code, a register used inside a loop
+    is live until the jump back to the start of the loop. The allocator moves through the
+    code in order, so registers are closed at the end of their live interval.
+    """
+    intervals = live_intervals(code)
+    registers: Dict[int, Register] = {}
+
+    for index, instr in enumerate(code):
         for v_reg in instr.touched_registers:
-            if v_reg not in spotted_registers:
-                instr.closing_registers.add(v_reg)
-                spotted_registers.add(v_reg)
+            registers.setdefault(v_reg.reg, v_reg)
+            if intervals[v_reg.reg][1] == index:
+                instr.close_register(v_reg)
+
+    # registers live around a loop end at the jump back, which doesn't touch them
+    for v_reg, (_, end) in intervals.items():
+        code[end].close_register(registers[v_reg])
+
+
+def assign_physical_registers(code: Sequence[ir_object.IRObject], assignment: Sequence[int]):
+    """Set the physical registers of the registers touched by some code.
+
+    Instructions share register objects, a register is copied for an instruction only
+    when it's already set to a different physical register by another instruction.
+
+    :param assignment: The physical register of each register touched by each instruction, in order.
+    """
+    position = 0
+
+    def assign(arg):
+        nonlocal position
+        reg = ir_object.filter_reg(arg)
+        if reg is None:
+            return arg
+
+        physical = assignment[position]
+        position += 1
+
+        if reg.physical_register is None:
+            reg.physical_register = physical
+            return arg
+
+        if reg.physical_register == physical:
+            return arg
+
+        reg = reg.copy()
+        reg.physical_register = physical
+        if isinstance(arg, ir_object.Dereference):
+            return ir_object.Dereference(reg, arg.size)
+        return reg
+
+    for instr in code:
+        if isinstance(instr, ir_object.MachineInstr):
+            instr.args = [assign(arg) for arg in instr.args]
+            continue
+
+        for attr in instr.touched_regs:
+            arg = getattr(instr, attr)
+            assigned = assign(arg)
+            if assigned is not arg:
+                setattr(instr, attr, assigned)
 
 
 def allocate(reg_count: int, code: Sequence[ir_object.IRObject]) -> AllocationState:
     """Allocate registers for an ∞ register IR.
     returns the allocation state to be used in further processing.
+
+    Virtual registers are refered to by their numbers while they're allocated, and the physical
+    register of each register touched by each instruction is kept in an array until the end.
     """
 
-    state = AllocationState(reg_count)
+    # the numbers of the registers each instruction touches
+    touched = [tuple(v_reg.reg for v_reg in instr.touched_registers) for instr in code]
+
+    # the instructions each register is touched at, for choosing which register to spill
+    uses: Dict[int, List[int]] = {}
+    for index, v_regs in enumerate(touched):
+        for v_reg in v_regs:
+            v_reg_uses = uses.setdefault(v_reg, [])
+            if not v_reg_uses or v_reg_uses[-1] != index:
+                v_reg_uses.append(index)
+
+    rematerialisable = {v_reg.reg: info for v_reg, info in find_rematerialisable(code).items()}
+    state = AllocationState(reg_count, uses, rematerialisable)
 
     # update each instruction to mark where registers become unused
     mark_last_usages(code)
 
-    for i in code:
-        regs_for_instruction = []
+    assignment = array("b")
 
-        # clone the registers of the instruction so that each instruction has it's own instance of a command
-        i.clone_regs()
-        for v_reg in i.touched_registers:
-            # bad stuff could happen if the register has already been allocated in this instruction
-            # or we're using a shared instance of the register objects
-            assert v_reg.physical_register is None
+    for index, (i, v_regs) in enumerate(zip(code, touched)):
+        state.position = index
+        regs_for_instruction = []
 
+        for v_reg in v_regs:
             reg = state.allocate_register(v_reg, i, regs_for_instruction)
 
             # ensure we got a register (just a sanity check)
@@ -229,11 +410,13 @@ def allocate(reg_count: int, code: Sequence[ir_object.IRObject]) -> AllocationSt
 
             # ensure that this hw-reg isn't swapped out mid-instruction
             regs_for_instruction.append(reg)
-            v_reg.physical_register = reg
+            assignment.append(reg)
 
         # mark the closing registers as free
         # prevents unneeded spills
         for v_reg in i.closing_registers:
-            state.free_register(v_reg)
+            state.free_register(v_reg.reg)
+
+    assign_physical_registers(code, assignment)
 
     return state
@@ -0,0 +1,199 @@
+"""Register usage of functions over the call graph.
+
+Functions preserve the registers of their callers by pushing them in their prelude and popping them
+when they return. A function only needs to save a register if a caller holds a value in it across a call
+to the function, and the function or a function it calls without saving the register writes to it.
+
+Calls through a function pointer could reach any function whose address is taken, so those functions
+save every register they write to.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Set, Tuple
+
+from wewcompiler.backend.rustvm.cfg import ControlFlowGraph
+from wewcompiler.backend.rustvm.register_allocate import Spill
+from wewcompiler.objects import ir_object
+from wewcompiler.objects.ir_object import Register
+from wewcompiler.objects.variable import DataReference
+
+
+@dataclass
+class RegisterUsage:
+    """The physical registers some code uses around the calls it makes.
+
+    :clobbered: The physical registers written to.
+    :live_across: The physical registers live across direct calls, by the identifier of the function called.
+    :address_taken: The identifiers of the functions whose address is used other than to call them.
+    """
+
+    clobbered: Set[int] = field(default_factory=set)
+    live_across: Dict[str, Set[int]] = field(default_factory=dict)
+    address_taken: Set[str] = field(default_factory=set)
+
+    def update(self, other: 'RegisterUsage'):
+        """Add the usage of some other code to this."""
+        self.clobbered |= other.clobbered
+        for identifier, live in other.live_across.items():
+            self.live_across.setdefault(identifier, set()).update(live)
+        self.address_taken |= other.address_taken
+
+
+def data_references(instr: ir_object.IRObject) -> Iterable[DataReference]:
+    """Get the data references an instruction uses, directly or dereferenced."""
+    if isinstance(instr, ir_object.MachineInstr):
+        args = instr.args
+    else:
+        args = [getattr(instr, attr) for attr in instr.touched_regs]
+
+    for arg in args:
+        if isinstance(arg, ir_object.Dereference):
+            arg = arg.to
+        if isinstance(arg, DataReference):
+            yield arg
+
+
+def call_targets(code: Iterable[ir_object.IRObject]) -> Tuple[Dict[int, str], Set[str]]:
+    """Find the functions called directly by some code, before it's registers are allocated.
+
+    Functions are called through a register the address of the function is moved into,
+    which may be copied between registers before the call.
+
+    :returns: The identifier of the function called by each direct call, by the id of the call,
+              and the identifiers of data references used other than to call them.
+    """
+    code = list(code)
+
+    definitions: Dict[Register, int] = {}
+    for instr in code:
+        for v_reg in instr.defined_registers:
+            definitions[v_reg] = definitions.get(v_reg, 0) + 1
+
+    def is_copy(instr: ir_object.IRObject) -> bool:
+        return (isinstance(instr, ir_object.Mov) and isinstance(instr.to, Register)
+                and definitions[instr.to] == 1)
+
+    # registers set once to the address of a function, or to a copy of one
+    holds: Dict[Register, str] = {}
+    for instr in code:
+        if not is_copy(instr):
+            continue
+        if isinstance(instr.from_, DataReference):
+            holds[instr.to] = instr.from_.name
+        elif isinstance(instr.from_, Register) and instr.from_ in holds:
+            holds[instr.to] = holds[instr.from_]
+
+    targets: Dict[int, str] = {}
+    address_taken: Set[str] = set()
+
+    for instr in code:
+        for ref in data_references(instr):
+            if not (is_copy(instr) and instr.from_ is ref):
+                address_taken.add(ref.name)
+
+        for v_reg in instr.used_registers:
+            if v_reg not in holds:
+                continue
+            if isinstance(instr, ir_object.Call) and instr.jump == v_reg:
+                targets[id(instr)] = holds[v_reg]
+            elif not (is_copy(instr) and instr.from_ == v_reg):
+                address_taken.add(holds[v_reg])
+
+    return targets, address_taken
+
+
+def live_before(instr: ir_object.IRObject, live: Set[int]) -> Set[int]:
+    """Find the physical registers live before an instruction and the spill code before it
+    from those live after it."""
+    live = (live - {reg.physical_register for reg in instr.defined_registers}
+            | {reg.physical_register for reg in instr.used_registers})
+
+    for pre in reversed(instr.pre_instructions):
+        if isinstance(pre, Spill):
+            live = live | {pre.reg}
+        else:
+            live = live - {pre.reg}
+
+    return live
+
+
+def register_usage(code: Iterable[ir_object.IRObject], targets: Dict[int, str],
+                   address_taken: Set[str], cfg: ControlFlowGraph = None) -> RegisterUsage:
+    """Find the register usage of some code after it's registers are allocated.
+
+    :param targets: The functions called directly, from :func:`call_targets`.
+    :param address_taken: The functions whose address is taken, from :func:`call_targets`.
+    :param cfg: The control flow graph of the code, if it's already built.
+    """
+    code = list(code)
+    blocks = (cfg or ControlFlowGraph(code)).blocks
+
+    usage = RegisterUsage(address_taken=set(address_taken))
+    usage.clobbered = {reg.physical_register for instr in code for reg in instr.touched_registers}
+
+    live_in = [set() for _ in blocks]
+
+    def live_out(n: int) -> Set[int]:
+        return set().union(*(live_in[succ.index] for succ in blocks[n].successors))
+
+    # iterate to a fixed point, the same as for virtual registers
+    changed = True
+    while changed:
+        changed = False
+        for n in reversed(range(len(blocks))):
+            live = live_out(n)
+            for instr in reversed(code[blocks[n].start:blocks[n].end + 1]):
+                live = live_before(instr, live)
+            if live != live_in[n]:
+                live_in[n] = live
+                changed = True
+
+    for n, block in enumerate(blocks):
+        live = live_out(n)
+        for instr in reversed(code[block.start:block.end + 1]):
+            if id(instr) in targets:
+                result = {reg.physical_register for reg in instr.defined_registers}
+                usage.live_across.setdefault(targets[id(instr)], set()).update(live - result)
+            live = live_before(instr, live)
+
+    return usage
+
+
+def saved_registers(usages: Dict[str, RegisterUsage], toplevel: RegisterUsage) -> Dict[str, Set[int]]:
+    """Choose the registers each function saves.
+
+    A function clobbers the registers it writes to and those clobbered by the functions it calls
+    that they don't save, this is found by iterating to a fixed point over the call graph.
+
+    :param usages: The register usage of each function, by it's identifier.
+    :param toplevel: The register usage of the toplevel code, which calls functions but isn't called.
+    :returns: The physical registers each function saves, by it's identifier.
+    """
+    address_taken = set(toplevel.address_taken).union(*(u.address_taken for u in usages.values()))
+
+    needed: Dict[str, Set[int]] = {identifier: set() for identifier in usages}
+    for usage in (toplevel, *usages.values()):
+        for identifier, live in usage.live_across.items():
+            if identifier in needed:
+                needed[identifier] |= live
+
+    clobbered = {identifier: set(usage.clobbered) for identifier, usage in usages.items()}
+
+    def saves(identifier: str) -> Set[int]:
+        if identifier in address_taken:
+            return clobbered[identifier]
+        return clobbered[identifier] & needed[identifier]
+
+    changed = True
+    while changed:
+        changed = False
+        for identifier, usage in usages.items():
+            for callee in usage.live_across:
+                if callee not in clobbered:
+                    continue
+                unsaved = clobbered[callee] - saves(callee)
+                if not unsaved <= clobbered[identifier]:
+                    clobbered[identifier] |= unsaved
+                    changed = True
+
+    return {identifier: saves(identifier) for identifier in usages}
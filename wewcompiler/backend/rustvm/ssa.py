@@ -0,0 +1,467 @@
+"""Static single assignment form of desugared IR code.
+
+Registers of the IR can be written to any number of times, in SSA form each is written to by a single
+instruction. Each write is given a new register, and where different writes of a register reach a block,
+a phi at the start of the block picks the register written along the edge control flow entered the block by.
+Phis are placed at the iterated dominance frontiers of the blocks a register is written in, where the
+register is live.
+
+The arguments of a phi are keyed by the edge they're taken along, which is the jump to the block for edges
+taken by a jump, and None for the edge falling through from the block before. Passes that remove jumps or
+blocks remove the arguments of the edges they remove.
+
+Registers passed to inline assembly are left as they are, as what it does with them isn't known.
+
+Out of SSA form, each register is renamed back to the register it was made from, unless it's live
+at the same time as another register made from the same register, then it's given a new number.
+Phis become moves along the edges into their block, edges leaving a block with more than one successor
+for a block with more than one predecessor are split so that the moves are only run along that edge.
+"""
+
+import itertools
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from wewcompiler.backend.rustvm.cfg import BasicBlock, function_cfg, halts, invalidate_cfg
+from wewcompiler.backend.rustvm.graph_colouring import rename_registers
+from wewcompiler.backend.rustvm.liveness import Liveness
+from wewcompiler.objects import ir_object
+from wewcompiler.objects.base import StatementObject
+from wewcompiler.objects.ir_object import IRParam, Register, filter_reg, slotted
+
+#: The edge an argument of a phi is taken along, the jump taking it or None for falling through.
+Edge = Optional[ir_object.Jump]
+
+
+@slotted
+@dataclass
+class Phi(ir_object.IRObject):
+    """Pick the register written along the edge control flow entered the block by.
+
+    :param to: The register to write to.
+    :param args: The edge and register or immediate of each argument.
+    """
+
+    to: Register
+    args: List[Tuple[Edge, IRParam]] = field(default_factory=list)
+
+    def arg_for(self, edge: Edge) -> Optional[IRParam]:
+        """Get the argument taken along an edge, None if it has none."""
+        for other, arg in self.args:
+            if other is edge:
+                return arg
+        return None
+
+    def remove_edge(self, edge: Edge):
+        self.args = [(other, arg) for other, arg in self.args if other is not edge]
+
+    # the arguments are a list that can be changed in place, so the registers touched aren't kept
+
+    @property
+    def touched_registers(self) -> Iterable[Register]:
+        return (self.to, *self.used_registers)
+
+    @property
+    def used_registers(self) -> Iterable[Register]:
+        return tuple(arg for _, arg in self.args if isinstance(arg, Register))
+
+    @property
+    def defined_registers(self) -> Iterable[Register]:
+        return (self.to,)
+
+    touched_regs = ("to",)
+    written_regs = ("to",)
+
+
+def out_edges(code: List[ir_object.IRObject], block: BasicBlock) -> List[Tuple[Edge, BasicBlock]]:
+    """Get the edges leaving a block, with the block each enters."""
+    last = code[block.end]
+    edges: List[Edge] = [last] if isinstance(last, ir_object.Jump) else []
+    if len(block.successors) > len(edges):
+        edges.append(None)
+    return list(zip(edges, block.successors))
+
+
+def block_phis(code: List[ir_object.IRObject], block: BasicBlock) -> List[Phi]:
+    """Get the phis at the start of a block."""
+    start = block.start + isinstance(code[block.start], ir_object.JumpTarget)
+    phis = []
+    for instr in code[start:block.end + 1]:
+        if not isinstance(instr, Phi):
+            break
+        phis.append(instr)
+    return phis
+
+
+def with_number(arg: IRParam, number: int) -> IRParam:
+    """Get a register argument, or a dereference of one, with the register given another number."""
+    if isinstance(arg, Register):
+        return Register(number, arg.size, arg.sign)
+    return ir_object.Dereference(Register(number, arg.to.size, arg.to.sign), arg.size)
+
+
+def to_ssa(obj: StatementObject) -> Dict[int, int]:
+    """Convert the desugared code of an object to SSA form in place.
+
+    :returns: The register each new register was made from, by number.
+    """
+    code = obj.context.code
+    cfg = function_cfg(obj)
+    blocks, idom = cfg.blocks, cfg.idom
+
+    if not blocks:
+        return {}
+
+    # registers of inline assembly, it may write to them without saying so
+    fixed = {reg.reg for instr in code if isinstance(instr, ir_object.MachineInstr)
+             for reg in instr.touched_registers}
+
+    written: Dict[int, Set[int]] = {}
+    widest: Dict[int, Register] = {}
+
+    for block in blocks:
+        for instr in code[block.start:block.end + 1]:
+            for reg in instr.touched_registers:
+                if reg.reg not in widest or reg.size > widest[reg.reg].size:
+                    widest[reg.reg] = reg
+            if idom[block.index] is None:
+                continue
+            for reg in instr.defined_registers:
+                if reg.reg not in fixed:
+                    written.setdefault(reg.reg, set()).add(block.index)
+
+    live_in = Liveness(code).live_in
+    phis: Dict[int, Dict[int, Phi]] = {}
+
+    for reg, found in written.items():
+        work, placed = list(found), set()
+        while work:
+            for n in cfg.frontiers[work.pop()]:
+                if n in placed:
+                    continue
+                placed.add(n)
+                work.append(n)
+                if reg in live_in[n]:
+                    phis.setdefault(n, {})[reg] = Phi(Register(reg, widest[reg].size, widest[reg].sign))
+
+        # a register live on entry to a loop back to the start of the code has no edge to take it's value along
+        if 0 in phis and reg in phis[0]:
+            fixed.add(reg)
+
+    for found in phis.values():
+        for reg in fixed & found.keys():
+            del found[reg]
+
+    numbers = itertools.count(max(widest, default=-1) + 1)
+    origins: Dict[int, int] = {}
+
+    # the registers written to each register, a register with none is read as it was before
+    versions: Dict[int, List[int]] = {}
+    pushed: List[int] = []
+
+    def current(reg: int) -> int:
+        stack = versions.get(reg)
+        return stack[-1] if stack else reg
+
+    def write(reg: int) -> int:
+        number = next(numbers)
+        origins[number] = reg
+        versions.setdefault(reg, []).append(number)
+        pushed.append(reg)
+        return number
+
+    children: List[List[int]] = [[] for _ in blocks]
+    for n in range(1, len(blocks)):
+        if idom[n] is not None:
+            children[idom[n]].append(n)
+
+    # walk the dominator tree, so that the registers written above a block are those that reach it
+    stack = [(0, False)]
+    marks: List[int] = []
+
+    while stack:
+        n, leaving = stack.pop()
+
+        if leaving:
+            mark = marks.pop()
+            while len(pushed) > mark:
+                versions[pushed.pop()].pop()
+            continue
+
+        marks.append(len(pushed))
+        stack.append((n, True))
+        stack.extend((child, False) for child in reversed(children[n]))
+
+        block = blocks[n]
+
+        for reg, phi in phis.get(n, {}).items():
+            phi.to = with_number(phi.to, write(reg))
+
+        for instr in code[block.start:block.end + 1]:
+            if isinstance(instr, ir_object.MachineInstr):
+                continue
+
+            writes = []
+            for attr in instr.touched_regs:
+                arg = getattr(instr, attr)
+                reg = filter_reg(arg)
+                if reg is None or reg.reg in fixed:
+                    continue
+                if attr in instr.written_regs and isinstance(arg, Register):
+                    writes.append((attr, arg))
+                else:
+                    setattr(instr, attr, with_number(arg, current(reg.reg)))
+
+            for attr, arg in writes:
+                setattr(instr, attr, with_number(arg, write(arg.reg)))
+
+        for edge, succ in out_edges(code, block):
+            for reg, phi in phis.get(succ.index, {}).items():
+                phi.args.append((edge, with_number(phi.to, current(reg))))
+
+    # phis go after the jump target starting their block
+    placed_phis = {blocks[n].start + isinstance(code[blocks[n].start], ir_object.JumpTarget): list(found.values())
+                   for n, found in phis.items() if found}
+
+    new_code = []
+    for index, instr in enumerate(code):
+        new_code.extend(placed_phis.get(index, ()))
+        new_code.append(instr)
+    code[:] = new_code
+
+    invalidate_cfg(obj)
+
+    return origins
+
+
+def ssa_liveness(code: List[ir_object.IRObject],
+                 blocks: List[BasicBlock]) -> Tuple[List[Set[int]], List[Set[int]]]:
+    """Find the registers live after the phis of each block and on exit from each block of code in SSA form.
+
+    The arguments of a phi are live on exit from the block of the edge they're taken along, not on entry to the phi's block.
+
+    :returns: The registers live after the phis and on exit of each block, in the order of the blocks.
+    """
+    uses, defs, phi_defs = [], [], []
+    for block in blocks:
+        used, defined, phi_defined = set(), set(), set()
+        for instr in code[block.start:block.end + 1]:
+            if isinstance(instr, Phi):
+                phi_defined.add(instr.to.reg)
+                continue
+            used.update(i.reg for i in instr.used_registers if i.reg not in defined)
+            defined.update(i.reg for i in instr.defined_registers)
+        uses.append(used)
+        defs.append(defined)
+        phi_defs.append(phi_defined)
+
+    # the registers taken along the edges leaving each block
+    taken = []
+    for block in blocks:
+        args = set()
+        for edge, succ in out_edges(code, block):
+            for phi in block_phis(code, succ):
+                arg = phi.arg_for(edge)
+                if isinstance(arg, Register):
+                    args.add(arg.reg)
+        taken.append(args)
+
+    live_in: List[Set[int]] = [set() for _ in blocks]
+    live_out: List[Set[int]] = [set() for _ in blocks]
+
+    changed = True
+    while changed:
+        changed = False
+        for n in reversed(range(len(blocks))):
+            out = set(taken[n])
+            for succ in blocks[n].successors:
+                out |= live_in[succ.index] - phi_defs[succ.index]
+
+            in_ = uses[n] | (out - defs[n])
+
+            if in_ != live_in[n] or out != live_out[n]:
+                live_in[n] = in_
+                live_out[n] = out
+                changed = True
+
+    return live_in, live_out
+
+
+def find_conflicts(code: List[ir_object.IRObject], blocks: List[BasicBlock],
+                   origins: Dict[int, int]) -> Dict[int, Set[int]]:
+    """Find the registers made from the same register that are live at the same time.
+
+    Two registers conflict if one is written to while the other is live,
+    the phis of a block are all written to at once.
+
+    :returns: The registers each register conflicts with, for registers with conflicts.
+    """
+    live_in, live_out = ssa_liveness(code, blocks)
+    conflicts: Dict[int, Set[int]] = {}
+
+    def conflict(a: int, b: int):
+        conflicts.setdefault(a, set()).add(b)
+        conflicts.setdefault(b, set()).add(a)
+
+    for block, out in zip(blocks, live_out):
+        # the live registers made from each register
+        live: Dict[int, Set[int]] = {}
+        for reg in out:
+            live.setdefault(origins.get(reg, reg), set()).add(reg)
+
+        phis = []
+        for instr in reversed(code[block.start:block.end + 1]):
+            if isinstance(instr, Phi):
+                phis.append(instr.to.reg)
+                continue
+
+            for reg in instr.defined_registers:
+                for other in live.get(origins.get(reg.reg, reg.reg), ()):
+                    if other != reg.reg:
+                        conflict(reg.reg, other)
+
+            for reg in instr.defined_registers:
+                live.get(origins.get(reg.reg, reg.reg), set()).discard(reg.reg)
+            for reg in instr.used_registers:
+                live.setdefault(origins.get(reg.reg, reg.reg), set()).add(reg.reg)
+
+        for reg in phis:
+            origin = origins.get(reg, reg)
+            others = live.get(origin, set()) | {i for i in phis if origins.get(i, i) == origin}
+            for other in others - {reg}:
+                conflict(reg, other)
+
+    return conflicts
+
+
+def sequence_copies(copies: List[Tuple[Register, IRParam]], temps: Iterator[int]) -> List[ir_object.Mov]:
+    """Order moves that are run at once so that none overwrites a register another reads.
+
+    Moves in a cycle are broken up by saving the register one writes to in a temporary register.
+
+    :param copies: The register written to and the argument read by each move, each register written to once.
+    :param temps: Numbers of unused registers.
+    """
+    pending = [(to, from_) for to, from_ in copies if to != from_]
+    moves = []
+
+    while pending:
+        read = {from_.reg for _, from_ in pending if isinstance(from_, Register)}
+        ready = [copy for copy in pending if copy[0].reg not in read]
+
+        if ready:
+            for copy in ready:
+                moves.append(ir_object.Mov(*copy))
+            pending = [copy for copy in pending if copy not in ready]
+            continue
+
+        # every register written to is read by another move, save one to break the cycle
+        to, _ = pending[0]
+        saved = Register(next(temps), to.size, to.sign)
+        moves.append(ir_object.Mov(saved, to))
+        pending = [(other, saved if isinstance(from_, Register) and from_.reg == to.reg else from_)
+                   for other, from_ in pending]
+
+    return moves
+
+
+def new_jump_target(obj: StatementObject) -> ir_object.JumpTarget:
+    """Make a jump target numbered after the others of an object."""
+    target = ir_object.JumpTarget()
+    target.index = obj.context.jump_targets
+    target.parent = obj
+    obj.context.jump_targets += 1
+    return target
+
+
+def from_ssa(obj: StatementObject, origins: Dict[int, int]):
+    """Convert the code of an object out of SSA form in place, replacing phis with moves.
+
+    :param origins: The register each register was made from, from :func:`to_ssa`.
+    """
+    code = obj.context.code
+    blocks = function_cfg(obj).blocks
+
+    conflicts = find_conflicts(code, blocks, origins)
+
+    numbers = itertools.count(max((reg.reg for instr in code for reg in instr.touched_registers), default=-1) + 1)
+
+    # registers are renamed to the register they were made from where they don't conflict
+    names: Dict[int, int] = {}
+    holders: Dict[int, List[int]] = {}
+
+    touched = {reg.reg for instr in code for reg in instr.touched_registers}
+    for reg in sorted(touched):
+        origin = origins.get(reg, reg)
+        if reg in conflicts and conflicts[reg].intersection(holders.get(origin, ())):
+            names[reg] = next(numbers)
+        else:
+            names[reg] = origin
+            holders.setdefault(origin, []).append(reg)
+
+    names = {reg: name for reg, name in names.items() if reg != name}
+
+    # moves to place before instructions, by the instruction's index, moves run on entering a block
+    # go before those run on leaving it, for blocks with nothing but phis these are at the same place
+    entering: Dict[int, List[ir_object.IRObject]] = {}
+    leaving: Dict[int, List[ir_object.IRObject]] = {}
+    # blocks that only run the moves for an edge, placed after the code
+    split: List[ir_object.IRObject] = []
+
+    def renamed(arg: IRParam) -> IRParam:
+        reg = filter_reg(arg)
+        if reg is None or reg.reg not in names:
+            return arg
+        return with_number(arg, names[reg.reg])
+
+    for block in blocks:
+        phis = block_phis(code, block)
+        if not phis:
+            continue
+
+        top = block.start + isinstance(code[block.start], ir_object.JumpTarget) + len(phis)
+
+        # a block jumping to the block after it is it's predecessor twice
+        for pred in dict.fromkeys(block.predecessors):
+            for edge, succ in out_edges(code, pred):
+                if succ is not block:
+                    continue
+
+                copies = [(renamed(phi.to), renamed(phi.arg_for(edge)))
+                          for phi in phis if phi.arg_for(edge) is not None]
+                moves = sequence_copies(copies, numbers)
+                if not moves:
+                    continue
+
+                if len(pred.successors) == 1:
+                    # before the jump leaving the block, or where it falls through
+                    position = pred.end if isinstance(code[pred.end], ir_object.Jump) else pred.end + 1
+                    leaving.setdefault(position, []).extend(moves)
+                elif len(block.predecessors) == 1:
+                    entering.setdefault(top, []).extend(moves)
+                elif edge is None:
+                    # the edge falls through, moves between the blocks are skipped by jumps to the block
+                    leaving.setdefault(block.start, []).extend(moves)
+                else:
+                    target = new_jump_target(obj)
+                    split.extend([target, *moves, ir_object.Jump(edge.location)])
+                    edge.location = target
+
+    new_code = []
+    for index, instr in enumerate(code):
+        new_code.extend(entering.get(index, ()))
+        new_code.extend(leaving.get(index, ()))
+        if not isinstance(instr, Phi):
+            rename_registers(instr, names)
+            new_code.append(instr)
+
+    if split:
+        if not isinstance(new_code[-1], ir_object.Return) and not halts(new_code[-1]) and not (
+                isinstance(new_code[-1], ir_object.Jump) and new_code[-1].condition is None):
+            end = new_jump_target(obj)
+            split = [ir_object.Jump(end), *split, end]
+        new_code.extend(split)
+
+    code[:] = new_code
+
+    invalidate_cfg(obj)
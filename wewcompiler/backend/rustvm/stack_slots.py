@@ -0,0 +1,160 @@
+"""Assignment of stack offsets to the variables and spill slots of a function.
+
+Variables of nested scopes are placed in the frame of the function they're in. A variable only
+holds a value while the scope it's declared in is entered, so variables of scopes that are never
+entered at the same time, like sibling blocks and the arms of an if, can share their offsets.
+Spill slots are only needed while they hold a spilled register, and can share offsets with
+variables of scopes that aren't entered at the time.
+
+Variables are given offsets before the IR is desugared, as loading a variable uses it's offset.
+Spill slots are given offsets once registers are allocated, in the space the variables leave.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+from wewcompiler.backend.rustvm.cfg import ControlFlowGraph, function_cfg
+from wewcompiler.backend.rustvm.register_allocate import Spill, Load
+from wewcompiler.objects import ir_object
+from wewcompiler.objects.base import FunctionDecl
+from wewcompiler.objects.variable import Variable
+
+#: The (first, last) index of the instructions something is live over.
+Interval = Tuple[int, int]
+
+
+def overlaps(a: Interval, b: Interval) -> bool:
+    return a[0] <= b[1] and b[0] <= a[1]
+
+
+def variable_intervals(fn: FunctionDecl, code: Sequence[ir_object.IRObject]) -> List[Tuple[Variable, Interval]]:
+    """Find the interval each variable on the stack of a function is live over.
+
+    Variables of the function are live over all of it's code, variables of nested scopes from the
+    prelude of their scope to it's last epilog, returns emit epilogs for the scopes they leave.
+
+    :returns: The variables and their intervals, those of the function first, then of nested scopes in order.
+    """
+    whole = (0, max(len(code) - 1, 0))
+    found = [(var, whole) for var in fn.vars.values()]
+
+    # scopes are looked up by identity
+    intervals: Dict[int, Interval] = {}
+    scopes = {}
+
+    for index, instr in enumerate(code):
+        if not isinstance(instr, (ir_object.Prelude, ir_object.Epilog)) or instr.scope is fn:
+            continue
+        start, end = intervals.get(id(instr.scope), (index, index))
+        intervals[id(instr.scope)] = (min(start, index), max(end, index))
+        scopes[id(instr.scope)] = instr.scope
+
+    for key, scope in scopes.items():
+        found.extend((var, intervals[key]) for var in scope.vars.values())
+
+    # parameters have negative offsets, and are placed by the caller
+    return [(var, interval) for var, interval in found
+            if var.stack_offset is not None and var.stack_offset >= 0]
+
+
+def spill_slot_intervals(cfg: ControlFlowGraph) -> Dict[int, Interval]:
+    """Find the interval each spill slot is live over, from a spill to the last load that can read it.
+
+    :returns: The interval of each spill slot that's used, by it's index.
+    """
+    code, blocks = cfg.code, cfg.blocks
+
+    def live_before(instr: ir_object.IRObject, live: frozenset) -> frozenset:
+        for pre in reversed(instr.pre_instructions):
+            if isinstance(pre, Spill):
+                live = live - {pre.index}
+            elif isinstance(pre, Load):
+                live = live | {pre.index}
+        return live
+
+    live_in = [frozenset() for _ in blocks]
+
+    def live_out(n: int) -> frozenset:
+        return frozenset().union(*(live_in[succ.index] for succ in blocks[n].successors))
+
+    # iterate to a fixed point, the same as for registers
+    changed = True
+    while changed:
+        changed = False
+        for n in reversed(range(len(blocks))):
+            live = live_out(n)
+            for instr in reversed(code[blocks[n].start:blocks[n].end + 1]):
+                live = live_before(instr, live)
+            if live != live_in[n]:
+                live_in[n] = live
+                changed = True
+
+    intervals: Dict[int, Interval] = {}
+
+    def extend(slot: int, position: int):
+        start, end = intervals.get(slot, (position, position))
+        intervals[slot] = (min(start, position), max(end, position))
+
+    for n, block in enumerate(blocks):
+        for slot in live_in[n]:
+            extend(slot, block.start)
+        for slot in live_out(n):
+            extend(slot, block.end)
+
+        for position in range(block.start, block.end + 1):
+            for pre in code[position].pre_instructions:
+                if isinstance(pre, (Spill, Load)):
+                    extend(pre.index, position)
+
+    return intervals
+
+
+def first_fit(size: int, interval: Interval, placed: Sequence[Tuple[int, int, Interval]]) -> int:
+    """Find the lowest offset something can be placed at without overlapping
+    anything placed that is live at the same time.
+
+    :param placed: The offset, size and interval of everything already placed.
+    """
+    taken = sorted((offset, offset + other_size) for offset, other_size, other in placed
+                   if overlaps(interval, other))
+
+    offset = 0
+    for start, end in taken:
+        if offset + size <= start:
+            break
+        offset = max(offset, end)
+
+    return offset
+
+
+def assign_variable_offsets(fn: FunctionDecl):
+    """Give the variables of a function and it's nested scopes their stack offsets and size the frame.
+
+    Variables are placed in the order they become live, each at the lowest offset that is free while it's live.
+    """
+    items = sorted(variable_intervals(fn, fn.code), key=lambda item: item[1][0])
+
+    placed: List[Tuple[int, int, Interval]] = []
+    for var, interval in items:
+        var.stack_offset = first_fit(var.size, interval, placed)
+        placed.append((var.stack_offset, var.size, interval))
+
+    fn.size = max((offset + size for offset, size, _ in placed), default=0)
+
+
+def assign_spill_offsets(fn: FunctionDecl, spill_slot_count: int):
+    """Insert the spill slots of a function once it's registers are allocated,
+    placing them where they don't overlap a variable or another spill slot live at the same time."""
+    placed = [(var.stack_offset, var.size, interval) for var, interval in variable_intervals(fn, fn.code)]
+
+    fn.add_spill_vars(spill_slot_count)
+
+    intervals = spill_slot_intervals(function_cfg(fn))
+    whole = (0, max(len(fn.code) - 1, 0))
+
+    for slot in range(spill_slot_count):
+        var = fn.lookup_variable(f"spill-var-{slot}")
+        interval = intervals.get(slot, whole)
+        var.stack_offset = first_fit(var.size, interval, placed)
+        placed.append((var.stack_offset, var.size, interval))
+
+    fn.size = max((offset + size for offset, size, _ in placed), default=0)
@@ -2,20 +2,27 @@ from typing import List
 
 from wewcompiler.objects import builder
 from wewcompiler.objects import base
-from wewcompiler.parser import lang
+from wewcompiler.parser import lang, pratt_lang, pratt_unavailable
 
 
-def parse_with_semantics(text: str, semantics: type=None) -> List[base.StatementObject]:
-    """Parse a file with given semantics."""
-    return lang.parse(text, semantics=semantics())
+def parse_with_semantics(text: str, semantics: type=None, pratt: bool = False) -> List[base.StatementObject]:
+    """Parse a file with given semantics.
 
+    :param pratt: Parse binary expressions by precedence climbing instead of with the generated rules.
+    """
+    if pratt and pratt_lang is None:
+        raise RuntimeError(f"The precedence climbing parser can't be used, {pratt_unavailable}.")
 
-def parse_source(inp: str) -> List[base.StatementObject]:
-    return parse_with_semantics(inp, builder.WewSemantics)
+    parser = pratt_lang if pratt else lang
+    return parser.parse(text, semantics=semantics())
 
 
-def compile_source(inp: str) -> base.Compiler:
-    parsed = parse_source(inp)
+def parse_source(inp: str, pratt: bool = False) -> List[base.StatementObject]:
+    return parse_with_semantics(inp, builder.WewSemantics, pratt)
+
+
+def compile_source(inp: str, pratt: bool = False) -> base.Compiler:
+    parsed = parse_source(inp, pratt)
     compiler = base.Compiler()
     compiler.compile(parsed)
     return compiler
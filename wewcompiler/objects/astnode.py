@@ -6,6 +6,7 @@ import colorama
 from wewcompiler.utils import add_line_count, strip_newlines
 from wewcompiler.utils.formatter import format_lines
 from wewcompiler.objects.errors import CompileException, InternalCompileException
+from wewcompiler.parser.lines import line_table
 
 from tatsu.ast import AST
 from tatsu.infos import ParseInfo
@@ -65,11 +66,11 @@ class BaseObject:
         startl, endl = info.line, info.endline
         startp, endp = info.pos, info.endpos
 
-        source = info.buffer.get_lines()
+        lines = line_table(info.buffer)
         # startp and endp are offsets from the start
         # calculate their offsets from the line they are on.
-        startp = startp - sum(map(len, source[:startl]))
-        endp -= sum(map(len, source[:endl]))
+        startp -= lines.line_start(startl)
+        endp -= lines.line_start(endl)
 
         return startp + 1, endp
 
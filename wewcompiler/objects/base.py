@@ -3,14 +3,14 @@
 from contextlib import contextmanager
 from functools import wraps
 from itertools import accumulate
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 from tatsu.ast import AST
 
 from wewcompiler.objects import types
 from wewcompiler.objects.astnode import BaseObject
 from wewcompiler.objects.errors import CompileException, InternalCompileException
-from wewcompiler.objects.ir_object import Epilog, IRObject, Prelude, Register, Return
+from wewcompiler.objects.ir_object import Epilog, IRObject, JumpTarget, Prelude, Register, Return
 from wewcompiler.objects.variable import Variable, DataReference
 
 
@@ -162,6 +162,10 @@ class Scope(StatementObject, IdentifierScope):
     def vars(self) -> Dict[str, Variable]:
         return self._vars
 
+    def __repr__(self):
+        # scopes show up in the IR of preludes and epilogs, so don't use the address of the object
+        return f"<{self.__class__.__name__} {self.identifier}>"
+
     @with_ctx
     async def compile(self, ctx: 'CompileContext'):
         with ctx.scope(self):
@@ -277,7 +281,8 @@ class Compiler(IdentifierScope):
 
     __slots__ = ("data", "_vars", "compiled_objects",
                  "waiting_coros", "data_identifiers",
-                 "spill_size", "_objects", "unique_counter")
+                 "spill_size", "_objects", "unique_counter",
+                 "references")
 
     def __init__(self):
         self._vars: Dict[str, Variable] = {}
@@ -292,6 +297,10 @@ class Compiler(IdentifierScope):
         #: counter for generating unique identifiers
         self.unique_counter = 0
 
+        #: the global names each object looked up and the indexes of the data it added,
+        #: the code of an object depends on nothing else outside of it.
+        self.references: Dict[StatementObject, Set[Union[str, int]]] = {}
+
     @property
     def vars(self) -> Dict[str, Variable]:
         return self._vars
@@ -326,6 +335,11 @@ class Compiler(IdentifierScope):
     def own_variable(self, var: Variable):
         self.vars[var.name] = var
 
+        # wake up anything that was waiting on this name, they're resumed once the current object yields
+        to_wake = self.waiting_coros.pop(var.name, None)
+        if to_wake is not None:
+            self._objects.extend((o, var) for o in to_wake)
+
     def add_string(self, string: str) -> Variable:
         """Add a string to the object table.
 
@@ -408,30 +422,41 @@ class Compiler(IdentifierScope):
             coro = obj.compile(ctx)
             obj._coro = coro  # pylint: disable=protected-access
 
-        while True:
-            try:
-                r = coro.send(to_send)
-            except StopIteration:
-                return True
-
-            assert isinstance(r, ObjectRequest)
-            # look for either a global object or a scope variable.
-            var = ctx.lookup_variable(r.name)
-            if var is not None:
-                to_send = var
-                continue
-
-            # when looking in globals add to the namespace
-            name = fully_qualified_name(obj, r.name)
+        references = self.references.setdefault(obj, set())
+        if to_send is not None:
+            # we were woken up by the global we were waiting on
+            references.add(to_send.name)
 
-            var = self.lookup_variable(name)
-            if var is not None:
-                to_send = var
-                continue
+        data_start = len(self.data)
 
-            # if nothing was found place coro on waiting list and start compiling something else.
-            self.add_waiting(name, obj)
-            return False
+        try:
+            while True:
+                try:
+                    r = coro.send(to_send)
+                except StopIteration:
+                    return True
+
+                assert isinstance(r, ObjectRequest)
+                # look for either a global object or a scope variable.
+                var = ctx.lookup_variable(r.name)
+                if var is not None:
+                    to_send = var
+                    continue
+
+                # when looking in globals add to the namespace
+                name = fully_qualified_name(obj, r.name)
+
+                var = self.lookup_variable(name)
+                if var is not None:
+                    references.add(name)
+                    to_send = var
+                    continue
+
+                # if nothing was found place coro on waiting list and start compiling something else.
+                self.add_waiting(name, obj)
+                return False
+        finally:
+            references.update(range(data_start, len(self.data)))
 
     def compile(self, objects: Optional[List[StatementObject]] = None):
         """Compile a list of objects or restart compilation of any lasting objects."""
@@ -439,15 +464,8 @@ class Compiler(IdentifierScope):
             self._objects.extend((o, None) for o in objects)
         while self._objects:
             obj, to_send = self._objects.pop()
+            # objects waiting on a name are placed back on the compilation list by `own_variable`
             if self.run_over(obj, to_send):
-                # after completing a compilation, run over the waiting list,
-                # adding any objects that are satisfied back on to the compilation list
-                for name in tuple(self.waiting_coros.keys()):
-                    var = self.lookup_variable(name)
-                    if var is None:
-                        continue
-                    to_wake = self.waiting_coros.pop(name)
-                    self._objects.extend((o, var) for o in to_wake)
                 if not isinstance(obj, ModDecl):
                     self.compiled_objects.append(obj)
 
@@ -470,7 +488,8 @@ class CompileContext:
     """A compilation context. Once context exists for every file level code object."""
 
     __slots__ = ("scope_stack", "object_stack",
-                 "compiler", "code", "regs_used")
+                 "compiler", "code", "regs_used",
+                 "jump_targets", "cfg")
 
     def __init__(self, compiler: Compiler):
 
@@ -488,6 +507,12 @@ class CompileContext:
         #: Count of registers used
         self.regs_used = 0
 
+        #: Count of jump targets emitted
+        self.jump_targets = 0
+
+        #: The control flow graph of the code, built by the backend when it's needed
+        self.cfg = None
+
     @property
     def current_object(self) -> BaseObject:
         """Get the current object being compiled."""
@@ -589,5 +614,8 @@ class CompileContext:
     def emit(self, instr: IRObject):
         """Emit an IR instruction."""
         instr.parent = self.current_object
+        if isinstance(instr, JumpTarget):
+            instr.index = self.jump_targets
+            self.jump_targets += 1
         self.code.append(instr)
         return instr
@@ -1,9 +1,8 @@
 from enum import IntEnum
-from typing import Optional, Union, Iterable, List, Set, Any
-from dataclasses import dataclass, field
+from typing import Optional, Union, Iterable, List, Set, Any, Tuple
+from dataclasses import dataclass, field, fields
 
 from wewcompiler.objects.variable import Variable, DataReference
-from wewcompiler.objects.astnode import BaseObject
 
 class CompType(IntEnum):
     (uncond,  # unconditional (set to 1)
@@ -19,6 +18,24 @@ class CompType(IntEnum):
      gts) = range(11)  # greater than signed
 
 
+def slotted(cls):
+    """Rebuild a dataclass with slots for the fields it declares.
+
+    A class can't declare a slot for a field with a default, the default would be
+    a class attribute. The generated __init__ holds the defaults itself, so once the
+    dataclass is made they're removed and the class is made again with slots.
+    """
+    names = tuple(f.name for f in fields(cls) if f.name in cls.__dict__.get("__annotations__", {}))
+
+    namespace = dict(cls.__dict__)
+    for name in (*names, "__dict__", "__weakref__"):
+        namespace.pop(name, None)
+    namespace["__slots__"] = names
+
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@slotted
 @dataclass
 class AllocatedRegister:
     """References an allocated register."""
@@ -28,6 +45,7 @@ class AllocatedRegister:
     physical_register: Optional[int] = None
 
 
+@slotted
 @dataclass
 class Register:
     """A generic register for an infinite register machine."""
@@ -91,10 +109,6 @@ class Dereference:
     to: Union[Register, AllocatedRegister, Immediate, DataReference]
     size: int
 
-    def __post_init__(self):
-        if isinstance(self.to, Register):
-            self.to = self.to.copy()
-
     def __str__(self):
         return f"Dereference({self.to})"
 
@@ -111,43 +125,102 @@ def filter_reg(reg: IRParam) -> Optional[Register]:
     return None
 
 
-@dataclass
 class IRObject:
-    """An instruction in internal representation."""
+    """An instruction in internal representation.
+
+    Most instructions are never spilled around or close a register, so the lists of those
+    are only made when something is added to them. The registers an instruction touches
+    are found when first asked for, and again once one of the attributes holding them is set.
+    """
+
+    __slots__ = ("_pre_instructions", "_closing_registers", "_registers", "parent")
 
-    #: list of instructions to be run before this instruction
-    pre_instructions: List[Any] = field(default_factory=list, init=False, repr=False)
+    def __new__(cls, *args, **kwargs):  # pylint: disable=unused-argument
+        self = super().__new__(cls)
+        object.__setattr__(self, "_pre_instructions", None)
+        object.__setattr__(self, "_closing_registers", None)
+        object.__setattr__(self, "_registers", None)
+        object.__setattr__(self, "parent", None)
+        return self
 
-    #: regisers that are dead after this instruction
-    closing_registers: Set[Register] = field(default_factory=set, init=False, repr=False)
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self.touched_regs:
+            object.__setattr__(self, "_registers", None)
 
-    parent: Optional[BaseObject] = field(default=None, init=False, repr=False)
+    @property
+    def pre_instructions(self) -> List[Any]:
+        """Instructions to be run before this instruction, use insert_pre_instrs to add to them."""
+        return self._pre_instructions if self._pre_instructions is not None else []
 
-    def clone_regs(self):
-        """Clone the registers of this instruction.
-        This is so that they can be mutated without affecting other IR instructions."""
-        def copy_reg(arg):
-            if isinstance(arg, Register):
-                return arg.copy()
-            return arg
+    @pre_instructions.setter
+    def pre_instructions(self, instrs: List[Any]):
+        self._pre_instructions = list(instrs) or None
 
+    @property
+    def closing_registers(self) -> Set[Register]:
+        """Registers that are dead after this instruction."""
+        return self._closing_registers or frozenset()
+
+    @closing_registers.setter
+    def closing_registers(self, regs: Set[Register]):
+        self._closing_registers = set(regs) or None
+
+    def close_register(self, reg: Register):
+        """Mark a register as dead after this instruction."""
+        if self._closing_registers is None:
+            self._closing_registers = set()
+        self._closing_registers.add(reg)
+
+    def find_registers(self) -> Tuple[Tuple[Register, ...], Tuple[Register, ...], Tuple[Register, ...]]:
+        """Find the registers this instruction touches, reads from and writes to."""
+        touched, used, defined = [], [], []
         for attr in self.touched_regs:
-            # copy the instances of the registers we're using
-            setattr(self, attr, copy_reg(getattr(self, attr)))
+            arg = getattr(self, attr)
+            reg = filter_reg(arg)
+            if reg is None:
+                continue
+            touched.append(reg)
+            # a register being written to isn't read, a register being dereferenced to write to is
+            if attr in self.written_regs and isinstance(arg, Register):
+                defined.append(reg)
+            else:
+                used.append(reg)
+        return tuple(touched), tuple(used), tuple(defined)
 
     @property
     def touched_registers(self) -> Iterable[Register]:
         """Get the registers that this instruction reads from and writes to."""
-        attrs = self.touched_regs
-        regs = (filter_reg(getattr(self, i)) for i in attrs)
-        return list(filter(None, regs))
+        if self._registers is None:
+            object.__setattr__(self, "_registers", self.find_registers())
+        return self._registers[0]
+
+    @property
+    def used_registers(self) -> Iterable[Register]:
+        """Get the registers that this instruction reads from."""
+        if self._registers is None:
+            object.__setattr__(self, "_registers", self.find_registers())
+        return self._registers[1]
+
+    @property
+    def defined_registers(self) -> Iterable[Register]:
+        """Get the registers that this instruction writes to."""
+        if self._registers is None:
+            object.__setattr__(self, "_registers", self.find_registers())
+        return self._registers[2]
 
     touched_regs = ()
 
+    #: the attributes in touched_regs that are written to
+    written_regs = ()
+
     def insert_pre_instrs(self, *instrs):
-        self.pre_instructions.extend(instrs)
+        if self._pre_instructions is None:
+            self._pre_instructions = []
+        self._pre_instructions.extend(instrs)
 
 
+@slotted
 @dataclass
 class LoadVar(IRObject):
     """Load a variable to a location.
@@ -162,29 +235,29 @@ class LoadVar(IRObject):
     lvalue: bool = False
 
     touched_regs = ("to",)
+    written_regs = ("to",)
 
 
+@slotted
 @dataclass
 class SaveVar(IRObject):
 
-    __slots__ = ("variable", "from_")
-
     variable: Variable
     from_: IRParam
 
     touched_regs = ("from_",)
 
 
+@slotted
 @dataclass
 class Mov(IRObject):
     """More general than LoadVar/ SaveVar, for setting registers directly."""
 
-    __slots__ = ("to", "from_")
-
     to: IRParam
     from_: IRParam
 
     touched_regs = "to", "from_"
+    written_regs = ("to",)
 
 
 class UnaryMeta(type):
@@ -198,6 +271,7 @@ class UnaryMeta(type):
         raise AttributeError(f"Unary op has no sub-op {attr}")
 
 
+@slotted
 @dataclass
 class Unary(IRObject, metaclass=UnaryMeta):
     """Unary operation
@@ -216,6 +290,7 @@ class Unary(IRObject, metaclass=UnaryMeta):
     valid_ops = ("binv", "linv", "neg", "pos")
 
     touched_regs = ("arg", "to")
+    written_regs = ("to",)
 
 
 class BinaryMeta(type):
@@ -226,6 +301,7 @@ class BinaryMeta(type):
         raise AttributeError(f"Binary op has no sub-op {attr}")
 
 
+@slotted
 @dataclass
 class Binary(IRObject, metaclass=BinaryMeta):
     """Binary operation.
@@ -247,8 +323,10 @@ class Binary(IRObject, metaclass=BinaryMeta):
                  "imod", "umod")
 
     touched_regs = "left", "right", "to"
+    written_regs = ("to",)
 
 
+@slotted
 @dataclass
 class Compare(IRObject):
     """Comparison operation.
@@ -256,64 +334,60 @@ class Compare(IRObject):
     Compares two operands and sets resultant registers.
     """
 
-    __slots__ = ("left", "right")
-
     left: IRParam
     right: IRParam
 
     touched_regs = "left", "right"
 
 
+@slotted
 @dataclass
 class SetCmp(IRObject):
     """Set a location from the results of the last comparison."""
 
-    __slots__ = ("dest", "op")
-
     dest: IRParam
     op: CompType
 
     touched_regs = ("dest",)
+    written_regs = ("dest",)
 
 
+@slotted
 @dataclass
 class Push(IRObject):
 
-    __slots__ = ("arg",)
-
     arg: IRParam
 
     touched_regs = ("arg",)
 
 
+@slotted
 @dataclass
 class Pop(IRObject):
 
-    __slots__ = ("arg",)
-
     arg: IRParam
 
     touched_regs = ("arg",)
+    written_regs = ("arg",)
 
 
+@slotted
 @dataclass
 class Prelude(IRObject):
     """Function/ scope prelude."""
 
-    __slots__ = ("scope",)
-
     scope: Any
 
 
+@slotted
 @dataclass
 class Epilog(IRObject):
     """Function/ scope epilog."""
 
-    __slots__ = ("scope",)
-
     scope: Any
 
 
+@slotted
 @dataclass
 class Return(IRObject):
     """Function return
@@ -326,6 +400,7 @@ class Return(IRObject):
     touched_regs = ("arg",)
 
 
+@slotted
 @dataclass
 class Call(IRObject):
     """Call a procedure with arguments and possibly collect the result."""
@@ -339,8 +414,10 @@ class Call(IRObject):
         return sum(i.size for i in self.args)
 
     touched_regs = "jump", "result"
+    written_regs = ("result",)
 
 
+@slotted
 @dataclass
 class Jumpable(IRObject):
 
@@ -361,19 +438,28 @@ class Jumpable(IRObject):
         other.jumps_from = []
 
 
+@slotted
+@dataclass
 class JumpTarget(Jumpable):
-    """Jump target."""
+    """Jump target.
+
+    Jump targets are numbered in the order they are emitted, starting from zero in each context.
+    """
 
-    __slots__ = ()
+    index: Optional[int] = field(init=False)
+
+    def __post_init__(self):
+        self.index = None
 
     @property
     def identifier(self):
-        return f"jump-target-{id(self)}"
+        return f"jump-target-{self.index}"
 
     def __repr__(self):
         return f"{self.__class__.__name__}(identifier={self.identifier})"
 
 
+@slotted
 @dataclass
 class Jump(Jumpable):
     """Conditional jump.
@@ -391,31 +477,40 @@ class Jump(Jumpable):
     touched_regs = ("condition",)
 
 
+@slotted
 @dataclass
 class Resize(IRObject):
     """Resize data."""
 
-    __slots__ = ("from_", "to")
-
     from_: IRParam
     to: IRParam
 
     touched_regs = "from_", "to"
+    written_regs = ("to",)
 
 
+@slotted
 @dataclass
 class MachineInstr(IRObject):
     """Special machine instruction IR type to allow for inline ASM."""
 
-    __slots__ = ("instr", "size", "args")
-
     instr: str
     size: int
     args: List[IRParam]
 
+    # the arguments are a list that can be changed in place, so the registers touched aren't kept
+
     @property
     def touched_registers(self) -> Iterable[Register]:
         """Get the registers that this instruction reads from and writes to."""
+        return tuple(filter(None, map(filter_reg, self.args)))
 
-        regs = map(filter_reg, self.args)
-        return list(filter(None, regs))
+    # what an instruction does with it's arguments isn't known, so they're all treated as read
+
+    @property
+    def used_registers(self) -> Iterable[Register]:
+        return self.touched_registers
+
+    @property
+    def defined_registers(self) -> Iterable[Register]:
+        return ()
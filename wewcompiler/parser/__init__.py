@@ -1,13 +1,37 @@
 import os
 
+from wewcompiler.parser.lines import LineIndexed
+
 _lang = os.path.join(os.path.dirname(__file__), "lang.ebnf")
 
 with open(_lang) as f:
     language = f.read()
 
+#: Why the precedence climbing parser can't be used, None if it can.
+pratt_unavailable = None
+
 try:
-    from wewcompiler.parser.lang import WewParser
-    lang = WewParser()
+    from wewcompiler.parser.lang import WewBuffer, WewParser
+
+    class IndexedWewBuffer(LineIndexed, WewBuffer):
+        pass
+
+    lang = WewParser(buffer_class=IndexedWewBuffer)
 except ImportError:
     import tatsu
     lang = tatsu.compile(language)
+    # the precedence climbing parser extends the generated parser, so there isn't one without it
+    pratt_lang = None
+    pratt_unavailable = "it needs the generated parser, generate wewcompiler/parser/lang.py to use it"
+else:
+    try:
+        from wewcompiler.parser.pratt import PrattWewParser, missing_internals
+    except ImportError as e:
+        pratt_lang = None
+        pratt_unavailable = f"it can't import what it needs from the installed version of tatsu ({e})"
+    else:
+        pratt_lang = PrattWewParser(buffer_class=IndexedWewBuffer)
+        missing = missing_internals(pratt_lang)
+        if missing:
+            pratt_lang = None
+            pratt_unavailable = f"the installed version of tatsu is missing {', '.join(missing)}"
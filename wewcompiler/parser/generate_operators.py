@@ -41,4 +41,5 @@ def generate(op_table: Tuple[str, Tuple[str, ...]]):
     return "\n".join(result)
 
 
-print(generate(bin_ops))
+if __name__ == "__main__":
+    print(generate(bin_ops))
@@ -0,0 +1,50 @@
+"""Line offset index for parse buffers.
+
+Source positions in parse info are offsets from the start of the buffer, turning them
+into a column means knowing where their line starts. The table of line starts is built
+once per buffer so that lookups don't need to walk every preceding line.
+"""
+
+from bisect import bisect_right
+from itertools import accumulate
+from typing import List, Tuple
+
+from tatsu.buffering import Buffer
+
+
+class LineTable:
+    """Prefix sums of the line lengths of a buffer."""
+
+    __slots__ = ("starts",)
+
+    def __init__(self, lines: List[str]):
+        self.starts = [0, *accumulate(map(len, lines))]
+
+    def line_start(self, line: int) -> int:
+        """Get the offset the given line starts at."""
+        return self.starts[line]
+
+    def position(self, pos: int) -> Tuple[int, int]:
+        """Get the (line, column) of an offset."""
+        line = bisect_right(self.starts, pos, hi=len(self.starts) - 1) - 1
+        return line, pos - self.starts[line]
+
+
+def line_table(buffer: Buffer) -> LineTable:
+    """Get the line table of a buffer.
+
+    Buffers made by the wew parsers come with their table,
+    any other buffer gets one built on the first lookup.
+    """
+    table = getattr(buffer, "line_table", None)
+    if table is None:
+        table = buffer.line_table = LineTable(buffer.get_lines())
+    return table
+
+
+class LineIndexed:
+    """Buffer mixin that builds the line table when the source is loaded."""
+
+    def _preprocess(self, *args, **kwargs):
+        super()._preprocess(*args, **kwargs)
+        self.line_table = LineTable(self.get_lines())
@@ -0,0 +1,131 @@
+"""Precedence climbing parser for binary expressions.
+
+The generated parser descends through two rules per precedence level
+(``boolean_pre -> bitwise_pre -> ... -> multiply_pre -> unop_pre``) for every operand.
+This parser replaces that tower with a single loop over the operator table in
+:mod:`wewcompiler.parser.generate_operators`.
+
+Operands are still parsed with the generated ``unop_pre`` rule, and each level builds the
+same nodes (with the same parse info) as the generated rules, then hands them to the same
+semantic actions. So the semantics can't tell which parser was used.
+"""
+
+from typing import Optional, Tuple
+
+from tatsu.ast import AST
+from tatsu.contexts import tatsumasu
+from tatsu.exceptions import FailedCut, FailedParse
+from tatsu.infos import RuleInfo
+
+from wewcompiler.parser.generate_operators import bin_ops
+from wewcompiler.parser.lang import WewParser
+
+
+#: The parts of tatsu's parser context used here that aren't part of tatsu's interface,
+#: which may change or go between versions of tatsu.
+tatsu_internals = ("_next_token", "_buffer", "_goto", "_cut", "_cut_stack", "_get_parseinfo", "_invoke_semantic_rule")
+
+
+def missing_internals(parser: WewParser) -> Tuple[str, ...]:
+    """Find the parts of tatsu's parser context this parser needs that a parser is missing."""
+    return tuple(name for name in tatsu_internals if not hasattr(parser, name))
+
+
+def build_operator_table(op_table) -> Tuple[Tuple[str, Tuple[str, int, str]], ...]:
+    """Flatten an operator table into (token, (rule name, precedence, associativity)) pairs.
+
+    Longer tokens are placed first so that '<<' is never matched as '<'.
+    """
+    operators = [(op, (name, precedence, assoc))
+                 for precedence, (name, ops, assoc) in enumerate(op_table)
+                 for op in ops]
+    return tuple(sorted(operators, key=lambda i: -len(i[0])))
+
+
+class PrattWewParser(WewParser):
+    """Wew parser that parses binary expressions by precedence climbing."""
+
+    operators = build_operator_table(bin_ops)
+
+    @tatsumasu()
+    def _boolean_pre_(self):  # noqa
+        self.last_node = self._climb(0)
+        self.name_last_node('@')
+
+    def _operator(self) -> Optional[Tuple[int, str, Tuple[str, int, str]]]:
+        """Match a binary operator.
+
+        :returns: The position the operator starts at, the operator and it's table entry.
+                  None if no operator matched.
+        """
+        self._next_token()
+        pos = self._pos
+        for op, entry in self.operators:
+            if self._buffer.match(op) is not None:
+                return pos, op, entry
+        return None
+
+    def _build(self, name: str, pos: int, **fields):
+        """Build the node a generated rule would have built and run it's semantic action."""
+        node = AST(**fields)
+        if self.parseinfo:
+            node.set_parseinfo(self._get_parseinfo(name, pos))
+        # the fields of rule info differ between versions of tatsu, only the name is needed
+        rule = RuleInfo(**{**dict.fromkeys(RuleInfo._fields), "name": name})
+        return self._invoke_semantic_rule(rule, node)
+
+    def _climb(self, min_precedence: int):
+        """Parse an expression containing no operators of lower precedence than `min_precedence`."""
+        self._next_token()
+        start = self._pos
+
+        self._unop_pre_()
+        left = self.last_node
+
+        while True:
+            before = self._pos
+            matched = self._operator()
+            if matched is None or matched[2][1] < min_precedence:
+                self._goto(before)
+                return left
+
+            op_pos, op, (name, precedence, assoc) = matched
+
+            if assoc == ">":
+                # right associative levels commit after the operator, like the cut in the grammar.
+                # the cut is made in it's own frame so that it doesn't leak into an enclosing option,
+                # it's still needed as cutting is what drops memos behind the current position.
+                self._cut_stack.append(False)
+                try:
+                    self._cut()
+                    right = self._climb(precedence)
+                except FailedParse as e:
+                    raise FailedCut(e)
+                finally:
+                    self._cut_stack.pop()
+                left = self._build(name, start, left=left, op=op, right=right)
+                continue
+
+            # gather every operator of this level, the semantics fold them to the left
+            rest = []
+            while True:
+                try:
+                    right = self._climb(precedence + 1)
+                except FailedParse:
+                    # the generated rules backtrack to before the operator here
+                    self._goto(before)
+                    break
+
+                rest.append(self._build(f"{name}_rep", op_pos, op=op, right=right))
+
+                before = self._pos
+                matched = self._operator()
+                if matched is None or matched[2][1] != precedence:
+                    self._goto(before)
+                    break
+                op_pos, op, _ = matched
+
+            if not rest:
+                return left
+
+            left = self._build(name, start, left=left, rest=rest)
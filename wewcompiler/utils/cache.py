@@ -0,0 +1,125 @@
+"""On-disk cache for compiler artifacts."""
+
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Optional
+
+import tatsu
+
+from wewcompiler import __version__
+
+
+def default_cache_dir() -> str:
+    """Get the default location of the artifact cache."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "wewcompiler")
+
+
+#: The files of the compiler that what it caches depends on.
+source_suffixes = (".py", ".ebnf", ".wew")
+
+
+@lru_cache(maxsize=None)
+def compiler_fingerprint() -> bytes:
+    """Hash the sources of the compiler.
+
+    Cached artifacts are made by the code of the compiler, the version isn't bumped
+    when that changes, so the code itself is hashed.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    digest = hashlib.sha256()
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith(source_suffixes):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, "rb") as f:
+                source = f.read()
+            for part in (os.path.relpath(path, root).replace(os.sep, "/").encode(), source):
+                digest.update(len(part).to_bytes(8, "little"))
+                digest.update(part)
+
+    return digest.digest()
+
+
+def cache_key(*parts: bytes) -> str:
+    """Make a key from some content.
+
+    The compiler's version and sources and the parser's version are mixed in so that
+    changing any of them invalidates anything cached by another compiler.
+    """
+    digest = hashlib.sha256()
+    for part in (__version__.encode(), compiler_fingerprint(), tatsu.__version__.encode(), *parts):
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """A directory of pickled artifacts, grouped by kind and addressed by key.
+
+    The number of hits and misses of each kind of artifact are counted in :attr:`hits` and :attr:`misses`,
+    and the number of artifacts that couldn't be written in :attr:`skipped`.
+    """
+
+    __slots__ = ("directory", "hits", "misses", "skipped")
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or default_cache_dir()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.skipped = Counter()
+
+    def path_for(self, kind: str, key: str) -> str:
+        return os.path.join(self.directory, kind, f"{key}.pickle")
+
+    def load(self, kind: str, key: str) -> Optional[Any]:
+        """Load an artifact, returns None if it isn't cached."""
+        try:
+            with open(self.path_for(kind, key), "rb") as f:
+                obj = pickle.load(f)
+        except FileNotFoundError:
+            obj = None
+        except Exception:  # pylint: disable=broad-except
+            # a corrupt or stale entry is just a cache miss, it'll be overwritten.
+            obj = None
+
+        (self.misses if obj is None else self.hits)[kind] += 1
+        return obj
+
+    def store(self, kind: str, key: str, obj: Any):
+        """Store an artifact.
+
+        The entry is written to a temporary file and moved into place so that
+        concurrent compiles never see a partially written entry.
+        An entry that can't be written, as the cache directory can't be created
+        or is read only or full, is skipped, the cache never fails a compile.
+        """
+        path = self.path_for(kind, key)
+        directory = os.path.dirname(path)
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        except OSError:
+            self.skipped[kind] += 1
+            return
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException as e:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            if not isinstance(e, OSError):
+                raise
+            self.skipped[kind] += 1